@@ -2,6 +2,9 @@ from flask import Flask
 from .extensions import db, migrate, jwt, cors
 from .config import Config
 from .routes import register_routes
+from .commands import register_commands
+from . import admins, audit, cache, duplicates, metrics, notifications, profiling, ratelimit, sharding, tokens
+from .encoding import flask_after_request
 
 def create_app():
     app = Flask(__name__)
@@ -10,5 +13,25 @@ def create_app():
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    ratelimit.configure(app.config)
+    admins.configure(app.config)
+    metrics.configure(app.config)
+    audit.configure(app.config)
+    cache.configure(app.config)
+    duplicates.configure(app.config)
+    notifications.configure(app.config)
+    profiling.configure(app.config)
+    sharding.configure(app.config)
+    tokens.configure(app.config)
+    jwt.token_in_blocklist_loader(lambda header, claims: tokens.is_revoked(claims, db.engine))
     register_routes(app)
+    register_commands(app)
+    app.before_request(profiling.flask_before_request)
+    app.teardown_request(profiling.flask_teardown_request)
+    app.after_request(profiling.flask_after_request)
+    app.after_request(flask_after_request)
+    if app.config["SCHEDULER_ENABLED"]:
+        from .jobs import Scheduler
+        scheduler = app.extensions["scheduler"] = Scheduler(app)
+        app.before_request(scheduler.start)  # per serving process, never in a preloading master
     return app
@@ -0,0 +1,24 @@
+"""Operator accounts, listed by user id in ``ADMIN_USER_IDS``.
+
+Any visitor can register as a property manager, so a role alone cannot gate
+operator-only tools (profiling, revoking other users' tokens). Admins are the
+users whose ids the deployment lists; nothing a user does through the API can
+add them. With the list empty, nobody is an admin.
+"""
+settings = {"ADMIN_USER_IDS": frozenset()}
+
+
+def parse_ids(value):
+    """``"1, 7"`` -> frozenset({1, 7})."""
+    if isinstance(value, str):
+        value = [part for part in value.replace(" ", "").split(",") if part]
+    return frozenset(int(part) for part in value or ())
+
+
+def configure(config):
+    """Apply ADMIN_USER_IDS; called from create_app and the FastAPI module."""
+    settings["ADMIN_USER_IDS"] = parse_ids(config.get("ADMIN_USER_IDS"))
+
+
+def is_admin(identity):
+    return isinstance(identity, dict) and identity.get("id") in settings["ADMIN_USER_IDS"]
@@ -0,0 +1,106 @@
+"""Offline scan of the whole payment history (hot table and archive) for anomalous patterns.
+
+Run with ``flask scan-payments``. The scan reports three kinds of finding:
+
+* ``amount_mismatch``: the completed payments of a lease in one calendar month
+  add up to something other than the unit's ``rent_amount``.
+* ``burst``: ``burst_count`` or more initiations on one lease within
+  ``burst_seconds``. Each maximal run is reported once.
+* ``double_charge``: two completed payments of the same amount on one lease
+  within ``duplicate_seconds``.
+
+The monthly totals are summed by a grouped query in the database. Bursts and
+double charges come from one streaming pass over the history, ordered by lease
+and time, that holds only the current lease's window in memory.
+"""
+from collections import deque, namedtuple
+
+from sqlalchemy import func, inspect, select, union_all
+
+from .models import Lease, Payment, PaymentArchive, Unit
+
+KINDS = ("amount_mismatch", "burst", "double_charge")
+
+# payment_ids is empty for amount_mismatch, which is about a month's total
+Finding = namedtuple("Finding", "kind lease_id payment_ids detail")
+
+
+def _history(since=None):
+    """payments and payments_archive as one subquery of (id, lease_id, created_at, amount, status)."""
+    selects = [select(m.id, m.lease_id, m.created_at, m.amount, m.status) for m in (Payment, PaymentArchive)]
+    if since is not None:
+        selects = [s.where(m.created_at >= since) for s, m in zip(selects, (Payment, PaymentArchive))]
+    return union_all(*selects).subquery("history")
+
+
+def _month(column, dialect):
+    if dialect == "sqlite":
+        return func.strftime("%Y-%m", column)
+    return func.date_format(column, "%Y-%m")
+
+
+def amount_mismatches(session, since=None):
+    """Lease-months whose completed payments do not add up to the unit's rent."""
+    history = _history(since)
+    month = _month(history.c.created_at, session.get_bind(mapper=inspect(Payment)).dialect.name)
+    paid = func.sum(history.c.amount)
+    stmt = (
+        select(history.c.lease_id, month.label("month"), paid.label("paid"), func.count().label("payments"),
+               Unit.rent_amount)
+        .join(Lease, Lease.id == history.c.lease_id).join(Unit, Unit.id == Lease.unit_id)
+        .where(history.c.status == "completed")
+        .group_by(history.c.lease_id, month, Unit.rent_amount)
+        .having(paid != Unit.rent_amount)
+        .order_by(history.c.lease_id, month)
+    )
+    for row in session.execute(stmt):
+        yield Finding("amount_mismatch", row.lease_id, (), {
+            "month": row.month, "paid": row.paid, "rent": row.rent_amount, "payments": row.payments,
+            "difference": row.paid - row.rent_amount})
+
+
+def _burst(lease_id, rows):
+    return Finding("burst", lease_id, tuple(r.id for r in rows), {
+        "count": len(rows), "first": rows[0].created_at.isoformat(timespec="seconds"),
+        "last": rows[-1].created_at.isoformat(timespec="seconds")})
+
+
+def scan_stream(rows, burst_count=3, burst_seconds=600, duplicate_seconds=3600):
+    """Bursts and double charges from rows ordered by (lease_id, created_at, id)."""
+    lease_id, window, run, last_completed = None, deque(), None, {}
+    for row in rows:
+        if row.created_at is None:
+            continue
+        if row.lease_id != lease_id:
+            if run:
+                yield _burst(lease_id, run)
+            lease_id, run, last_completed = row.lease_id, None, {}
+            window.clear()
+        window.append(row)
+        while (row.created_at - window[0].created_at).total_seconds() > burst_seconds:
+            window.popleft()
+        if len(window) >= burst_count:
+            if run is None:
+                run = list(window)
+            else:
+                run.append(row)
+        elif run:
+            yield _burst(lease_id, run)
+            run = None
+        if row.status == "completed":
+            previous = last_completed.get(row.amount)
+            if previous is not None and (row.created_at - previous.created_at).total_seconds() <= duplicate_seconds:
+                yield Finding("double_charge", lease_id, (previous.id, row.id), {
+                    "amount": row.amount, "seconds": int((row.created_at - previous.created_at).total_seconds())})
+            last_completed[row.amount] = row
+    if run:
+        yield _burst(lease_id, run)
+
+
+def scan(session, since=None, burst_count=3, burst_seconds=600, duplicate_seconds=3600, batch_size=5000):
+    """Every finding in the history visible to ``session``, amount mismatches first."""
+    yield from amount_mismatches(session, since)
+    history = _history(since)
+    rows = session.execute(select(history).order_by(history.c.lease_id, history.c.created_at, history.c.id)
+                           .execution_options(yield_per=batch_size))
+    yield from scan_stream(rows, burst_count, burst_seconds, duplicate_seconds)
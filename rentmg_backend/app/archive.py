@@ -0,0 +1,87 @@
+"""Hot/cold split of the payments table.
+
+``payments`` keeps the current and the previous ``PAYMENT_ARCHIVE_KEEP_YEARS``
+years, plus anything still pending. The ``archive_payments`` job moves settled
+payments from closed years into ``payments_archive`` a batch at a time. That
+table has the same ids and columns, no foreign keys, and compressed rows on
+MySQL. MySQL range partitioning was not an option: InnoDB does not allow
+partitioned tables to take part in foreign keys, and ``payments.lease_id``
+needs one.
+
+Reads prune at the boundary: history only touches the archive when the
+requested range starts before the boundary, or when the caller asks for
+archived rows explicitly. A history request with no ``from`` therefore
+leaves archived payments out unless ``include_archived`` is set. Results
+from both tables are merged newest first. Single payments, receipts and
+statements (app/statements.py) read the archive too.
+"""
+import heapq
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import delete, insert, select
+
+from .models import Payment, PaymentArchive
+from .rows import fetch, select_rows
+from .scoping import apply_scope
+
+SETTLED_STATUSES = ("completed", "failed")
+
+
+def archive_boundary(config, today=None):
+    """First day still kept hot: 1 January of the oldest year not yet closed for archiving."""
+    today = today or date.today()
+    return datetime(today.year - config.get("PAYMENT_ARCHIVE_KEEP_YEARS", 1), 1, 1)
+
+
+def archive_payments(session, config, now):
+    """Move settled payments created before the boundary into payments_archive."""
+    hot, cold = Payment.__table__, PaymentArchive.__table__
+    columns = [c.name for c in cold.c]
+    stmt = select(Payment.id).where(
+        Payment.created_at < archive_boundary(config, now.date()), Payment.status.in_(SETTLED_STATUSES),
+    ).order_by(Payment.id).limit(config["JOB_BATCH_SIZE"])
+    moved = 0
+    while True:
+        ids = session.execute(stmt).scalars().all()
+        if not ids:
+            return moved
+        session.execute(insert(cold).from_select(columns, select(*(hot.c[n] for n in columns)).where(hot.c.id.in_(ids))))
+        session.execute(delete(hot).where(hot.c.id.in_(ids)))
+        session.commit()
+        moved += len(ids)
+
+
+def parse_history_range(start=None, end=None):
+    """``?from=`` / ``?to=`` ISO dates (both inclusive) as a half-open datetime range."""
+    start = datetime.combine(date.fromisoformat(start), time.min) if start else None
+    end = datetime.combine(date.fromisoformat(end) + timedelta(days=1), time.min) if end else None
+    return start, end
+
+
+def payment_history(session, scope, config, lease_id=None, start=None, end=None, include_archived=False):
+    """Payments visible to ``scope`` as read-only rows, newest first; the archive is read only when the range needs it."""
+    models = [Payment]
+    if include_archived or (start is not None and start < archive_boundary(config)):
+        models.append(PaymentArchive)
+    results = []
+    for model in models:
+        q = apply_scope(select_rows(model), model, scope)
+        if lease_id:
+            q = q.filter(model.lease_id == lease_id)
+        if start is not None:
+            q = q.filter(model.created_at >= start)
+        if end is not None:
+            q = q.filter(model.created_at < end)
+        results.append(fetch(session, q.order_by(model.created_at.desc()), model))
+    if len(results) == 1:
+        return results[0]
+    return list(heapq.merge(*results, key=lambda p: p.created_at or datetime.min, reverse=True))
+
+
+def find_payment(session, scope, payment_id):
+    """A payment by id from the hot table, falling back to the archive."""
+    for model in (Payment, PaymentArchive):
+        payment = apply_scope(session.query(model), model, scope).filter(model.id == payment_id).first()
+        if payment is not None:
+            return payment
+    return None
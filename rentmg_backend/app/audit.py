@@ -0,0 +1,263 @@
+"""Append-only audit log of every committed model change.
+
+Capture happens in session events and only copies values that SQLAlchemy
+already holds in memory:
+
+* ``after_flush`` records inserts (all columns), updates (changed columns as
+  ``[old, new]``) and deletes for ORM objects.
+* ``do_orm_execute`` records bulk ``update(Model)`` / ``delete(Model)``
+  statements such as the ones the background jobs issue. It resolves the
+  affected ids with one SELECT on the statement's WHERE clause.
+
+Events wait in ``session.info`` until the transaction commits, and are dropped
+on rollback. They are then handed to a background thread, which JSON-encodes
+them and inserts them into ``audit_events`` in batches of ``AUDIT_BATCH_SIZE``
+at least every ``AUDIT_FLUSH_INTERVAL`` seconds. The request only pays for a
+list append.
+
+The queue is bounded (``AUDIT_QUEUE_MAX``). Overflow and write failures are
+dropped and counted as ``audit.dropped`` on ``/metrics`` rather than slowing
+requests down.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .models import AuditEvent, Issue, JobState, Lease, Payment, Property, RevokedToken, Unit
+from .scoping import apply_scope
+
+log = logging.getLogger(__name__)
+
+EXCLUDED_TABLES = {AuditEvent.__tablename__, JobState.__tablename__, RevokedToken.__tablename__}
+REDACTED_COLUMNS = {"password_hash"}
+
+settings = {"AUDIT_ENABLED": True, "AUDIT_BATCH_SIZE": 500, "AUDIT_FLUSH_INTERVAL": 1.0, "AUDIT_QUEUE_MAX": 100_000}
+
+
+def configure(config):
+    """Apply AUDIT_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+
+
+def _value(column, value):
+    return "***" if column in REDACTED_COLUMNS else value
+
+
+def request_identity(session):
+    """Identity (``{"id", "role"}``) of the user behind the current request, if any."""
+    request_scope = session.info.get("request_scope")
+    if request_scope is not None:  # FastAPI: get_identity leaves the identity in the ASGI scope
+        return request_scope.get("rentmg.identity")
+    from flask import has_request_context
+
+    if has_request_context():
+        from flask_jwt_extended import get_jwt_identity
+
+        try:
+            return get_jwt_identity()
+        except RuntimeError:  # route without @jwt_required
+            return None
+    return None
+
+
+def _actor(session):
+    """Id of the user behind the current request, if any."""
+    identity = request_identity(session)
+    return identity["id"] if identity else None
+
+
+def _pending(session):
+    return session.info.setdefault("audit_events", [])
+
+
+@event.listens_for(Session, "after_flush")
+def _capture_flush(session, flush_context):
+    if not settings["AUDIT_ENABLED"]:
+        return
+    now = datetime.utcnow()
+    events = _pending(session)
+    for action, objects in (("I", session.new), ("U", session.dirty), ("D", session.deleted)):
+        for obj in objects:
+            state = inspect(obj)
+            table = state.mapper.local_table.name
+            if table in EXCLUDED_TABLES:
+                continue
+            if action == "I":
+                changes = {key: _value(key, value) for key, value in state.dict.items()
+                           if key in state.mapper.columns and value is not None}
+            elif action == "U":
+                changes = {}
+                for attr in state.attrs:
+                    if attr.key not in state.mapper.columns:
+                        continue
+                    history = attr.history
+                    if history.added or history.deleted:
+                        old = history.deleted[0] if history.deleted else None
+                        new = history.added[0] if history.added else None
+                        changes[attr.key] = [_value(attr.key, old), _value(attr.key, new)]
+                if not changes:
+                    continue
+            else:
+                changes = None
+            entity_id = state.mapper.primary_key_from_instance(obj)[0]
+            events.append((now, table, entity_id, action, changes))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _capture_bulk(orm_execute_state):
+    if not settings["AUDIT_ENABLED"] or not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.local_table.name in EXCLUDED_TABLES:
+        return
+    statement = orm_execute_state.statement
+    session = orm_execute_state.session
+    ids_stmt = select(*mapper.primary_key)
+    if statement.whereclause is not None:
+        ids_stmt = ids_stmt.where(statement.whereclause)
+    ids = session.execute(ids_stmt).scalars().all()
+    if not ids:
+        return
+    changes = None
+    if orm_execute_state.is_update:
+        params = statement.compile().params
+        changes = {key: [None, _value(key, params[key])] for key in mapper.local_table.c.keys() if key in params}
+    now = datetime.utcnow()
+    action = "U" if orm_execute_state.is_update else "D"
+    _pending(session).extend((now, mapper.local_table.name, entity_id, action, changes) for entity_id in ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    events = session.info.pop("audit_events", None)
+    if events:
+        writer.submit(session.get_bind(), _actor(session), events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("audit_events", None)
+
+
+class AuditWriter:
+    """Background thread batching audit rows into ``audit_events``."""
+
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # After a fork (gunicorn preload) the parent's thread does not exist in the child
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=settings["AUDIT_QUEUE_MAX"])
+            threading.Thread(target=self._run, name="audit-writer", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, engine, actor_id, events):
+        self._ensure_started()
+        for at, entity, entity_id, action, changes in events:
+            try:
+                self._queue.put_nowait((engine, (at, actor_id, entity, entity_id, action, changes)))
+            except queue.Full:
+                metrics.incr("audit.dropped")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + settings["AUDIT_FLUSH_INTERVAL"]
+            while len(batch) < settings["AUDIT_BATCH_SIZE"]:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        by_engine = {}
+        for engine, (at, actor_id, entity, entity_id, action, changes) in batch:
+            by_engine.setdefault(engine, []).append({
+                "at": at, "actor_id": actor_id, "entity": entity, "entity_id": entity_id, "action": action,
+                "changes": None if changes is None else json.dumps(changes, separators=(",", ":"), default=str),
+            })
+        for engine, rows in by_engine.items():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(AuditEvent.__table__), rows)
+                metrics.incr("audit.written", len(rows))
+            except Exception:
+                log.exception("dropping %d audit events", len(rows))
+                metrics.incr("audit.dropped", len(rows))
+
+    def flush(self, timeout=5.0):
+        """Block until queued events are written (tests, shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._pid == os.getpid() and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def query_events(session, since=None, until=None, entity=None, entity_id=None, actor_id=None,
+                 after_id=None, limit=100):
+    """Audit rows in write order, filtered by time range and keyset-paginated on ``id``."""
+    stmt = select(AuditEvent)
+    if since is not None:
+        stmt = stmt.where(AuditEvent.at >= since)
+    if until is not None:
+        stmt = stmt.where(AuditEvent.at < until)
+    if entity:
+        stmt = stmt.where(AuditEvent.entity == entity)
+    if entity_id is not None:
+        stmt = stmt.where(AuditEvent.entity_id == entity_id)
+    if actor_id is not None:
+        stmt = stmt.where(AuditEvent.actor_id == actor_id)
+    if after_id is not None:
+        stmt = stmt.where(AuditEvent.id > after_id)
+    return [
+        {
+            "id": e.id,
+            "at": e.at.isoformat(timespec="microseconds"),
+            "actor_id": e.actor_id,
+            "entity": e.entity,
+            "entity_id": e.entity_id,
+            "action": e.action,
+            "changes": json.loads(e.changes) if e.changes else None,
+        }
+        for e in session.execute(stmt.order_by(AuditEvent.id).limit(limit)).scalars()
+    ]
+
+
+def can_read(session, scope, entity=None, entity_id=None):
+    """Whether ``scope`` may read the audit trail asked for.
+
+    Property managers read everything. Tenants and landlords may only read the
+    history of a single row they can see: a lease, payment or issue (and, for
+    landlords, a property or unit).
+    """
+    if not (scope.is_tenant or scope.is_landlord):
+        return True
+    models = (Lease, Payment, Issue) if scope.is_tenant else (Property, Unit, Lease, Payment, Issue)
+    model = next((m for m in models if m.__tablename__ == entity), None)
+    if model is None or entity_id is None:
+        return False
+    stmt = apply_scope(select(model.id).where(model.id == entity_id), model, scope)
+    return session.execute(stmt).first() is not None
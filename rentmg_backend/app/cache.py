@@ -0,0 +1,284 @@
+"""Read-through identity cache for small, hot rows (users and properties).
+
+Entries are column snapshots keyed by ``(table, primary key)``, held in an
+in-process LRU with a TTL. A hit rebuilds the row in the caller's session with
+``merge(load=False)``, so no SELECT is issued. Once it sits in the identity
+map, many-to-one lazy loads such as ``user.linked_property`` resolve from the
+map too. Lookups by a natural key (``users.email``,
+``properties.name_normalized``) cache the matching ids, and each id then goes
+through the same read-through path. Empty results are never cached.
+
+Invalidation follows the audit log's pattern. ``after_flush`` notes which
+cached rows and natural keys changed, including the old values of renamed
+keys, and ``after_commit`` drops them. Bulk ``update()`` / ``delete()`` on a
+cached table clears that whole table. Each commit also publishes the dropped
+keys on a bus so other workers can drop their copies. The default
+:class:`LocalBus` is an in-process stand-in. Setting ``ENTITY_CACHE_BUS_URL``
+to a Redis URL fans invalidations out across workers. The TTL bounds
+staleness from anything the events cannot see, such as raw SQL or another
+service writing to the database.
+
+Hits, misses, evictions, invalidations and the entry count are reported as
+``cache.*`` on ``/metrics``.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from . import metrics
+from .models import Property, User
+
+# table -> natural-key columns whose lookups are cached
+NATURAL_KEYS = {User.__tablename__: ("email",), Property.__tablename__: ("name_normalized",)}
+MODELS = {User.__tablename__: User, Property.__tablename__: Property}
+
+settings = {"ENTITY_CACHE_ENABLED": True, "ENTITY_CACHE_TTL": 60, "ENTITY_CACHE_MAX": 10_000,
+            "ENTITY_CACHE_BUS_URL": None}
+
+
+class LocalBus:
+    """In-process stand-in for a pub/sub channel: publish calls every subscriber synchronously."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, keys):
+        for callback in self._subscribers:
+            callback(keys)
+
+
+class RedisBus:
+    """Invalidations shared across workers over Redis pub/sub; needs the optional ``redis`` package."""
+
+    CHANNEL = "rentmg:cache:invalidate"
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("ENTITY_CACHE_BUS_URL requires the 'redis' package") from exc
+        self._client = redis.Redis.from_url(url)
+        self._origin = uuid.uuid4().hex
+        self._subscribers = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listening(self):
+        # The listener thread does not survive a fork (gunicorn preload), so start it per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._origin = uuid.uuid4().hex
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.CHANNEL: self._receive})
+            pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            self._pid = os.getpid()
+
+    def _receive(self, message):
+        payload = json.loads(message["data"])
+        if payload["origin"] != self._origin:
+            keys = [tuple(key) for key in payload["keys"]]
+            for callback in self._subscribers:
+                callback(keys)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, keys):
+        self._ensure_listening()
+        # Local subscribers first; the network copy is for the other workers
+        for callback in self._subscribers:
+            callback(keys)
+        self._client.publish(self.CHANNEL, json.dumps({"origin": self._origin, "keys": keys}, default=str))
+
+
+class EntityCache:
+    """Bounded LRU of column snapshots with a per-entry TTL."""
+
+    def __init__(self, max_entries=10_000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            if hit[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return hit[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr("cache.evicted")
+            size = len(self._entries)
+        metrics.gauge("cache.entries", size)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                if len(key) == 1:  # whole table
+                    for k in [k for k in self._entries if k[0] == key[0]]:
+                        del self._entries[k]
+                else:
+                    self._entries.pop(key, None)
+        metrics.incr("cache.invalidated", len(keys))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = EntityCache()
+bus = LocalBus()
+bus.subscribe(cache.invalidate)
+_subscribers = [cache.invalidate]  # re-attached when configure swaps in a RedisBus
+
+
+def subscribe(callback):
+    """Also call ``callback(keys)`` for every invalidation, this worker's and (over Redis) the others'."""
+    _subscribers.append(callback)
+    bus.subscribe(callback)
+
+
+def publish(keys):
+    """Broadcast invalidation ``keys`` outside a commit (e.g. compiled scopes, see app/scoping.py)."""
+    bus.publish(keys)
+
+
+def configure(config):
+    """Apply ENTITY_CACHE_* settings; called from create_app and the FastAPI module."""
+    global bus
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+    cache.max_entries = settings["ENTITY_CACHE_MAX"]
+    cache.ttl = settings["ENTITY_CACHE_TTL"]
+    if settings["ENTITY_CACHE_BUS_URL"] and not isinstance(bus, RedisBus):
+        bus = RedisBus(settings["ENTITY_CACHE_BUS_URL"])
+        for callback in _subscribers:
+            bus.subscribe(callback)
+
+
+def _snapshot(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def _cacheable(session, obj):
+    """Only committed state is shared: skip rows changed (flushed or not) in this transaction."""
+    state = inspect(obj)
+    key = (state.mapper.local_table.name, state.identity[0])
+    return not state.modified and key not in session.info.get("cache_invalidations", ())
+
+
+def _attach(session, model, snapshot):
+    """Put a cached row into ``session`` as a clean persistent instance, without a SELECT."""
+    obj = model(**snapshot)
+    make_transient_to_detached(obj)
+    return session.merge(obj, load=False)
+
+
+def get(session, model, pk):
+    """``session.get(model, pk)`` served from the cache when possible."""
+    if pk is None:
+        return None
+    if not settings["ENTITY_CACHE_ENABLED"]:
+        return session.get(model, pk)
+    table = model.__tablename__
+    snapshot = cache.get((table, pk))
+    if snapshot is not None:
+        metrics.incr(f"cache.hit.{table}")
+        # A copy already in this session wins: it may hold this transaction's changes
+        existing = session.identity_map.get(inspect(model).identity_key_from_primary_key((pk,)))
+        return existing if existing is not None else _attach(session, model, snapshot)
+    metrics.incr(f"cache.miss.{table}")
+    obj = session.get(model, pk)
+    if obj is not None and _cacheable(session, obj):
+        cache.put((table, pk), _snapshot(obj))
+    return obj
+
+
+def find(session, model, column, value, limit=2):
+    """Rows whose natural-key ``column`` equals ``value`` (at most ``limit``), through the cache."""
+    table = model.__tablename__
+    if not settings["ENTITY_CACHE_ENABLED"]:
+        return session.query(model).filter(getattr(model, column) == value).limit(limit).all()
+    ids = cache.get((table, column, value))
+    if ids is not None:
+        metrics.incr(f"cache.hit.{table}.{column}")
+        return [row for row in (get(session, model, pk) for pk in ids) if row is not None]
+    metrics.incr(f"cache.miss.{table}.{column}")
+    rows = session.query(model).filter(getattr(model, column) == value).limit(limit).all()
+    # Only exact matches are cached, so a case-insensitive collation cannot leave stale aliases behind
+    if rows and all(_cacheable(session, row) and getattr(row, column) == value for row in rows) \
+            and (table, column, value) not in session.info.get("cache_invalidations", ()):
+        cache.put((table, column, value), tuple(row.id for row in rows))
+        for row in rows:
+            cache.put((table, row.id), _snapshot(row))
+    return rows
+
+
+def _pending(session):
+    return session.info.setdefault("cache_invalidations", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    keys = None
+    dirty = session.dirty
+    for obj in (*session.new, *dirty, *session.deleted):
+        state = inspect(obj)
+        table = state.mapper.local_table.name
+        if table not in MODELS:
+            continue
+        if obj in dirty and not any(state.attrs[a.key].history.has_changes() for a in state.mapper.column_attrs):
+            continue  # only a relationship/backref collection changed
+        keys = keys if keys is not None else _pending(session)
+        keys.add((table, state.mapper.primary_key_from_instance(obj)[0]))
+        for column in NATURAL_KEYS[table]:
+            history = state.attrs[column].history
+            for value in (*history.added, *history.unchanged, *history.deleted):
+                keys.add((table, column, value))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.local_table.name in MODELS:
+        _pending(orm_execute_state.session).add((mapper.local_table.name,))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    keys = session.info.pop("cache_invalidations", None)
+    if keys:
+        bus.publish(sorted(keys, key=repr))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("cache_invalidations", None)
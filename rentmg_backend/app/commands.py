@@ -0,0 +1,169 @@
+"""Maintenance commands registered on the Flask CLI (``flask <command>``)."""
+import click
+from sqlalchemy import select, update
+
+from . import sharding
+from .extensions import db
+from .models import Property, Unit, Lease, Payment
+
+
+def _missing_owner_batches(session, model, batch_size):
+    """Yield id batches of rows with no landlord_id, walking the primary key."""
+    last_id = 0
+    while True:
+        ids = session.execute(
+            select(model.id)
+            .where(model.landlord_id.is_(None), model.id > last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def backfill_owner_columns(session, batch_size=1000):
+    """Populate leases/payments.property_id and landlord_id in bounded batches.
+
+    Each batch commits on its own so the backfill can run against a live
+    database without holding locks on the whole table. Leases go first since
+    payments copy their owner columns from the lease.
+    """
+    unit_owner = (
+        select(Unit.property_id, Property.landlord_id)
+        .join(Property, Unit.property_id == Property.id)
+        .where(Unit.id == Lease.unit_id)
+    )
+    leases = 0
+    for ids in _missing_owner_batches(session, Lease, batch_size):
+        session.execute(
+            update(Lease)
+            .where(Lease.id.in_(ids))
+            .values(
+                property_id=unit_owner.with_only_columns(Unit.property_id).scalar_subquery(),
+                landlord_id=unit_owner.with_only_columns(Property.landlord_id).scalar_subquery(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        leases += len(ids)
+
+    lease_owner = select(Lease.property_id, Lease.landlord_id).where(Lease.id == Payment.lease_id)
+    payments = 0
+    for ids in _missing_owner_batches(session, Payment, batch_size):
+        session.execute(
+            update(Payment)
+            .where(Payment.id.in_(ids))
+            .values(
+                property_id=lease_owner.with_only_columns(Lease.property_id).scalar_subquery(),
+                landlord_id=lease_owner.with_only_columns(Lease.landlord_id).scalar_subquery(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        payments += len(ids)
+    return leases, payments
+
+
+def register_commands(app):
+    @app.cli.command("backfill-owners")
+    @click.option("--batch-size", default=1000, show_default=True)
+    def backfill_owners(batch_size):
+        """Backfill denormalized property/landlord ids on leases and payments."""
+        leases, payments = backfill_owner_columns(db.session, batch_size)
+        click.echo(f"backfilled {leases} leases, {payments} payments")
+
+    @app.cli.command("run-jobs")
+    @click.argument("names", nargs=-1)
+    @click.option("--force", is_flag=True, help="Run even if the job interval has not elapsed.")
+    def run_jobs(names, force):
+        """Run scheduled maintenance jobs once (all jobs when NAMES is empty)."""
+        from .jobs import JOBS, run_job
+
+        for name in names or JOBS:
+            if name not in JOBS:
+                raise click.BadParameter(f"unknown job {name!r}; choose from {', '.join(JOBS)}")
+            processed = run_job(db.session, app.config, name, force=force)
+            click.echo(f"{name}: {'skipped (not due or locked)' if processed is None else f'{processed} rows'}")
+
+    @app.cli.command("generate-statements")
+    @click.option("--month", default=None, help="YYYY-MM, defaults to the current month.")
+    @click.option("--format", "formats", multiple=True, default=["pdf"], type=click.Choice(["pdf", "csv"]),
+                  show_default=True)
+    @click.option("--workers", type=int, default=None, help="Render processes (defaults to STATEMENT_WORKERS).")
+    def generate_statements(month, formats, workers):
+        """Render every tenant and property statement for a month into the statement cache."""
+        import time
+        from .statements import DEFAULT_CACHE_DIR, generate_month, parse_month
+
+        started = time.perf_counter()
+        documents = rendered = 0
+        for _ in sharding.each_shard(db.session):
+            shard_documents, shard_rendered = generate_month(
+                db.session, parse_month(month), formats=formats,
+                cache_dir=app.config.get("STATEMENT_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                workers=workers or app.config.get("STATEMENT_WORKERS"),
+                max_bytes=app.config.get("STATEMENT_CACHE_MAX_BYTES"),
+            )
+            documents, rendered = documents + shard_documents, rendered + shard_rendered
+        click.echo(f"{documents} documents ({rendered} rendered, {documents - rendered} cached) "
+                   f"in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command("scan-payments")
+    @click.option("--since", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Only payments from this date.")
+    @click.option("--burst-count", default=3, show_default=True, help="Initiations on one lease that make a burst.")
+    @click.option("--burst-seconds", default=600, show_default=True)
+    @click.option("--duplicate-seconds", default=3600, show_default=True,
+                  help="Same-amount completed payments this close together are a double charge.")
+    @click.option("--json", "as_json", is_flag=True, help="One JSON object per finding.")
+    def scan_payments(since, burst_count, burst_seconds, duplicate_seconds, as_json):
+        """Flag amount mismatches, bursts and double charges across the whole payment history."""
+        import json
+        from collections import Counter
+        from .anomalies import KINDS, scan
+
+        counts = Counter()
+        for shard in sharding.each_shard(db.session):
+            for finding in scan(db.session, since, burst_count, burst_seconds, duplicate_seconds):
+                counts[finding.kind] += 1
+                if as_json:
+                    click.echo(json.dumps({"shard": shard, **finding._asdict()}, default=str))
+                else:
+                    detail = " ".join(f"{key}={value}" for key, value in finding.detail.items())
+                    ids = ",".join(map(str, finding.payment_ids)) or "-"
+                    click.echo(f"{shard} {finding.kind} lease={finding.lease_id} payments={ids} {detail}")
+        if not as_json:
+            click.echo(", ".join(f"{counts[kind]} {kind}" for kind in KINDS))
+
+    @app.cli.group("shards")
+    def shards():
+        """Landlord shards configured in SHARD_URIS (see app/sharding.py)."""
+
+    @shards.command("init")
+    def shards_init():
+        """Create the sharded tables on every shard, each with its own id range."""
+        for index, name in enumerate(sharding.names()):
+            if name != sharding.PRIMARY:
+                sharding.create_schema(sharding.engine_for(name, db.engine), index)
+                click.echo(f"{name}: ready, ids from {index * sharding.SHARD_ID_SPAN + 1}")
+
+    @shards.command("status")
+    def shards_status():
+        """Landlords mapped to, and properties held by, each shard."""
+        for name, landlords, properties in sharding.status(db.engine):
+            click.echo(f"{name}: {landlords} landlords mapped, {properties} properties")
+
+    @shards.command("move")
+    @click.argument("landlord_id", type=int)
+    @click.argument("target")
+    @click.option("--batch-size", default=1000, show_default=True)
+    @click.option("--pause", type=float, default=None, help="Seconds to wait for map caches (default SHARD_MAP_TTL + 1).")
+    def shards_move(landlord_id, target, batch_size, pause):
+        """Move a landlord's properties, units, leases, payments and issues to TARGET."""
+        try:
+            moved = sharding.move_landlord(db.engine, landlord_id, target, batch_size=batch_size, pause=pause,
+                                           echo=click.echo)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc))
+        click.echo(f"moved {sum(moved.values())} rows" if moved else f"landlord {landlord_id} is already on {target}")
@@ -0,0 +1,121 @@
+"""Guard against duplicate M-Pesa initiations for the same lease and phone.
+
+A tenant tapping "Pay" twice, or an app retrying a slow request, used to
+send a second STK push and leave two pending payments, so the tenant could
+be charged twice. Two layers now stop the second push:
+
+* Each worker keeps an index of the initiations it has in flight, keyed by
+  lease and normalized phone number. ``claim`` checks the key and reserves
+  it under one lock, so of several concurrent requests on one worker only
+  one goes on to the database and Daraja. Entries are dropped when the
+  request ends, or after ``PAYMENT_DEDUPE_WINDOW`` seconds at the latest.
+* :func:`earlier_pending` runs in the initiating transaction, before the
+  push. It locks the lease row (``SELECT ... FOR UPDATE`` on MySQL; on SQLite
+  the insert takes the database write lock), adds the new pending payment
+  and looks for another pending payment of the same amount on the lease
+  created within the window (payments keep no phone number). Initiations on
+  other workers, or from before a restart, wait for each other there, so
+  the second one always finds the first's row.
+
+What a repeat gets depends on ``PAYMENT_DEDUPE_MODE``:
+
+* ``coalesce`` (default): the first request's payment, with ``duplicate: true``;
+* ``reject``: 409 with the first payment's id;
+* ``off``: no check.
+
+A repeat that arrives while the first push is still waiting on Daraja (no
+checkout id yet) gets 409 in both modes. Once the first payment completes or
+fails, it is no longer pending, so a new initiation goes through on every
+worker.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from .models import Lease, Payment
+
+MODES = ("coalesce", "reject", "off")
+
+settings = {"PAYMENT_DEDUPE_MODE": "coalesce", "PAYMENT_DEDUPE_WINDOW": 120.0}
+
+
+def configure(config):
+    """Apply PAYMENT_DEDUPE_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+    if settings["PAYMENT_DEDUPE_MODE"] not in MODES:
+        raise ValueError(f"PAYMENT_DEDUPE_MODE must be one of {', '.join(MODES)}")
+
+
+def enabled():
+    return settings["PAYMENT_DEDUPE_MODE"] != "off"
+
+
+def normalize_phone(phone):
+    """Digits only, Kenyan local form (07..., 7...) rewritten to 2547..."""
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    if digits.startswith("0") and len(digits) == 10:
+        return "254" + digits[1:]
+    if len(digits) == 9:
+        return "254" + digits
+    return digits
+
+
+class InitiationIndex:
+    """(lease_id, phone) keys with an initiation in flight on this worker, expiring in claim order."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> expires
+        self._expiry = deque()  # (expires, key), oldest first
+
+    def _evict(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, key = self._expiry.popleft()
+            if self._entries.get(key) == expires:  # not released and re-claimed since
+                del self._entries[key]
+
+    def claim(self, key, now=None):
+        """Reserve ``key``; False if another request on this worker holds it."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._evict(now)
+            if key in self._entries:
+                return False
+            expires = now + settings["PAYMENT_DEDUPE_WINDOW"]
+            self._entries[key] = expires
+            self._expiry.append((expires, key))
+            return True
+
+    def release(self, key):
+        """Free ``key`` once its request has committed or failed."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+index = InitiationIndex()
+
+
+def earlier_pending(session, payment, now=None):
+    """Add and flush ``payment``; return (id, mpesa_checkout_id) of an earlier duplicate, or None.
+
+    Leaves the transaction open: the caller rolls back on a duplicate and
+    commits otherwise, which releases the lease lock.
+    """
+    session.execute(select(Lease.id).where(Lease.id == payment.lease_id).with_for_update())
+    session.add(payment)
+    session.flush()
+    since = (now or datetime.utcnow()) - timedelta(seconds=settings["PAYMENT_DEDUPE_WINDOW"])
+    return session.execute(
+        select(Payment.id, Payment.mpesa_checkout_id)
+        .where(Payment.status == "pending", Payment.created_at >= since, Payment.lease_id == payment.lease_id,
+               Payment.amount == payment.amount, Payment.id != payment.id)
+        .order_by(Payment.created_at.desc()).limit(1)
+        .with_for_update(read=True)  # a locking read sees rows committed after this transaction began
+    ).first()
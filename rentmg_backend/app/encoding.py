@@ -0,0 +1,192 @@
+"""Negotiated response compression and compact list encodings for both stacks.
+
+Clients opt in through standard headers, so existing clients see no change:
+
+* ``Accept-Encoding: br`` / ``gzip`` compresses JSON bodies of at least
+  ``COMPRESS_MIN_SIZE`` bytes (brotli only when the optional ``brotli``
+  package is installed).
+* ``Accept: application/vnd.rentmg.columnar+json`` turns a list of objects into
+  ``{"columns": [...], "rows": [[...], ...]}`` so keys are sent once.
+* ``Accept: application/msgpack`` encodes the same columnar shape with
+  MessagePack when the optional ``msgpack`` package is installed.
+"""
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+COLUMNAR = "application/vnd.rentmg.columnar+json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+def _accepted(header):
+    """Media types / codings from an Accept-style header, skipping q=0 entries."""
+    accepted = set()
+    for part in (header or "").lower().split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode()
+    return None
+
+
+def pick_encoding(accept_encoding):
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def pick_format(accept):
+    accepted = _accepted(accept)
+    if msgpack is not None and accepted.intersection(MSGPACK_TYPES):
+        return MSGPACK
+    if COLUMNAR in accepted:
+        return COLUMNAR
+    return None
+
+
+def compress(data, encoding, level=6):
+    if encoding == "br":
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def to_columnar(value):
+    """Columnar form of a list of same-keyed dicts, or None if the body is not one."""
+    if not isinstance(value, list) or not all(isinstance(row, dict) for row in value):
+        return None
+    columns = list(value[0]) if value else []
+    if any(list(row) != columns for row in value):
+        return None
+    return {"columns": columns, "rows": [[row[c] for c in columns] for row in value]}
+
+
+def encode_body(body, content_type, accept, accept_encoding, min_size=1024, level=6):
+    """Re-encode a JSON response body for the client.
+
+    Returns ``(body, headers)`` where ``headers`` holds the Content-Type /
+    Content-Encoding to set, or ``None`` when the body should go out unchanged.
+    """
+    if not (content_type or "").startswith("application/json"):
+        return None
+    headers = {}
+    fmt = pick_format(accept)
+    if fmt:
+        columnar = to_columnar(json.loads(body))
+        if columnar is not None:
+            if fmt == MSGPACK:
+                body = msgpack.packb(columnar, use_bin_type=True)
+            else:
+                body = json.dumps(columnar, separators=(",", ":")).encode()
+            headers["Content-Type"] = fmt
+    encoding = pick_encoding(accept_encoding)
+    if encoding and len(body) >= min_size:
+        body = compress(body, encoding, level)
+        headers["Content-Encoding"] = encoding
+    return (body, headers) if headers else None
+
+
+def flask_after_request(response):
+    """Flask ``after_request`` hook applying :func:`encode_body`."""
+    from flask import current_app, request
+
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or response.status_code < 200 or response.status_code >= 300 \
+            or "Content-Encoding" in response.headers:
+        return response
+    encoded = encode_body(
+        response.get_data(),
+        response.content_type,
+        request.headers.get("Accept"),
+        request.headers.get("Accept-Encoding"),
+        current_app.config["COMPRESS_MIN_SIZE"],
+        current_app.config["COMPRESS_LEVEL"],
+    )
+    if encoded is not None:
+        body, headers = encoded
+        response.set_data(body)
+        for name, value in headers.items():
+            response.headers[name] = value
+    return response
+
+
+class CompactResponseMiddleware:
+    """ASGI counterpart of :func:`flask_after_request` for the FastAPI app.
+
+    JSON responses are buffered (they are built in one piece anyway) and
+    re-encoded; anything else streams straight through.
+    """
+
+    def __init__(self, app, min_size=1024, level=6):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = _header(scope["headers"], b"accept")
+        accept_encoding = _header(scope["headers"], b"accept-encoding")
+        if not pick_format(accept) and not pick_encoding(accept_encoding):
+            return await self.app(scope, receive, send)
+
+        start = None
+        chunks = []
+
+        async def wrapped_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                headers = message.get("headers", [])
+                if not (200 <= message["status"] < 300) or _header(headers, b"content-encoding") \
+                        or not (_header(headers, b"content-type") or "").startswith("application/json"):
+                    start = None
+                    await send(message)
+                return
+            if start is None:
+                return await send(message)
+            chunks.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            body = b"".join(chunks)
+            headers = start.get("headers", [])
+            encoded = encode_body(body, _header(headers, b"content-type"), accept, accept_encoding,
+                                  self.min_size, self.level)
+            replaced = {b"content-length", b"vary"}
+            extra = {}
+            if encoded is not None:
+                body, extra = encoded
+                replaced |= {name.lower().encode() for name in extra}
+            headers = [(k, v) for k, v in headers if k.lower() not in replaced]
+            headers += [(name.lower().encode(), value.encode()) for name, value in extra.items()]
+            headers += [(b"content-length", str(len(body)).encode()), (b"vary", b"Accept, Accept-Encoding")]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, wrapped_send)
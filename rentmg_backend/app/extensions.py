@@ -1,9 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 
-db = SQLAlchemy()
+from .sharding import ShardRouting
+
+
+class RoutingSession(ShardRouting, Session):
+    """Flask-SQLAlchemy session that sends a landlord's tables to their shard (app/sharding.py)."""
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 jwt = JWTManager()
 cors = CORS()
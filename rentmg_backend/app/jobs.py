@@ -0,0 +1,243 @@
+"""In-process scheduler for recurring lease and payment maintenance.
+
+Job state lives in the ``job_states`` table: a job is claimed with a
+conditional UPDATE on ``locked_until`` so only one worker process runs it per
+interval, and restarts pick up where the last run finished. Every job walks
+its rows by primary key in chunks of ``JOB_BATCH_SIZE`` and commits per chunk
+to keep transactions (and the row locks they hold) short.
+"""
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import sharding
+from .models import JobState, Lease, Payment, RevokedToken
+from .archive import archive_payments
+from .reconcile import reconcile_pending_payments
+
+log = logging.getLogger(__name__)
+
+
+def _chunks(session, stmt, key, batch_size):
+    """Yield id batches from ``stmt`` (a select of ``key``), walking ``key`` upwards."""
+    last_id = 0
+    while True:
+        ids = session.execute(stmt.where(key > last_id).order_by(key).limit(batch_size)).scalars().all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def expire_leases(session, config, now):
+    """Mark active leases whose end_date has passed as ended."""
+    today = now.date()
+    stmt = select(Lease.id).where(Lease.status == "active", Lease.end_date < today)
+    processed = 0
+    for ids in _chunks(session, stmt, Lease.id, config["JOB_BATCH_SIZE"]):
+        session.execute(
+            update(Lease).where(Lease.id.in_(ids), Lease.status == "active")
+            .values(status="ended", updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        processed += len(ids)
+    return processed
+
+
+def fail_stale_payments(session, config, now):
+    """Fail pending payments whose M-Pesa callback never arrived."""
+    cutoff = now - timedelta(hours=config["PAYMENT_STALE_HOURS"])
+    stmt = select(Payment.id).where(Payment.status == "pending", Payment.created_at < cutoff)
+    processed = 0
+    for ids in _chunks(session, stmt, Payment.id, config["JOB_BATCH_SIZE"]):
+        session.execute(
+            update(Payment).where(Payment.id.in_(ids), Payment.status == "pending")
+            .values(status="failed", updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        processed += len(ids)
+    return processed
+
+
+def _last_due_date(start, today):
+    """Most recent monthly anniversary of ``start`` on or before ``today``."""
+    months = (today.year - start.year) * 12 + today.month - start.month
+    if today.day < start.day:
+        months -= 1
+    if months < 0:
+        return None
+    year, month = divmod(start.month - 1 + months, 12)
+    year += start.year
+    month += 1
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return date(year, month, min(start.day, (next_month - timedelta(days=1)).day))
+
+
+def flag_arrears(session, config, now):
+    """Set Lease.in_arrears for active leases with no completed payment since the last due date."""
+    today = now.date()
+    grace = timedelta(days=config["RENT_GRACE_DAYS"])
+    stmt = select(Lease.id).where(Lease.status == "active", Lease.start_date.isnot(None))
+    changed = 0
+    for ids in _chunks(session, stmt, Lease.id, config["JOB_BATCH_SIZE"]):
+        leases = session.execute(
+            select(Lease.id, Lease.start_date, Lease.in_arrears).where(Lease.id.in_(ids))
+        ).all()
+        last_paid = dict(session.execute(
+            select(Payment.lease_id, func.max(Payment.created_at))
+            .where(Payment.lease_id.in_(ids), Payment.status == "completed")
+            .group_by(Payment.lease_id)
+        ).all())
+        flag, clear = [], []
+        for lease_id, start, current in leases:
+            due = _last_due_date(start, today)
+            overdue = (
+                due is not None
+                and today > due + grace
+                and (last_paid.get(lease_id) is None or last_paid[lease_id].date() < due)
+            )
+            if overdue and not current:
+                flag.append(lease_id)
+            elif not overdue and current:
+                clear.append(lease_id)
+        for lease_ids, value in ((flag, True), (clear, False)):
+            if lease_ids:
+                session.execute(
+                    update(Lease).where(Lease.id.in_(lease_ids))
+                    .values(in_arrears=value, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+        session.commit()
+        changed += len(flag) + len(clear)
+    return changed
+
+
+def prune_revoked_tokens(session, config, now):
+    """Delete token denylist rows once every token they cover has expired."""
+    stmt = select(RevokedToken.id).where(RevokedToken.expires_at < now)
+    processed = 0
+    for ids in _chunks(session, stmt, RevokedToken.id, config["JOB_BATCH_SIZE"]):
+        session.execute(delete(RevokedToken).where(RevokedToken.id.in_(ids)))
+        session.commit()
+        processed += len(ids)
+    return processed
+
+
+# name -> (interval in seconds, job function)
+JOBS = {
+    "expire_leases": (3600, expire_leases),
+    "reconcile_mpesa_payments": (120, reconcile_pending_payments),
+    "fail_stale_payments": (900, fail_stale_payments),
+    "flag_arrears": (3600, flag_arrears),
+    "archive_payments": (86400, archive_payments),
+    "prune_revoked_tokens": (3600, prune_revoked_tokens),
+}
+GLOBAL_JOBS = {"prune_revoked_tokens"}
+
+
+def _claim(session, name, interval, now, force=False):
+    """Atomically take the job lock; returns False if another worker holds it or it is not due."""
+    try:
+        session.execute(insert(JobState).values(name=name, run_count=0, last_processed=0))
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+    conditions = [JobState.name == name, or_(JobState.locked_until.is_(None), JobState.locked_until < now)]
+    if not force:
+        conditions.append(or_(
+            JobState.last_finished_at.is_(None),
+            JobState.last_finished_at <= now - timedelta(seconds=interval),
+        ))
+    claimed = session.execute(
+        update(JobState).where(and_(*conditions))
+        .values(locked_until=now + timedelta(seconds=max(interval, 300)), last_started_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    return claimed == 1
+
+
+def run_job(session, config, name, force=False, now=None):
+    """Run one job if it is due (or ``force``); returns rows processed or None if skipped."""
+    interval, job = JOBS[name]
+    now = now or datetime.utcnow()
+    if not _claim(session, name, interval, now, force):
+        return None
+    processed, error = 0, None
+    try:
+        # Portfolio jobs run once per shard (app/sharding.py); global ones touch the primary only
+        for _ in ([None] if name in GLOBAL_JOBS else sharding.each_shard(session)):
+            processed += job(session, config, now)
+    except Exception as exc:
+        session.rollback()
+        log.exception("job %s failed", name)
+        error = str(exc)
+    session.execute(
+        update(JobState).where(JobState.name == name)
+        .values(
+            last_finished_at=datetime.utcnow(),
+            last_error=error,
+            last_processed=processed,
+            run_count=JobState.run_count + 1,
+            locked_until=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return processed
+
+
+class Scheduler:
+    """Daemon thread that runs due jobs every ``tick`` seconds inside the Flask app context.
+
+    Started lazily, once per process, on the first request (or ASGI startup)
+    rather than in create_app. A gunicorn master that preloads the app must
+    not run jobs, nor fork workers while a job thread holds a lock such as
+    services_mpesa's token lock.
+    """
+
+    def __init__(self, app, tick=30):
+        self.app = app
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread in this process unless it already runs here."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="rentmg-scheduler", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self._thread = self._pid = None
+
+    def _loop(self):
+        from .extensions import db
+
+        while not self._stop.is_set():
+            with self.app.app_context():
+                for name in JOBS:
+                    try:
+                        run_job(db.session, self.app.config, name)
+                    except Exception:
+                        db.session.rollback()
+                        log.exception("scheduler tick failed for %s", name)
+                db.session.remove()
+            self._stop.wait(self.tick)
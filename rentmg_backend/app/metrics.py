@@ -0,0 +1,82 @@
+"""Process-local metrics registry exposed at ``/metrics`` on both stacks.
+
+Counters only go up, gauges hold the last value set, and timings keep a
+count/sum/max summary. Everything is in memory and per worker process.
+
+The endpoint answers only requests bearing ``METRICS_TOKEN``
+(``Authorization: Bearer <token>``); with no token configured it is closed.
+"""
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+settings = {"METRICS_TOKEN": ""}
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+
+def configure(config):
+    """Apply METRICS_TOKEN; called from create_app and the FastAPI module."""
+    settings["METRICS_TOKEN"] = config.get("METRICS_TOKEN") or ""
+
+
+def authorized(header):
+    """True if the Authorization header carries the configured scrape token."""
+    token = settings["METRICS_TOKEN"]
+    scheme, _, value = (header or "").partition(" ")
+    return bool(token) and scheme.lower() == "bearer" and hmac.compare_digest(value.strip(), token)
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            _timings[name] = {"count": 1, "sum": value, "max": value}
+        else:
+            t["count"] += 1
+            t["sum"] += value
+            t["max"] = max(t["max"], value)
+
+
+class timer:
+    """Context manager recording elapsed seconds under ``name``."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {k: dict(v) for k, v in _timings.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
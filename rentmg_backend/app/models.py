@@ -1,8 +1,11 @@
 from datetime import datetime
+from sqlalchemy import event, inspect, select, update
 from .extensions import db
 
 class BaseModel(db.Model):
     __abstract__ = True
+    # Fetch server-generated values in the INSERT itself (RETURNING where supported)
+    __mapper_args__ = {"eager_defaults": True}
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -19,6 +22,8 @@ class User(BaseModel):
 class Property(BaseModel):
     __tablename__ = "properties"
     name = db.Column(db.String(120), nullable=False)
+    # lower(trim(name)), kept in sync by the events below; indexed for tenant signup lookups
+    name_normalized = db.Column(db.String(120), index=True)
     address = db.Column(db.String(255))
     landlord_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     landlord = db.relationship("User", backref="properties", foreign_keys=[landlord_id])
@@ -37,8 +42,16 @@ class Lease(BaseModel):
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date, nullable=True)
     status = db.Column(db.String(20), default="active")
+    # Denormalized from unit -> property so landlord queries stay single-table
+    property_id = db.Column(db.Integer, db.ForeignKey("properties.id"), nullable=True, index=True)
+    landlord_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    in_arrears = db.Column(db.Boolean, default=False, nullable=False)
     unit = db.relationship("Unit", backref="leases")
     tenant = db.relationship("User", foreign_keys=[tenant_id])
+    __table_args__ = (
+        db.Index("ix_leases_status_end_date", "status", "end_date"),
+        db.Index("ix_leases_unit_start", "unit_id", "start_date"),
+    )
 
 class Payment(BaseModel):
     __tablename__ = "payments"
@@ -47,13 +60,46 @@ class Payment(BaseModel):
     amount = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(20), default="pending")
     reference = db.Column(db.String(64))
-    mpesa_checkout_id = db.Column(db.String(64))
+    mpesa_checkout_id = db.Column(db.String(64), index=True)
+    # Denormalized from lease so landlord history is an indexed range scan
+    property_id = db.Column(db.Integer, db.ForeignKey("properties.id"), nullable=True)
+    landlord_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     lease = db.relationship("Lease", backref="payments")
+    __table_args__ = (
+        db.Index("ix_payments_landlord_created", "landlord_id", "created_at"),
+        db.Index("ix_payments_property_created", "property_id", "created_at"),
+        db.Index("ix_payments_status_created", "status", "created_at"),
+    )
+
+class PaymentArchive(db.Model):
+    """Settled payments from closed years, moved out of ``payments`` by app/archive.py.
+
+    Same columns and ids as ``payments`` but no foreign keys, and stored
+    compressed on MySQL; rows are only ever inserted.
+    """
+    __tablename__ = "payments_archive"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    lease_id = db.Column(db.Integer, nullable=False)
+    method = db.Column(db.String(20))
+    amount = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20))
+    reference = db.Column(db.String(64))
+    mpesa_checkout_id = db.Column(db.String(64))
+    property_id = db.Column(db.Integer)
+    landlord_id = db.Column(db.Integer)
+    __table_args__ = (
+        db.Index("ix_payments_archive_landlord_created", "landlord_id", "created_at"),
+        db.Index("ix_payments_archive_lease_created", "lease_id", "created_at"),
+        db.Index("ix_payments_archive_property_created", "property_id", "created_at"),
+        {"mysql_row_format": "COMPRESSED"},
+    )
 
 class Issue(BaseModel):
     __tablename__ = "issues"
     title = db.Column(db.String(120), nullable=False)
-    description = db.Column(db.Text)
+    description = db.deferred(db.Column(db.Text))  # loaded on first access; list endpoints read rows (app/rows.py)
     status = db.Column(db.String(20), default="open")
     priority = db.Column(db.String(20), default="normal")
     reporter_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -62,3 +108,125 @@ class Issue(BaseModel):
     unit_id = db.Column(db.Integer, db.ForeignKey("units.id"), nullable=True)
     reporter = db.relationship("User", foreign_keys=[reporter_id])
     assignee = db.relationship("User", foreign_keys=[assignee_id])
+
+class JobState(db.Model):
+    """Persistent bookkeeping for a recurring background job (see app/jobs.py)."""
+    __tablename__ = "job_states"
+    name = db.Column(db.String(64), primary_key=True)
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    last_processed = db.Column(db.Integer, default=0)
+    run_count = db.Column(db.Integer, default=0)
+    locked_until = db.Column(db.DateTime)
+
+
+class AuditEvent(db.Model):
+    """Append-only change log written in batches by app/audit.py; rows are never updated."""
+    __tablename__ = "audit_events"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    at = db.Column(db.DateTime, nullable=False, index=True)
+    actor_id = db.Column(db.Integer)  # no FK: the log outlives the users it mentions
+    entity = db.Column(db.String(32), nullable=False)
+    entity_id = db.Column(db.Integer)
+    action = db.Column(db.String(1), nullable=False)  # I(nsert), U(pdate), D(elete)
+    changes = db.Column(db.Text)  # compact JSON: {column: [old, new]} or {column: value}
+
+    __table_args__ = (db.Index("ix_audit_events_entity", "entity", "entity_id", "id"),)
+
+
+class RevokedToken(db.Model):
+    """Denylist entry: one token (jti), a login session's token family, or every token a user holds."""
+    __tablename__ = "revoked_tokens"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # jti | family | user
+    value = db.Column(db.String(64), nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)  # sync cursor
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # after this no affected token is valid
+
+    __table_args__ = (db.UniqueConstraint("kind", "value", name="uq_revoked_tokens_kind_value"),)
+
+
+class LandlordShard(db.Model):
+    """Shard map (app/sharding.py): which database holds a landlord's properties, units, leases, payments and issues."""
+    __tablename__ = "landlord_shards"
+    landlord_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    shard = db.Column(db.String(32), nullable=False, index=True)
+    moving = db.Column(db.Boolean, nullable=False, default=False)  # set by move_landlord while rows are copied
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def normalize_property_name(name):
+    return (name or "").strip().lower()
+
+
+@event.listens_for(Property, "before_insert")
+@event.listens_for(Property, "before_update")
+def _normalize_property_name(mapper, connection, target):
+    target.name_normalized = normalize_property_name(target.name)
+
+
+# ----------------------------
+# Denormalized owner columns
+# ----------------------------
+def _unit_owner(connection, unit_id):
+    row = connection.execute(
+        select(Unit.property_id, Property.landlord_id)
+        .join(Property, Unit.property_id == Property.id)
+        .where(Unit.id == unit_id)
+    ).first()
+    return (row.property_id, row.landlord_id) if row else (None, None)
+
+
+@event.listens_for(Lease, "before_insert")
+def _lease_owner_on_insert(mapper, connection, target):
+    if target.landlord_id is None:
+        target.property_id, target.landlord_id = _unit_owner(connection, target.unit_id)
+
+
+@event.listens_for(Lease, "before_update")
+def _lease_owner_on_update(mapper, connection, target):
+    if inspect(target).attrs.unit_id.history.has_changes():
+        target.property_id, target.landlord_id = _unit_owner(connection, target.unit_id)
+        connection.execute(
+            update(Payment.__table__)
+            .where(Payment.__table__.c.lease_id == target.id)
+            .values(property_id=target.property_id, landlord_id=target.landlord_id)
+        )
+
+
+@event.listens_for(Payment, "before_insert")
+def _payment_owner_on_insert(mapper, connection, target):
+    if target.landlord_id is not None:
+        return  # copied from an already-loaded lease by the caller
+    row = connection.execute(
+        select(Lease.property_id, Lease.landlord_id).where(Lease.id == target.lease_id)
+    ).first()
+    if row:
+        target.property_id, target.landlord_id = row.property_id, row.landlord_id
+
+
+@event.listens_for(Property, "after_update")
+def _property_owner_on_update(mapper, connection, target):
+    if inspect(target).attrs.landlord_id.history.has_changes():
+        for table in (Lease.__table__, Payment.__table__):
+            connection.execute(
+                update(table).where(table.c.property_id == target.id).values(landlord_id=target.landlord_id)
+            )
+
+
+@event.listens_for(Unit, "after_update")
+def _unit_owner_on_update(mapper, connection, target):
+    if inspect(target).attrs.property_id.history.has_changes():
+        property_id, landlord_id = _unit_owner(connection, target.id)
+        leases = Lease.__table__
+        connection.execute(
+            update(leases).where(leases.c.unit_id == target.id)
+            .values(property_id=property_id, landlord_id=landlord_id)
+        )
+        payments = Payment.__table__
+        connection.execute(
+            update(payments)
+            .where(payments.c.lease_id.in_(select(leases.c.id).where(leases.c.unit_id == target.id)))
+            .values(property_id=property_id, landlord_id=landlord_id)
+        )
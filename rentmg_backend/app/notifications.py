@@ -0,0 +1,317 @@
+"""Push, SMS and email notifications for payment and issue events.
+
+Events come from committed model changes, like the audit log. Two changes
+produce one:
+
+* a payment whose status moves to ``completed`` or ``failed``, whichever code
+  path did it (the M-Pesa callback, reconciliation, an admin fix). The tenant
+  on the lease and the landlord are notified.
+* an issue whose status changes. The reporter and the assignee are notified.
+
+The user who made the change is never notified about it.
+
+``after_flush`` notes the events of ORM changes in ``session.info``, and
+``do_orm_execute`` those of bulk ``update(Payment)`` / ``update(Issue)``
+statements that set a status (reconciliation, ``fail_stale_payments``),
+resolving the rows they change with one SELECT on their WHERE clause.
+``after_commit`` queues the events and ``after_rollback`` drops them, so the
+request only pays for a list append. A background thread takes events off the bounded queue
+(``NOTIFY_QUEUE_MAX``), for up to ``NOTIFY_COALESCE_SECONDS`` or
+``NOTIFY_BATCH_SIZE`` events per batch. It resolves recipients with one query
+per batch and coalesces per recipient. Several status changes of the same
+payment or issue collapse into the latest, and each recipient gets a single
+delivery carrying all of their notifications. Each delivery is handed to every
+sink in ``NOTIFY_SINKS``.
+
+A sink that raises has its deliveries retried with exponential backoff, up to
+``NOTIFY_MAX_ATTEMPTS`` tries. The retry queue is bounded too
+(``NOTIFY_RETRY_MAX``). Overflow on either queue is dropped and counted as
+``notify.dropped`` on ``/metrics``.
+
+The built-in ``push``, ``sms`` and ``email`` sinks are local stubs. They log
+deliveries and keep the most recent ones in memory. To wire up a real provider,
+register a callable taking a list of :data:`Delivery` under the channel name
+with :func:`register_sink`.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .audit import _actor
+from .models import Issue, Lease, Payment, User
+
+log = logging.getLogger(__name__)
+
+PAYMENT_STATUSES = {"completed", "failed"}
+
+settings = {"NOTIFY_ENABLED": True, "NOTIFY_SINKS": "push,sms,email", "NOTIFY_BATCH_SIZE": 1000,
+            "NOTIFY_COALESCE_SECONDS": 0.5, "NOTIFY_QUEUE_MAX": 100_000, "NOTIFY_RETRY_MAX": 10_000,
+            "NOTIFY_MAX_ATTEMPTS": 5, "NOTIFY_RETRY_BASE_SECONDS": 1.0}
+
+# user_id/email of the recipient, and their notifications as dicts (kind, title, body, data)
+Delivery = namedtuple("Delivery", "user_id email notifications")
+
+
+def configure(config):
+    """Apply NOTIFY_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+
+
+class StubSink:
+    """Local stand-in for a provider: logs deliveries and keeps the last ``keep`` in ``sent``."""
+
+    def __init__(self, channel, keep=1000):
+        self.channel = channel
+        self.sent = deque(maxlen=keep)
+
+    def __call__(self, deliveries):
+        for delivery in deliveries:
+            log.debug("%s to user %s: %s", self.channel, delivery.user_id,
+                      "; ".join(n["title"] for n in delivery.notifications))
+            self.sent.append(delivery)
+
+
+sinks = {channel: StubSink(channel) for channel in ("push", "sms", "email")}
+
+
+def register_sink(channel, sink):
+    """Use ``sink(deliveries)`` for ``channel``; list the channel in NOTIFY_SINKS to enable it."""
+    sinks[channel] = sink
+
+
+def _enabled_sinks():
+    names = [name.strip() for name in settings["NOTIFY_SINKS"].split(",") if name.strip()]
+    return [(name, sinks[name]) for name in names if name in sinks]
+
+
+def _status_change(state):
+    history = state.attrs.status.history
+    if history.added and history.deleted and history.added[0] != history.deleted[0]:
+        return history.deleted[0], history.added[0]
+    return None
+
+
+def _payment_event(payment, new):
+    # the tenant comes from the lease, resolved off the request path
+    return (f"payment.{new}", ("payment", payment.id), (payment.landlord_id,), payment.lease_id,
+            {"payment_id": payment.id, "lease_id": payment.lease_id, "amount": payment.amount,
+             "reference": payment.reference})
+
+
+def _issue_event(issue, old, new):
+    return ("issue.status", ("issue", issue.id), (issue.reporter_id, issue.assignee_id), None,
+            {"issue_id": issue.id, "title": issue.title, "from": old, "to": new})
+
+
+@event.listens_for(Session, "after_flush")
+def _capture(session, flush_context):
+    if not settings["NOTIFY_ENABLED"]:
+        return
+    events = None
+    for obj in session.dirty:
+        if not isinstance(obj, (Payment, Issue)):
+            continue
+        change = _status_change(inspect(obj))
+        if change is None:
+            continue
+        old, new = change
+        if isinstance(obj, Payment):
+            if new not in PAYMENT_STATUSES:
+                continue
+            item = _payment_event(obj, new)
+        else:
+            item = _issue_event(obj, old, new)
+        events = events if events is not None else session.info.setdefault("notify_events", [])
+        events.append(item)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _capture_bulk(orm_execute_state):
+    if not settings["NOTIFY_ENABLED"] or not orm_execute_state.is_update:
+        return
+    mapper = orm_execute_state.bind_mapper
+    model = mapper.class_ if mapper is not None else None
+    if model is not Payment and model is not Issue:
+        return
+    statement = orm_execute_state.statement
+    new = statement.compile().params.get("status")
+    if new is None or (model is Payment and new not in PAYMENT_STATUSES):
+        return
+    if model is Payment:
+        rows = select(Payment.id, Payment.landlord_id, Payment.lease_id, Payment.amount, Payment.reference)
+    else:
+        rows = select(Issue.id, Issue.reporter_id, Issue.assignee_id, Issue.title, Issue.status)
+    rows = rows.where(model.status != new)
+    if statement.whereclause is not None:
+        rows = rows.where(statement.whereclause)
+    session = orm_execute_state.session
+    items = [_payment_event(row, new) if model is Payment else _issue_event(row, row.status, new)
+             for row in session.execute(rows)]
+    if items:
+        session.info.setdefault("notify_events", []).extend(items)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    events = session.info.pop("notify_events", None)
+    if events:
+        # Leases may sit on a landlord's shard (app/sharding.py) while users stay on the primary
+        engines = (session.get_bind(mapper=inspect(Lease)), session.get_bind())
+        notifier.submit(engines, _actor(session), events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("notify_events", None)
+
+
+def _render(kind, data):
+    if kind == "payment.completed":
+        ref = f" (ref {data['reference']})" if data["reference"] else ""
+        return "Payment received", f"KES {data['amount']} for lease {data['lease_id']}{ref}"
+    if kind == "payment.failed":
+        return "Payment failed", f"KES {data['amount']} for lease {data['lease_id']} did not go through"
+    return f"Issue #{data['issue_id']} is now {data['to']}", data["title"]
+
+
+class Notifier:
+    """Background thread batching, coalescing and delivering notifications."""
+
+    def __init__(self):
+        self._queue = None
+        self._retries = []  # heap of (due, seq, channel, delivery, attempt)
+        self._seq = itertools.count()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # After a fork (gunicorn preload) the parent's thread does not exist in the child
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=settings["NOTIFY_QUEUE_MAX"])
+            self._retries = []
+            threading.Thread(target=self._run, name="notifier", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, engines, actor_id, events):
+        """Queue events committed through ``engines``: (the one holding leases, the one holding users)."""
+        self._ensure_started()
+        for item in events:
+            try:
+                self._queue.put_nowait((engines, actor_id, item))
+            except queue.Full:
+                metrics.incr("notify.dropped")
+
+    def _run(self):
+        while True:
+            wait = max(self._retries[0][0] - time.monotonic(), 0) if self._retries else None
+            try:
+                batch = [self._queue.get(timeout=wait)]
+            except queue.Empty:
+                batch = []
+            if batch:
+                deadline = time.monotonic() + settings["NOTIFY_COALESCE_SECONDS"]
+                while len(batch) < settings["NOTIFY_BATCH_SIZE"]:
+                    try:
+                        batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                    except queue.Empty:
+                        break
+                try:
+                    self._dispatch(batch)
+                except Exception:
+                    log.exception("dropping %d notification events", len(batch))
+                    metrics.incr("notify.dropped", len(batch))
+                for _ in batch:
+                    self._queue.task_done()
+            self._retry_due()
+
+    def _dispatch(self, batch):
+        by_engines = {}
+        for engines, actor_id, item in batch:
+            by_engines.setdefault(engines, []).append((actor_id, item))
+        for engines, items in by_engines.items():
+            deliveries = self._coalesce(engines, items)
+            for channel, sink in _enabled_sinks():
+                self._send(channel, sink, deliveries, 1)
+
+    def _coalesce(self, engines, items):
+        lease_engine, user_engine = engines
+        lease_ids = {lease_id for _, (_, _, _, lease_id, _) in items if lease_id is not None}
+        tenants = {}
+        if lease_ids:
+            with lease_engine.connect() as conn:
+                tenants = dict(conn.execute(select(Lease.id, Lease.tenant_id).where(Lease.id.in_(lease_ids))).all())
+        latest = {}  # recipient -> {entity key -> notification}
+        addressed = 0
+        for actor_id, (kind, key, recipients, lease_id, data) in items:
+            for user_id in {*recipients, tenants.get(lease_id)}:
+                if user_id is None or user_id == actor_id:
+                    continue
+                addressed += 1
+                title, body = _render(kind, data)
+                latest.setdefault(user_id, {})[key] = {"kind": kind, "title": title, "body": body, "data": data}
+        emails = {}
+        if latest:
+            with user_engine.connect() as conn:
+                emails = dict(conn.execute(select(User.id, User.email).where(User.id.in_(latest))).all())
+        notifications = sum(len(by_key) for by_key in latest.values())
+        metrics.incr("notify.events", len(items))
+        metrics.incr("notify.coalesced", addressed - notifications)
+        return [Delivery(user_id, emails.get(user_id), list(by_key.values())) for user_id, by_key in latest.items()]
+
+    def _send(self, channel, sink, deliveries, attempt):
+        if not deliveries:
+            return
+        try:
+            with metrics.timer(f"notify.send.{channel}"):
+                sink(deliveries)
+            metrics.incr(f"notify.sent.{channel}", len(deliveries))
+        except Exception:
+            if attempt >= settings["NOTIFY_MAX_ATTEMPTS"]:
+                log.exception("giving up on %d %s deliveries after %d attempts", len(deliveries), channel, attempt)
+                metrics.incr("notify.failed", len(deliveries))
+                return
+            log.warning("%s sink failed (attempt %d), retrying", channel, attempt, exc_info=True)
+            due = time.monotonic() + settings["NOTIFY_RETRY_BASE_SECONDS"] * 2 ** (attempt - 1)
+            for delivery in deliveries:
+                if len(self._retries) >= settings["NOTIFY_RETRY_MAX"]:
+                    metrics.incr("notify.dropped")
+                    continue
+                heapq.heappush(self._retries, (due, next(self._seq), channel, delivery, attempt + 1))
+            metrics.incr("notify.retried", len(deliveries))
+        metrics.gauge("notify.retry_queue", len(self._retries))
+
+    def _retry_due(self):
+        now = time.monotonic()
+        due = {}  # (channel, attempt) -> deliveries, so a retry is still one sink call per batch
+        while self._retries and self._retries[0][0] <= now:
+            _, _, channel, delivery, attempt = heapq.heappop(self._retries)
+            due.setdefault((channel, attempt), []).append(delivery)
+        for (channel, attempt), deliveries in due.items():
+            sink = sinks.get(channel)
+            if sink is not None:
+                self._send(channel, sink, deliveries, attempt)
+
+    def flush(self, timeout=5.0):
+        """Block until queued events are handed to the sinks (tests, shutdown); retries are not awaited."""
+        deadline = time.monotonic() + timeout
+        while self._pid == os.getpid() and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+notifier = Notifier()
+atexit.register(notifier.flush)
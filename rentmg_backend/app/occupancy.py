@@ -0,0 +1,225 @@
+"""Per-unit occupancy index answering vacancy questions without scanning leases.
+
+Each unit keeps its occupying leases as ``[start, end]`` intervals (inclusive,
+open ends stored as ``date.min`` / ``date.max``) sorted by start date, plus a
+running maximum of the end dates. "Is the unit occupied anywhere in
+``[a, b]``" is then one bisect for the last lease starting on or before ``b``
+and a comparison of the running maximum with ``a`` -- O(log n) in the unit's
+lease count, and still correct if historical leases overlap.
+
+A property's timelines are loaded with two indexed queries on first use and
+kept current from committed ORM writes to ``Lease`` and ``Unit`` in this
+process. Writes made by other workers are picked up when the entry is
+reloaded after ``OCCUPANCY_TTL_SECONDS``.
+"""
+import threading
+import time
+from bisect import bisect_right
+from datetime import date
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .models import Lease, Unit
+
+OCCUPANCY_TTL_SECONDS = 300
+
+# Leases that hold, or held, the unit for their term: expire_leases turns an
+# active lease "ended" once its end_date has passed. Any other status
+# (cancelled, ...) never held the unit and does not block its dates.
+OCCUPYING_STATUSES = ("active", "ended")
+
+
+def lease_interval(start, end):
+    return start or date.min, end or date.max
+
+
+class UnitTimeline:
+    """Sorted lease intervals of one unit with a prefix maximum of end dates."""
+
+    __slots__ = ("starts", "ends", "lease_ids", "max_end")
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.lease_ids = []
+        self.max_end = []
+
+    def add(self, lease_id, start, end):
+        start, end = lease_interval(start, end)
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.lease_ids.insert(i, lease_id)
+        self.max_end.insert(i, end)
+        self._refresh(i)
+
+    def remove(self, lease_id):
+        try:
+            i = self.lease_ids.index(lease_id)
+        except ValueError:
+            return
+        for column in (self.starts, self.ends, self.lease_ids, self.max_end):
+            del column[i]
+        self._refresh(i)
+
+    def _refresh(self, i):
+        running = self.max_end[i - 1] if i else date.min
+        for j in range(i, len(self.ends)):
+            running = max(running, self.ends[j])
+            self.max_end[j] = running
+
+    def occupied(self, start, end=None):
+        """True if any lease overlaps ``[start, end]`` (a single day when ``end`` is None)."""
+        end = end or start
+        i = bisect_right(self.starts, end)
+        return i > 0 and self.max_end[i - 1] >= start
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class OccupancyIndex:
+    def __init__(self, ttl=OCCUPANCY_TTL_SECONDS):
+        self.ttl = ttl
+        self._properties = {}  # property_id -> (expires_at, {unit_id: (code, UnitTimeline)})
+        self._leases = {}  # lease_id -> (property_id, unit_id)
+        self._lock = threading.RLock()
+
+    def units(self, session, property_id):
+        """``{unit_id: (code, UnitTimeline)}`` for a property, loading it on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._properties.get(property_id)
+            if hit and hit[0] > now:
+                return hit[1]
+
+        units = {
+            unit_id: (code, UnitTimeline())
+            for unit_id, code in session.execute(
+                select(Unit.id, Unit.code).where(Unit.property_id == property_id).order_by(Unit.id)
+            )
+        }
+        rows = []
+        if units:
+            rows = session.execute(
+                select(Lease.id, Lease.unit_id, Lease.start_date, Lease.end_date)
+                .where(Lease.unit_id.in_(units), Lease.status.in_(OCCUPYING_STATUSES))
+            ).all()
+        with self._lock:
+            self._forget(property_id)
+            for lease_id, unit_id, start, end in rows:
+                units[unit_id][1].add(lease_id, start, end)
+                self._leases[lease_id] = (property_id, unit_id)
+            self._properties[property_id] = (now + self.ttl, units)
+        return units
+
+    def _forget(self, property_id):
+        self._properties.pop(property_id, None)
+        for lease_id in [k for k, v in self._leases.items() if v[0] == property_id]:
+            del self._leases[lease_id]
+
+    def invalidate(self, property_id=None):
+        with self._lock:
+            if property_id is None:
+                self._properties.clear()
+                self._leases.clear()
+            else:
+                self._forget(property_id)
+
+    def apply_lease(self, lease_id, property_id, unit_id, start, end, status):
+        """Move a committed lease to its current interval (``status=None`` for a delete)."""
+        with self._lock:
+            old = self._leases.pop(lease_id, None)
+            if old and old[0] in self._properties:
+                self._properties[old[0]][1][old[1]][1].remove(lease_id)
+            if status not in OCCUPYING_STATUSES or property_id not in self._properties:
+                return
+            units = self._properties[property_id][1]
+            if unit_id not in units:
+                self._forget(property_id)  # unit created elsewhere; reload on next read
+                return
+            units[unit_id][1].add(lease_id, start, end)
+            self._leases[lease_id] = (property_id, unit_id)
+
+
+index = OccupancyIndex()
+
+
+def parse_period(on=None, start=None, end=None):
+    """``(start, end)`` from ``?on=`` or ``?from=&to=`` ISO dates; today when neither is given.
+
+    Raises ValueError for malformed dates or an inverted range.
+    """
+    if start or end:
+        start = date.fromisoformat(start) if start else date.today()
+        end = date.fromisoformat(end) if end else start
+        if end < start:
+            raise ValueError("'to' is before 'from'")
+        return start, end
+    return (date.fromisoformat(on) if on else date.today()), None
+
+
+def _summary(unit_count, vacant_count):
+    return {
+        "unit_count": unit_count,
+        "vacant_count": vacant_count,
+        "vacancy_rate": round(vacant_count / unit_count, 4) if unit_count else None,
+    }
+
+
+def property_report(session, property_id, start, end=None):
+    """Vacancy of every unit in a property on ``start`` or over ``[start, end]``.
+
+    Over a range a unit is vacant only if it is free for the whole range.
+    """
+    units = [
+        {"unit_id": unit_id, "code": code, "vacant": not timeline.occupied(start, end)}
+        for unit_id, (code, timeline) in index.units(session, property_id).items()
+    ]
+    vacant = sum(u["vacant"] for u in units)
+    return {"property_id": property_id, **_summary(len(units), vacant), "units": units}
+
+
+def portfolio_report(session, property_ids, start, end=None):
+    """Per-property and overall vacancy rates for a set of properties."""
+    properties = []
+    for property_id in sorted(property_ids):
+        report = property_report(session, property_id, start, end)
+        del report["units"]
+        properties.append(report)
+    return {
+        **_summary(sum(p["unit_count"] for p in properties), sum(p["vacant_count"] for p in properties)),
+        "properties": properties,
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("occupancy_changes", [])
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Lease):
+            changes.append(("lease", obj.id, obj.property_id, obj.unit_id, obj.start_date, obj.end_date, obj.status))
+        elif isinstance(obj, Unit):
+            history = inspect(obj).attrs.property_id.history
+            for property_id in {obj.property_id, *history.deleted}:
+                changes.append(("unit", property_id))
+    for obj in session.deleted:
+        if isinstance(obj, Lease):
+            changes.append(("lease", obj.id, None, None, None, None, None))
+        elif isinstance(obj, Unit):
+            changes.append(("unit", obj.property_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    for change in session.info.pop("occupancy_changes", ()):
+        if change[0] == "lease":
+            index.apply_lease(*change[1:])
+        else:
+            index.invalidate(change[1])
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changes(session):
+    session.info.pop("occupancy_changes", None)
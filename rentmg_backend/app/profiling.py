@@ -0,0 +1,391 @@
+"""On-demand profiling for both stacks, for the admins in ``ADMIN_USER_IDS`` only (see app/admins.py).
+
+Three tools, all per worker process:
+
+* **Per-request profiles.** A request from an admin carrying
+  ``X-Profile: 1`` (or ``cprofile``) runs under cProfile. ``X-Profile:
+  pyinstrument`` uses pyinstrument when that optional package is installed.
+  Independently, ``PROFILE_SAMPLE_RATE`` (0 by default) profiles that fraction
+  of all requests. The response carries ``X-Profile-Id``, and the last
+  ``PROFILE_KEEP`` profiles can be read under ``/api/admin/profile/requests``.
+  Flask profiles the whole request. FastAPI profiles the endpoint function in
+  the thread that runs it; an async endpoint also picks up whatever else the
+  event loop ran meanwhile.
+* **Continuous sampling.** A thread snapshots every thread's stack each
+  ``PROFILE_SAMPLER_INTERVAL`` seconds (10 ms) and keeps per-second counts for
+  ``PROFILE_SAMPLER_WINDOW`` seconds. ``/api/admin/profile/flamegraph``
+  returns them as folded stacks for flamegraph.pl or speedscope. It starts with
+  ``PROFILE_SAMPLER_ENABLED``, or at runtime with ``POST
+  /api/admin/profile/sampler``.
+* **tracemalloc.** Start tracing, exercise the suspect endpoint (say a large
+  list), then read the allocations that grew since tracing started, grouped
+  by source line.
+"""
+import cProfile
+import functools
+import inspect
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime
+
+from . import admins
+
+try:
+    import pyinstrument
+except ImportError:  # optional
+    pyinstrument = None
+
+HEADER = "X-Profile"
+ID_HEADER = "X-Profile-Id"
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+settings = {"PROFILE_SAMPLE_RATE": 0.0, "PROFILE_KEEP": 50, "PROFILE_SAMPLER_ENABLED": False,
+            "PROFILE_SAMPLER_INTERVAL": 0.01, "PROFILE_SAMPLER_WINDOW": 300}
+
+
+def configure(config):
+    """Apply PROFILE_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+
+
+def is_admin(claims):
+    return admins.is_admin((claims or {}).get("sub") or (claims or {}).get("identity"))
+
+
+# ----------------------------
+# Per-request profiles
+# ----------------------------
+class RequestProfile:
+    """One profiled request; started and stopped in the thread doing the work."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, method, path, engine):
+        self.id = f"{os.getpid()}-{next(self._ids)}"
+        self.method = method
+        self.path = path
+        self.engine = engine
+        self.at = datetime.utcnow()
+        self.duration = None
+        self._profiler = None
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def claim(self):
+        """True for the first caller only, so nested endpoints (batch) do not restart the profiler."""
+        with self._lock:
+            claimed, self._claimed = self._claimed, True
+        return not claimed
+
+    def start(self):
+        self._profiler = pyinstrument.Profiler(async_mode="disabled") if self.engine == "pyinstrument" \
+            else cProfile.Profile()
+        self._started = time.perf_counter()
+        if self.engine == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.engine == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        self.duration = time.perf_counter() - self._started
+
+    def summary(self):
+        return {"id": self.id, "method": self.method, "path": self.path, "engine": self.engine,
+                "at": self.at.isoformat(timespec="seconds"),
+                "duration_ms": None if self.duration is None else round(self.duration * 1000, 3)}
+
+    def report(self, sort="cumulative", limit=50):
+        if self.engine == "pyinstrument":
+            return self._profiler.output_text(unicode=False, color=False)
+        out = io.StringIO()
+        out.write(f"{self.method} {self.path} {self.summary()['duration_ms']} ms\n")
+        pstats.Stats(self._profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+_profiles = OrderedDict()  # id -> RequestProfile, most recent last
+_profiles_lock = threading.Lock()
+_current = ContextVar("rentmg_profile", default=None)
+
+
+def choose(header_value, admin):
+    """Profiler for a request: the header (admins only) wins over random sampling."""
+    header_value = (header_value or "").strip().lower()
+    if header_value and header_value not in ("0", "false") and admin:
+        return "pyinstrument" if header_value == "pyinstrument" and pyinstrument is not None else "cprofile"
+    rate = settings["PROFILE_SAMPLE_RATE"]
+    if rate and random.random() < rate:
+        return "cprofile"
+    return None
+
+
+def keep(profile):
+    if profile.duration is None:  # never ran, e.g. the route did not exist
+        return
+    with _profiles_lock:
+        _profiles[profile.id] = profile
+        while len(_profiles) > settings["PROFILE_KEEP"]:
+            _profiles.popitem(last=False)
+
+
+def recent():
+    with _profiles_lock:
+        return [p.summary() for p in reversed(_profiles.values())]
+
+
+def find(profile_id):
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def flask_before_request():
+    from flask import g, request
+
+    sampler.ensure()
+    admin = False
+    if request.headers.get(HEADER):
+        admin = _flask_admin(request.headers.get("Authorization", ""))
+    engine = choose(request.headers.get(HEADER), admin)
+    if engine is not None:
+        g.rentmg_profile = profile = RequestProfile(request.method, request.path, engine)
+        profile.claim()
+        profile.start()
+
+
+def _flask_admin(authorization):
+    from flask_jwt_extended import decode_token
+
+    from . import tokens
+    from .extensions import db
+
+    if not authorization.startswith("Bearer "):
+        return False
+    try:
+        claims = decode_token(authorization[7:])
+        return is_admin(claims) and not tokens.is_revoked(claims, db.engine)
+    except Exception:  # bad, expired or revoked token: just not profiled
+        return False
+
+
+def flask_after_request(response):
+    from flask import g
+
+    profile = g.get("rentmg_profile")
+    if profile is not None:
+        response.headers[ID_HEADER] = profile.id
+    return response
+
+
+def flask_teardown_request(exc):
+    from flask import g
+
+    profile = g.pop("rentmg_profile", None)
+    if profile is not None:
+        profile.stop()
+        keep(profile)
+
+
+class ProfileMiddleware:
+    """ASGI side: picks requests to profile; :func:`profiled` endpoints do the profiling."""
+
+    def __init__(self, app, decode_claims):
+        self.app = app
+        self.decode_claims = decode_claims  # bearer token -> claims, raising if invalid
+
+    def _admin(self, headers):
+        authorization = headers.get(b"authorization", b"").decode()
+        if not authorization.startswith("Bearer "):
+            return False
+        try:
+            return is_admin(self.decode_claims(authorization[7:]))
+        except Exception:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        sampler.ensure()
+        headers = dict(scope["headers"])
+        header_value = headers.get(HEADER.lower().encode(), b"").decode()
+        engine = choose(header_value, bool(header_value) and self._admin(headers))
+        if engine is None:
+            return await self.app(scope, receive, send)
+        profile = RequestProfile(scope["method"], scope["path"], engine)
+
+        async def wrapped_send(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (ID_HEADER.lower().encode(), profile.id.encode())]
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            _current.reset(token)
+            keep(profile)
+
+
+def profiled(endpoint):
+    """Wrap a FastAPI endpoint so it runs under the request's profiler, if one was chosen."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None or not profile.claim():
+                return await endpoint(*args, **kwargs)
+            profile.start()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.stop()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None or not profile.claim():
+                return endpoint(*args, **kwargs)
+            profile.start()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                profile.stop()
+    return wrapper
+
+
+# ----------------------------
+# Continuous sampling
+# ----------------------------
+def _fold(thread_name, frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    stack.append(thread_name)
+    return ";".join(reversed(stack))
+
+
+class Sampler:
+    """Background thread counting folded stacks of every thread in one-second buckets."""
+
+    def __init__(self):
+        self._buckets = deque()  # (epoch second, Counter of folded stacks)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._generation = 0  # bumped on start/stop so an old thread exits instead of doubling up
+
+    @property
+    def running(self):
+        return self._pid == os.getpid()
+
+    def ensure(self):
+        """Start the sampler in this process if it is enabled (threads do not survive a fork)."""
+        if settings["PROFILE_SAMPLER_ENABLED"] and self._pid != os.getpid():
+            self.start()
+
+    def start(self):
+        with self._lock:
+            settings["PROFILE_SAMPLER_ENABLED"] = True
+            if self._pid == os.getpid():
+                return
+            self._generation += 1
+            threading.Thread(target=self._run, args=(self._generation,), name="profile-sampler",
+                             daemon=True).start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            settings["PROFILE_SAMPLER_ENABLED"] = False
+            self._generation += 1
+            self._pid = None
+
+    def _run(self, generation):
+        me = threading.get_ident()
+        while True:
+            time.sleep(settings["PROFILE_SAMPLER_INTERVAL"])
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [_fold(names.get(ident, str(ident)), frame)
+                      for ident, frame in sys._current_frames().items() if ident != me]
+            now = int(time.time())
+            with self._lock:
+                if generation != self._generation or self._pid != os.getpid():
+                    return
+                if not self._buckets or self._buckets[-1][0] != now:
+                    self._buckets.append((now, Counter()))
+                    while self._buckets[0][0] <= now - settings["PROFILE_SAMPLER_WINDOW"]:
+                        self._buckets.popleft()
+                self._buckets[-1][1].update(stacks)
+
+    def folded(self, seconds=None):
+        """Folded stacks (``a;b;c count`` per line) over the last ``seconds`` of the window."""
+        since = int(time.time()) - (seconds or settings["PROFILE_SAMPLER_WINDOW"])
+        total = Counter()
+        with self._lock:
+            for second, counts in self._buckets:
+                if second > since:
+                    total.update(counts)
+        return "".join(f"{stack} {count}\n" for stack, count in total.most_common())
+
+
+sampler = Sampler()
+
+
+# ----------------------------
+# tracemalloc
+# ----------------------------
+_baseline = None
+
+
+def _filtered(snapshot, path=None):
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+    if path:
+        filters.append(tracemalloc.Filter(True, f"*{path}*"))
+    return snapshot.filter_traces(filters)
+
+
+def start_tracemalloc(frames=1):
+    """Start tracing (if needed) and take the baseline later reports compare against."""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _baseline = tracemalloc.take_snapshot()
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+def tracemalloc_report(limit=25, path=None):
+    """Allocation growth since the baseline, by source line, largest first; None if not tracing."""
+    if not tracemalloc.is_tracing() or _baseline is None:
+        return None
+    snapshot = _filtered(tracemalloc.take_snapshot(), path)
+    current, peak = tracemalloc.get_traced_memory()
+    top = snapshot.compare_to(_filtered(_baseline, path), "lineno")[:limit]
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": [
+            {"file": stat.traceback[0].filename, "line": stat.traceback[0].lineno, "size": stat.size,
+             "size_diff": stat.size_diff, "count": stat.count, "count_diff": stat.count_diff}
+            for stat in top
+        ],
+    }
+
+
+def stop_tracemalloc():
+    global _baseline
+    tracemalloc.stop()
+    _baseline = None
+    return {"tracing": False}
@@ -0,0 +1,195 @@
+"""Admission control for the expensive auth and payment endpoints.
+
+Two mechanisms, both cheap enough to run before any DB or hashing work:
+
+* Token-bucket rate limits keyed by client IP, account email, user id or phone.
+  Buckets live in a bounded in-process LRU (idle buckets expire once they have
+  refilled) or, when ``RATELIMIT_STORAGE_URL`` points at Redis, in a shared
+  store so limits hold across workers.
+* Concurrency-based load shedding per endpoint pool: once the number of
+  in-flight requests reaches the pool limit, or the recent latency average
+  crosses its threshold, new requests are refused immediately with 503 rather
+  than queueing behind the slow ones.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify
+
+from . import metrics
+
+Rule = namedtuple("Rule", "rate burst")  # tokens per second, bucket capacity
+
+RULES = {
+    "login:ip": Rule(rate=20 / 60, burst=20),
+    "login:email": Rule(rate=5 / 60, burst=5),
+    "register:ip": Rule(rate=10 / 60, burst=10),
+    "mpesa:user": Rule(rate=5 / 60, burst=5),
+    "mpesa:phone": Rule(rate=3 / 60, burst=3),
+}
+
+
+class MemoryStore:
+    """Thread-safe token buckets in a size-bounded LRU."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, rule, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (rule.burst, now))
+            tokens = min(rule.burst, tokens + (now - updated) * rule.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # A bucket that has refilled carries no state; let it drop out
+            if tokens < rule.burst:
+                self._buckets[key] = (tokens, now)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            return allowed, 0 if allowed else math.ceil((1 - tokens) / rule.rate)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+_REDIS_TAKE = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or ARGV[2])
+local updated = tonumber(redis.call('HGET', KEYS[1], 'u') or ARGV[3])
+tokens = math.min(tonumber(ARGV[2]), tokens + (tonumber(ARGV[3]) - updated) * tonumber(ARGV[1]))
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('HSET', KEYS[1], 't', tokens, 'u', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) / tonumber(ARGV[1])) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisStore:
+    """Token buckets shared across workers; needs the optional ``redis`` package."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("RATELIMIT_STORAGE_URL requires the 'redis' package") from exc
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def take(self, key, rule, now):
+        allowed, tokens = self._take(keys=[f"rl:{key}"], args=[rule.rate, rule.burst, now])
+        if allowed:
+            return True, 0
+        return False, math.ceil((1 - float(tokens)) / rule.rate)
+
+    def clear(self):
+        pass
+
+
+_store = MemoryStore()
+enabled = True
+
+
+def configure(config):
+    """Apply RATELIMIT_* settings; called from create_app and the FastAPI module."""
+    global _store, enabled
+    enabled = config.get("RATELIMIT_ENABLED", True)
+    url = config.get("RATELIMIT_STORAGE_URL")
+    _store = RedisStore(url) if url else MemoryStore()
+    POOLS["auth"].max_inflight = config.get("SHED_AUTH_MAX_INFLIGHT", POOLS["auth"].max_inflight)
+    POOLS["payments"].max_inflight = config.get("SHED_PAYMENTS_MAX_INFLIGHT", POOLS["payments"].max_inflight)
+
+
+def check(*hits):
+    """Take a token for each ``(rule_name, key)``; returns seconds to wait, or 0 if allowed.
+
+    Empty keys are skipped so callers can pass optional fields straight through.
+    """
+    if not enabled:
+        return 0
+    now = time.time()
+    for rule_name, key in hits:
+        if not key:
+            continue
+        allowed, retry_after = _store.take(f"{rule_name}:{key}", RULES[rule_name], now)
+        if not allowed:
+            metrics.incr(f"ratelimit.rejected.{rule_name}")
+            return max(retry_after, 1)
+    return 0
+
+
+class Overloaded(Exception):
+    def __init__(self, pool, retry_after=1):
+        super().__init__(f"{pool} overloaded")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class Shedder:
+    """Refuse work once in-flight requests or the latency EWMA exceed the pool limits.
+
+    While latency is above ``max_latency`` the pool only admits half of
+    ``max_inflight``, which drains the backlog instead of adding to it.
+    """
+
+    def __init__(self, name, max_inflight, max_latency, alpha=0.2):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_latency = max_latency
+        self.alpha = alpha
+        self.inflight = 0
+        self.latency = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            limit = self.max_inflight
+            if self.latency > self.max_latency:
+                limit = max(1, limit // 2)
+            if enabled and self.inflight >= limit:
+                metrics.incr(f"shed.rejected.{self.name}")
+                raise Overloaded(self.name)
+            self.inflight += 1
+            metrics.gauge(f"shed.inflight.{self.name}", self.inflight)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.inflight -= 1
+                self.latency += self.alpha * (elapsed - self.latency)
+                metrics.gauge(f"shed.inflight.{self.name}", self.inflight)
+
+
+POOLS = {
+    "auth": Shedder("auth", max_inflight=8, max_latency=1.0),
+    "payments": Shedder("payments", max_inflight=16, max_latency=5.0),
+}
+
+
+def shed(pool):
+    """Flask view decorator answering 503 when ``pool`` is saturated."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with POOLS[pool].admit():
+                    return view(*args, **kwargs)
+            except Overloaded as exc:
+                return jsonify({"error": "server busy, retry shortly"}), 503, {"Retry-After": str(exc.retry_after)}
+        return wrapper
+    return decorator
+
+
+def too_many(retry_after):
+    """Flask 429 response for a failed :func:`check`."""
+    return jsonify({"error": "too many requests"}), 429, {"Retry-After": str(retry_after)}
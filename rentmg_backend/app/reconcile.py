@@ -0,0 +1,127 @@
+"""Reconcile pending M-Pesa payments whose Daraja callback never arrived.
+
+Stale pending payments are taken oldest first, queried with the STK Push
+Query API on a bounded thread pool (sharing the cached OAuth token), and the
+outcomes are applied with one bulk UPDATE per status. Checkout ids that are
+still in flight or error out are retried with per-id exponential backoff;
+ids still backing off are excluded in SQL, so they never take batch slots
+from newer payments. Backoff entries for payments settled elsewhere (the
+callback, ``fail_stale_payments``) are dropped at the start of each run.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import select, update
+
+from . import metrics
+from .models import Payment
+from .services_mpesa import stk_query
+
+log = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+_backoff_lock = threading.Lock()
+_backoff = {}  # checkout id -> (attempts, monotonic time of next allowed query)
+
+
+def _deferred(session, now):
+    """Checkout ids still backing off at ``now``; forgets those no longer pending."""
+    with _backoff_lock:
+        tracked = list(_backoff)
+        waiting = {checkout_id for checkout_id, (_, due) in _backoff.items() if due > now}
+    if not tracked:
+        return []
+    pending = set(session.execute(
+        select(Payment.mpesa_checkout_id)
+        .where(Payment.mpesa_checkout_id.in_(tracked), Payment.status == "pending")
+    ).scalars())
+    _forget([checkout_id for checkout_id in tracked if checkout_id not in pending])
+    return sorted(waiting & pending)
+
+
+def _defer(checkout_id, now):
+    with _backoff_lock:
+        attempts = _backoff.get(checkout_id, (0, 0))[0] + 1
+        delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+        _backoff[checkout_id] = (attempts, now + delay)
+
+
+def _forget(checkout_ids):
+    with _backoff_lock:
+        for checkout_id in checkout_ids:
+            _backoff.pop(checkout_id, None)
+
+
+def classify(resp):
+    """Map an STK query response to completed/failed, or None if still unresolved."""
+    if "errorCode" in resp:
+        return None
+    code = str(resp.get("ResultCode", ""))
+    if code == "0":
+        return "completed"
+    if code:
+        return "failed"
+    return None
+
+
+def _query(checkout_id, config):
+    try:
+        with metrics.timer("mpesa.stk_query_seconds"):
+            return checkout_id, classify(stk_query(checkout_id, config=config))
+    except Exception as exc:
+        metrics.incr("mpesa.reconcile.query_errors")
+        log.warning("stk query failed for %s: %s", checkout_id, exc)
+        return checkout_id, None
+
+
+def reconcile_pending_payments(session, config, now):
+    """Resolve one batch of stale pending payments; returns how many were settled."""
+    min_age = timedelta(seconds=config["MPESA_RECONCILE_MIN_AGE"])
+    mono = time.monotonic()
+    stmt = select(Payment.id, Payment.mpesa_checkout_id, Payment.created_at).where(
+        Payment.status == "pending",
+        Payment.mpesa_checkout_id.isnot(None),
+        Payment.created_at < now - min_age,
+    )
+    deferred = _deferred(session, mono)
+    if deferred:
+        stmt = stmt.where(Payment.mpesa_checkout_id.notin_(deferred))
+    rows = session.execute(stmt.order_by(Payment.created_at).limit(config["JOB_BATCH_SIZE"])).all()
+    metrics.gauge("mpesa.reconcile.pending_stale", len(rows))
+    metrics.gauge(
+        "mpesa.reconcile.lag_seconds",
+        (now - rows[0].created_at).total_seconds() if rows else 0,
+    )
+
+    if not rows:
+        return 0
+    with ThreadPoolExecutor(max_workers=config["MPESA_RECONCILE_CONCURRENCY"]) as pool:
+        results = list(pool.map(lambda r: _query(r.mpesa_checkout_id, config), rows))
+
+    by_status = {"completed": [], "failed": []}
+    created = {r.mpesa_checkout_id: r.created_at for r in rows}
+    for checkout_id, outcome in results:
+        if outcome is None:
+            _defer(checkout_id, mono)
+            continue
+        by_status[outcome].append(checkout_id)
+        metrics.observe("mpesa.reconcile.settle_lag_seconds", (now - created[checkout_id]).total_seconds())
+
+    for outcome, checkout_ids in by_status.items():
+        if checkout_ids:
+            session.execute(
+                update(Payment)
+                .where(Payment.mpesa_checkout_id.in_(checkout_ids), Payment.status == "pending")
+                .values(status=outcome, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            metrics.incr(f"mpesa.reconcile.{outcome}", len(checkout_ids))
+    session.commit()
+    settled = by_status["completed"] + by_status["failed"]
+    _forget(settled)
+    return len(settled)
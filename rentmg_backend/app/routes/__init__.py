@@ -1,13 +1,28 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify
+from ..services import ServiceError
+from ..sharding import RETRY_AFTER_SECONDS, LandlordMoving
 from .auth import bp as auth_bp
 from .properties import bp as properties_bp
 from .units import bp as units_bp
 from .issues import bp as issues_bp
 from .payments import bp as payments_bp
 from .leases import bp as leases_bp
+from .statements import bp as statements_bp
+from .audit import bp as audit_bp
+from .profiling import bp as profiling_bp
 from .root import bp as root_bp
 
+def _service_error(exc):
+    return jsonify(exc.body()), exc.status
+
+
+def _landlord_moving(exc):
+    return jsonify({"error": str(exc)}), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
 def register_routes(app):
+    app.register_error_handler(ServiceError, _service_error)
+    app.register_error_handler(LandlordMoving, _landlord_moving)
     app.register_blueprint(root_bp)
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(properties_bp, url_prefix="/api/properties")
@@ -15,3 +30,6 @@ def register_routes(app):
     app.register_blueprint(issues_bp, url_prefix="/api/issues")
     app.register_blueprint(payments_bp, url_prefix="/api/payments")
     app.register_blueprint(leases_bp, url_prefix="/api/leases")
+    app.register_blueprint(statements_bp, url_prefix="/api/statements")
+    app.register_blueprint(audit_bp, url_prefix="/api/audit")
+    app.register_blueprint(profiling_bp, url_prefix="/api/admin/profile")
@@ -0,0 +1,17 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..extensions import db
+from .. import services
+
+bp = Blueprint("audit", __name__)
+
+
+@bp.get("/")
+@jwt_required()
+def list_events():
+    args = request.args
+    return jsonify(services.audit_events(
+        db.session, get_jwt_identity(), entity=args.get("entity"), entity_id=args.get("entity_id", type=int),
+        actor_id=args.get("actor_id", type=int), since=args.get("since"), until=args.get("until"),
+        after_id=args.get("after_id", type=int), limit=args.get("limit", 100, type=int),
+    ))
@@ -0,0 +1,55 @@
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .. import services
+
+bp = Blueprint("profiling", __name__)
+
+
+def _text(body):
+    return Response(body, mimetype="text/plain")
+
+
+@bp.get("/requests")
+@jwt_required()
+def recent_profiles():
+    return jsonify(services.recent_profiles(get_jwt_identity()))
+
+
+@bp.get("/requests/<profile_id>")
+@jwt_required()
+def profile_report(profile_id):
+    return _text(services.profile_report(get_jwt_identity(), profile_id, request.args.get("sort", "cumulative"),
+                                         request.args.get("limit", 50, type=int)))
+
+
+@bp.get("/flamegraph")
+@jwt_required()
+def flamegraph():
+    return _text(services.flamegraph(get_jwt_identity(), request.args.get("seconds", type=int)))
+
+
+@bp.post("/sampler")
+@jwt_required()
+def set_sampler():
+    data = request.get_json(silent=True) or {}
+    return jsonify(services.set_sampler(get_jwt_identity(), bool(data.get("enabled", True))))
+
+
+@bp.post("/tracemalloc")
+@jwt_required()
+def start_tracemalloc():
+    data = request.get_json(silent=True) or {}
+    return jsonify(services.start_tracemalloc(get_jwt_identity(), data.get("frames", 1)))
+
+
+@bp.get("/tracemalloc")
+@jwt_required()
+def tracemalloc_report():
+    return jsonify(services.tracemalloc_report(get_jwt_identity(), request.args.get("limit", 25, type=int),
+                                               request.args.get("path")))
+
+
+@bp.delete("/tracemalloc")
+@jwt_required()
+def stop_tracemalloc():
+    return jsonify(services.stop_tracemalloc(get_jwt_identity()))
@@ -1,46 +1,40 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..extensions import db
-from ..models import Property
+from .. import services
 
 bp = Blueprint("properties", __name__)
 
 
-def _serialize_property(p: Property):
-    return {
-        "id": p.id,
-        "name": p.name,
-        "address": p.address,
-        "landlord_id": p.landlord_id,
-        "created_at": p.created_at.isoformat(timespec="seconds") if p.created_at else None,
-        "updated_at": p.updated_at.isoformat(timespec="seconds") if p.updated_at else None,
-    }
-
-
 @bp.get("/")
 @jwt_required()
 def list_properties():
-    ident = get_jwt_identity()
-    q = Property.query
-    if ident["role"] == "landlord":
-        q = q.filter_by(landlord_id=ident["id"])
-    items = [_serialize_property(p) for p in q.all()]
-    return jsonify(items)
+    return jsonify(services.list_properties(db.session, get_jwt_identity()))
 
 
 @bp.get("/<int:property_id>")
 @jwt_required()
 def get_property(property_id):
-    prop = Property.query.get_or_404(property_id)
-    return jsonify(_serialize_property(prop))
+    return jsonify(services.get_property(db.session, get_jwt_identity(), property_id))
+
+
+def _period():
+    return request.args.get("on"), request.args.get("from"), request.args.get("to")
+
+
+@bp.get("/occupancy")
+@jwt_required()
+def portfolio_occupancy():
+    return jsonify(services.portfolio_occupancy(db.session, get_jwt_identity(), *_period()))
+
+
+@bp.get("/<int:property_id>/occupancy")
+@jwt_required()
+def property_occupancy(property_id):
+    return jsonify(services.property_occupancy(db.session, get_jwt_identity(), property_id, *_period()))
 
 
 @bp.post("/")
 @jwt_required()
 def create_property():
-    ident = get_jwt_identity()
-    if ident["role"] != "landlord": return jsonify({"error":"only landlord"}), 403
-    data = request.get_json() or {}
-    p = Property(name=data.get("name"), address=data.get("address"), landlord_id=ident["id"])
-    db.session.add(p); db.session.commit()
-    return jsonify(_serialize_property(p)), 201
+    return jsonify(services.create_property(db.session, get_jwt_identity(), request.get_json() or {})), 201
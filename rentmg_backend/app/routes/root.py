@@ -1,4 +1,6 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from .. import metrics
+from ..services import Forbidden
 
 bp = Blueprint("root", __name__)
 
@@ -22,6 +24,13 @@ def health():
     return jsonify({"status": "ok"})
 
 
+@bp.get("/metrics")
+def metrics_snapshot():
+    if not metrics.authorized(request.headers.get("Authorization")):
+        raise Forbidden("metrics token required")
+    return jsonify(metrics.snapshot())
+
+
 @bp.get("/docs")
 def docs():
     """Simple docs hint for the Flask server."""
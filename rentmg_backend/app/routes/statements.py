@@ -0,0 +1,31 @@
+from flask import Blueprint, current_app, request, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..extensions import db
+from .. import services
+from ..statements import FORMATS, cached_document, download_name
+
+bp = Blueprint("statements", __name__)
+
+
+def send_document(doc, fmt):
+    """Serve a rendered document from the content-hash cache (ETag + Range via ``conditional``)."""
+    path, key = cached_document(doc, fmt, current_app.config)
+    return send_file(path, mimetype=FORMATS[fmt], as_attachment=True, download_name=download_name(doc, fmt),
+                     conditional=True, etag=key)
+
+
+@bp.get("/tenant")
+@jwt_required()
+def tenant_statement_document():
+    args = request.args
+    fmt = services.document_format(args.get("format", "pdf"))
+    doc = services.tenant_statement(db.session, get_jwt_identity(), args.get("tenant_id", type=int), args.get("month"))
+    return send_document(doc, fmt)
+
+
+@bp.get("/property/<int:property_id>")
+@jwt_required()
+def property_statement_document(property_id):
+    fmt = services.document_format(request.args.get("format", "pdf"))
+    doc = services.property_statement(db.session, get_jwt_identity(), property_id, request.args.get("month"))
+    return send_document(doc, fmt)
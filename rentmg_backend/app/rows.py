@@ -0,0 +1,32 @@
+"""Lightweight read-only rows for list endpoints.
+
+Loading ``Payment`` or ``Issue`` through the ORM builds an instrumented
+instance per row, with an ``InstanceState`` and a ``__dict__``, and keeps each
+one in the session's identity map until the request ends. List endpoints only
+read the rows and serialize them. So they select the table's columns with Core
+and wrap each result row in a named tuple that has the same attribute names.
+The ``serializers`` payload functions accept either form unchanged.
+``bench_memory.py`` measures the difference.
+"""
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from .models import Issue, Payment, PaymentArchive
+
+
+def _row_type(model):
+    return namedtuple(f"{model.__name__}Row", [column.key for column in model.__table__.columns])
+
+
+ROW_TYPES = {model: _row_type(model) for model in (Issue, Payment, PaymentArchive)}
+
+
+def select_rows(model):
+    """``select()`` of every column of ``model``'s table, to pass through apply_scope and fetch()."""
+    return select(*model.__table__.columns)
+
+
+def fetch(session, stmt, model):
+    make = ROW_TYPES[model]._make
+    return [make(row) for row in session.execute(stmt)]
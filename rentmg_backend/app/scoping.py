@@ -0,0 +1,136 @@
+"""Role-based row scoping shared by the Flask blueprints and the FastAPI app.
+
+A scope is compiled once per identity (the landlord's property and unit ids are
+resolved with two small indexed queries) and cached for a short TTL, so routes
+filter with cheap IN / equality predicates instead of re-joining
+Payment -> Lease -> Unit -> Property on every request. Leases and payments
+carry a denormalized ``landlord_id`` and are filtered on it directly.
+
+A landlord's scope goes stale when they add a property or unit.
+:func:`invalidate_scope` publishes the drop on the entity cache's bus, so
+every worker forgets it, not just the one that served the write. Callers
+about to refuse a request pass the ids they check to :func:`compile_scope`;
+a cached scope missing one of them is recompiled once before the answer.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import false, or_, select
+
+from . import cache, metrics
+from .models import Property, Unit, Lease, Payment, PaymentArchive, Issue
+
+SCOPE_TTL_SECONDS = 60
+BUS_KEY = "scopes"  # invalidation keys on the cache bus: (BUS_KEY,) or (BUS_KEY, user_id)
+
+_cache = {}
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Scope:
+    role: str
+    user_id: int
+    property_ids: frozenset = frozenset()
+    unit_ids: frozenset = frozenset()
+
+    @property
+    def is_tenant(self):
+        return self.role == "tenant"
+
+    @property
+    def is_landlord(self):
+        return self.role == "landlord"
+
+    def owns_property(self, property_id):
+        return not self.is_landlord or property_id in self.property_ids
+
+
+def compile_scope(session, identity, property_ids=(), unit_ids=()):
+    """Return the cached scope for a JWT identity, compiling it on a miss.
+
+    ``property_ids``/``unit_ids`` are ids the caller is about to check; a
+    cached landlord scope lacking any of them is recompiled rather than trusted.
+    """
+    key = (identity["role"], identity["id"])
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+    if hit and hit[0] > now:
+        scope = hit[1]
+        if not scope.is_landlord or (set(property_ids) <= scope.property_ids and set(unit_ids) <= scope.unit_ids):
+            return scope
+        metrics.incr("scope.recompiled")
+
+    role, user_id = key
+    property_ids = unit_ids = frozenset()
+    if role == "landlord":
+        property_ids = frozenset(
+            session.execute(select(Property.id).where(Property.landlord_id == user_id)).scalars()
+        )
+        if property_ids:
+            unit_ids = frozenset(
+                session.execute(select(Unit.id).where(Unit.property_id.in_(property_ids))).scalars()
+            )
+    scope = Scope(role=role, user_id=user_id, property_ids=property_ids, unit_ids=unit_ids)
+    with _lock:
+        _cache[key] = (now + SCOPE_TTL_SECONDS, scope)
+    return scope
+
+
+def invalidate_scope(user_id=None):
+    """Drop cached scopes for one user (all roles) or for everyone, in every worker."""
+    cache.publish([(BUS_KEY,) if user_id is None else (BUS_KEY, user_id)])
+
+
+def _drop(keys):
+    with _lock:
+        for key in keys:
+            if key[0] != BUS_KEY:
+                continue
+            if len(key) == 1:
+                _cache.clear()
+                continue
+            for k in [k for k in _cache if k[1] == key[1]]:
+                del _cache[k]
+
+
+cache.subscribe(_drop)
+
+
+def _in(column, ids):
+    return column.in_(ids) if ids else false()
+
+
+def apply_scope(query, model, scope):
+    """Restrict a query over ``model`` to the rows visible to ``scope``.
+
+    Roles other than tenant and landlord are left unrestricted, matching the
+    existing route behaviour for property managers.
+    """
+    if not (scope.is_tenant or scope.is_landlord):
+        return query
+
+    if model is Property:
+        if scope.is_landlord:
+            return query.filter(_in(Property.id, scope.property_ids))
+        return query
+    if model is Unit:
+        if scope.is_landlord:
+            return query.filter(_in(Unit.property_id, scope.property_ids))
+        return query
+    if model is Lease:
+        if scope.is_tenant:
+            return query.filter(Lease.tenant_id == scope.user_id)
+        return query.filter(Lease.landlord_id == scope.user_id)
+    if model is Payment or model is PaymentArchive:
+        if scope.is_tenant:
+            leases = select(Lease.id).where(Lease.tenant_id == scope.user_id)
+            return query.filter(model.lease_id.in_(leases))
+        return query.filter(model.landlord_id == scope.user_id)
+    if model is Issue:
+        if scope.is_tenant:
+            return query.filter(Issue.reporter_id == scope.user_id)
+        return query.filter(or_(_in(Issue.property_id, scope.property_ids), _in(Issue.unit_id, scope.unit_ids)))
+    raise ValueError(f"no scope rule for {model.__name__}")
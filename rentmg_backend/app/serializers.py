@@ -0,0 +1,84 @@
+"""JSON payloads for the API models, shared by the Flask and FastAPI stacks."""
+from .models import Issue, Lease, Payment, Property, Unit, User
+
+
+def _timestamps(obj):
+    return {
+        "created_at": obj.created_at.isoformat(timespec="seconds") if obj.created_at else None,
+        "updated_at": obj.updated_at.isoformat(timespec="seconds") if obj.updated_at else None,
+    }
+
+
+def user_payload(user: User):
+    prop = user.linked_property
+    return {
+        "id": user.id,
+        "email": user.email,
+        "role": user.role,
+        "full_name": user.full_name,
+        "property_id": user.property_id,
+        "property_name": prop.name if prop else None,
+        **_timestamps(user),
+    }
+
+
+def property_payload(p: Property):
+    return {
+        "id": p.id,
+        "name": p.name,
+        "address": p.address,
+        "landlord_id": p.landlord_id,
+        **_timestamps(p),
+    }
+
+
+def unit_payload(u: Unit):
+    return {
+        "id": u.id,
+        "code": u.code,
+        "rent_amount": u.rent_amount,
+        "property_id": u.property_id,
+        **_timestamps(u),
+    }
+
+
+def lease_payload(l: Lease):
+    return {
+        "id": l.id,
+        "unit_id": l.unit_id,
+        "tenant_id": l.tenant_id,
+        "start_date": l.start_date.isoformat() if l.start_date else None,
+        "end_date": l.end_date.isoformat() if l.end_date else None,
+        "status": l.status,
+        "in_arrears": l.in_arrears,
+        "property_id": l.property_id,
+        **_timestamps(l),
+    }
+
+
+def issue_payload(i: Issue):
+    return {
+        "id": i.id,
+        "title": i.title,
+        "description": i.description,
+        "status": i.status,
+        "priority": i.priority,
+        "reporter_id": i.reporter_id,
+        "assignee_id": i.assignee_id,
+        "property_id": i.property_id,
+        "unit_id": i.unit_id,
+        **_timestamps(i),
+    }
+
+
+def payment_payload(p: Payment):
+    return {
+        "id": p.id,
+        "lease_id": p.lease_id,
+        "method": p.method,
+        "amount": p.amount,
+        "status": p.status,
+        "reference": p.reference,
+        "mpesa_checkout_id": p.mpesa_checkout_id,
+        **_timestamps(p),
+    }
@@ -0,0 +1,664 @@
+"""Framework-agnostic request handlers shared by the Flask blueprints and the FastAPI app.
+
+Each function takes a SQLAlchemy session, the caller's identity (``{"id", "role"}``)
+and plain request values, and returns the JSON-ready response body. Failures
+raise a :class:`ServiceError` subclass carrying the HTTP status. Flask renders
+it as ``{"error": ...}`` and FastAPI as ``{"detail": ...}``. Parsing, rate
+limiting and load shedding stay in the adapters, because they depend on the
+request object. Everything that touches the database lives here, so both
+stacks issue the same queries. ``parity_check.py`` verifies that.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import admins, audit, cache, duplicates, metrics, profiling, sharding, statements, tokens
+from .archive import find_payment, parse_history_range, payment_history as load_history
+from .leasing import MAX_IMPORT_ROWS, LeaseConflict, find_overlap, import_leases as insert_leases
+from .models import Issue, Lease, Payment, PaymentArchive, Property, Unit, User, normalize_property_name
+from .occupancy import parse_period, portfolio_report, property_report
+from .rows import fetch, select_rows
+from .scoping import apply_scope, compile_scope, invalidate_scope
+from .serializers import issue_payload, lease_payload, payment_payload, property_payload, unit_payload, user_payload
+from .services_mpesa import stk_push
+from .utils import hash_password_async, verify_password
+from .writes import save, track_round_trips
+
+ROLES = ("tenant", "landlord", "property_manager")
+ISSUE_FIELDS = ("title", "description", "status", "priority", "assignee_id")
+
+
+class ServiceError(Exception):
+    status = 400
+
+    def __init__(self, message, **extra):
+        super().__init__(message)
+        self.message = message
+        self.extra = extra
+
+    def body(self):
+        return {"error": self.message, **self.extra}
+
+
+class BadRequest(ServiceError):
+    status = 400
+
+
+class Unauthorized(ServiceError):
+    status = 401
+
+
+class Forbidden(ServiceError):
+    status = 403
+
+
+class NotFound(ServiceError):
+    status = 404
+
+
+class Conflict(ServiceError):
+    status = 409
+
+
+class UpstreamError(ServiceError):
+    status = 502
+
+
+def _require_role(identity, role):
+    if identity["role"] != role:
+        raise Forbidden(f"only {role}")
+
+
+def _forbid_tenant(identity):
+    if identity["role"] == "tenant":
+        raise Forbidden("forbidden")
+
+
+def _scoped_property(session, identity, property_id):
+    sharding.pin_record(session, identity, Property, property_id)
+    if cache.get(session, Property, property_id) is None:
+        raise NotFound("Property not found")
+    if not compile_scope(session, identity, property_ids=[property_id]).owns_property(property_id):
+        raise Forbidden("forbidden")
+
+
+# ----------------------------
+# Auth
+# ----------------------------
+def register(session, data, issue_tokens):
+    """Create a user (and a landlord's first property).
+
+    ``issue_tokens(user, family=None)`` signs the access/refresh pair in the adapter's JWT flavour.
+    """
+    email, password = data.get("email"), data.get("password")
+    role = (data.get("role") or "tenant").lower()
+    property_name = (data.get("property_name") or "").strip()
+    property_address = (data.get("property_address") or "").strip()
+    if role not in ROLES:
+        raise BadRequest("role must be tenant, landlord, or property_manager")
+    if not email or not password:
+        raise BadRequest("email and password required")
+    if role == "tenant" and not property_name:
+        raise BadRequest("property_name required for tenant signup")
+    if role == "landlord":
+        if not property_name:
+            raise BadRequest("property_name required to create landlord profile")
+        if not property_address:
+            raise BadRequest("property_address required to create landlord profile")
+
+    # Hash on a worker thread while the property lookup and inserts go to the DB
+    password_hash = hash_password_async(password)
+
+    selected_property = None
+    if role == "tenant":
+        key = normalize_property_name(property_name)
+        if sharding.enabled():  # the name cache would answer every shard with the first shard's hit
+            matches = sharding.across(session, lambda: session.query(Property)
+                                      .filter(Property.name_normalized == key).limit(2).all())
+        else:
+            matches = cache.find(session, Property, "name_normalized", key)
+        if not matches:
+            raise NotFound("property not found")
+        if len(matches) > 1:
+            raise Conflict("multiple properties share that name; please use an exact/unique name")
+        selected_property = matches[0]
+        sharding.pin(session, selected_property.landlord_id)
+
+    user = User(email=email, password_hash=password_hash.result(), role=role, full_name=data.get("full_name"),
+                linked_property=selected_property)
+    session.add(user)
+    try:
+        # The unique index on email is the existence check: no SELECT beforehand
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        raise Conflict("email exists")
+
+    if role == "landlord":
+        sharding.place(session, user.id)
+        new_prop = Property(name=property_name, address=property_address or None, landlord_id=user.id)
+        session.add(new_prop)
+        session.flush()
+        user.property_id = new_prop.id
+        user.linked_property = new_prop
+
+    # Build the response before commit expires the instance, so nothing is re-selected
+    body = {"message": "registered", **issue_tokens(user), "user": user_payload(user)}
+    session.commit()
+    return body
+
+
+def _user_body(session, user):
+    prop = cache.get(session, Property, user.property_id)
+    if prop is not None:
+        # Hand the cached row to the relationship so user_payload does not lazy-load it
+        set_committed_value(user, "linked_property", prop)
+    return user_payload(user)
+
+
+def login(session, email, password, issue_tokens):
+    users = cache.find(session, User, "email", email, limit=1) if email else []
+    if not users or not verify_password(users[0].password_hash, password or ""):
+        raise Unauthorized("invalid credentials")
+    sharding.pin_user(session, users[0])
+    return {**issue_tokens(users[0]), "user": _user_body(session, users[0])}
+
+
+def refresh(session, claims, issue_tokens):
+    """Spend a refresh token and issue a new pair in the same family."""
+    if claims.get("type") != "refresh":
+        raise Unauthorized("refresh token required")
+    try:
+        tokens.revoke(session, "jti", claims["jti"], tokens.expiry(claims))
+    except IntegrityError:
+        session.rollback()
+        raise Unauthorized("refresh token already used")
+    user = cache.get(session, User, claims["sub"]["id"])
+    if user is None:
+        session.rollback()
+        raise Unauthorized("invalid credentials")
+    body = issue_tokens(user, family=claims.get("fam"))
+    session.commit()
+    return body
+
+
+def logout(session, claims):
+    """Revoke the caller's login session: this access token and every token of its family."""
+    try:
+        if claims.get("fam"):
+            tokens.revoke(session, "family", claims["fam"])
+        else:
+            tokens.revoke(session, "jti", claims["jti"], tokens.expiry(claims))
+        session.commit()
+    except IntegrityError:
+        session.rollback()  # already logged out
+    return {"message": "logged out"}
+
+
+def revoke_tokens(session, identity, user_id):
+    """Revoke every token issued so far to ``user_id`` (the user themself, or an admin)."""
+    if not isinstance(user_id, int):
+        raise BadRequest("user_id required")
+    if identity["id"] != user_id and not admins.is_admin(identity):
+        raise Forbidden("forbidden")
+    try:
+        tokens.revoke_user(session, user_id)
+        session.commit()
+    except IntegrityError:
+        session.rollback()  # revoked within the same second already
+    return {"message": "revoked"}
+
+
+def me(session, identity):
+    user = cache.get(session, User, identity["id"])
+    if user is None:
+        raise NotFound("User not found")
+    return _user_body(session, user)
+
+
+# ----------------------------
+# Properties
+# ----------------------------
+def list_properties(session, identity):
+    def load(session):
+        q = apply_scope(session.query(Property), Property, compile_scope(session, identity))
+        return [property_payload(p) for p in q.all()]
+    return sharding.gather(session, identity, load)
+
+
+def get_property(session, identity, property_id):
+    sharding.pin_record(session, identity, Property, property_id)
+    prop = cache.get(session, Property, property_id)
+    if prop is None:
+        raise NotFound("Property not found")
+    if not compile_scope(session, identity, property_ids=[prop.id]).owns_property(prop.id):
+        raise Forbidden("forbidden")
+    return property_payload(prop)
+
+
+def create_property(session, identity, data):
+    _require_role(identity, "landlord")
+    if not data.get("name"):
+        raise BadRequest("name required")
+    prop = Property(name=data["name"], address=data.get("address"), landlord_id=identity["id"])
+    body = save(session, prop, property_payload, "create_property")
+    invalidate_scope(identity["id"])
+    return body
+
+
+def _period(on, start, end):
+    try:
+        return parse_period(on, start, end)
+    except ValueError as exc:
+        raise BadRequest(f"invalid date: {exc}")
+
+
+def portfolio_occupancy(session, identity, on=None, start=None, end=None):
+    _forbid_tenant(identity)
+    start, end = _period(on, start, end)
+    scope = compile_scope(session, identity)
+    property_ids = scope.property_ids if scope.is_landlord else session.scalars(select(Property.id)).all()
+    return {"from": start.isoformat(), "to": (end or start).isoformat(),
+            **portfolio_report(session, property_ids, start, end)}
+
+
+def property_occupancy(session, identity, property_id, on=None, start=None, end=None):
+    _forbid_tenant(identity)
+    _scoped_property(session, identity, property_id)
+    start, end = _period(on, start, end)
+    return {"from": start.isoformat(), "to": (end or start).isoformat(),
+            **property_report(session, property_id, start, end)}
+
+
+# ----------------------------
+# Units
+# ----------------------------
+def list_units(session, identity, property_id):
+    sharding.pin_record(session, identity, Property, property_id)
+    q = apply_scope(session.query(Unit), Unit, compile_scope(session, identity, property_ids=[property_id]))
+    return [unit_payload(u) for u in q.filter(Unit.property_id == property_id).all()]
+
+
+def get_unit(session, identity, unit_id):
+    sharding.pin_record(session, identity, Unit, unit_id)
+    q = apply_scope(session.query(Unit), Unit, compile_scope(session, identity, unit_ids=[unit_id]))
+    unit = q.filter(Unit.id == unit_id).first()
+    if unit is None:
+        raise NotFound("Unit not found")
+    return unit_payload(unit)
+
+
+def create_unit(session, identity, data):
+    _require_role(identity, "landlord")
+    try:
+        property_id, code, rent_amount = int(data["property_id"]), data["code"], int(data["rent_amount"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise BadRequest(f"invalid unit: {exc}")
+    prop = cache.get(session, Property, property_id)
+    if prop is None:
+        raise NotFound("Property not found")
+    if prop.landlord_id != identity["id"]:
+        raise Forbidden("not your property")
+    body = save(session, Unit(code=code, rent_amount=rent_amount, property_id=property_id), unit_payload,
+                "create_unit")
+    invalidate_scope(identity["id"])
+    return body
+
+
+# ----------------------------
+# Leases
+# ----------------------------
+def _parse_date(value):
+    return datetime.fromisoformat(value).date() if value else None
+
+
+def lease_fields(data):
+    """Validated Lease column values from a request dict."""
+    try:
+        fields = dict(
+            unit_id=int(data["unit_id"]),
+            tenant_id=int(data["tenant_id"]),
+            status=data.get("status") or "active",
+            start_date=_parse_date(data.get("start_date")),
+            end_date=_parse_date(data.get("end_date")),
+        )
+    except (KeyError, TypeError, ValueError) as exc:
+        raise BadRequest(f"invalid lease: {exc}")
+    if fields["start_date"] and fields["end_date"] and fields["end_date"] < fields["start_date"]:
+        raise BadRequest("invalid lease: end_date is before start_date")
+    return fields
+
+
+def list_leases(session, identity):
+    # Tenant sees own; landlord sees leases on their units
+    def load(session):
+        q = apply_scope(session.query(Lease), Lease, compile_scope(session, identity))
+        return [lease_payload(l) for l in q.all()]
+    return sharding.gather(session, identity, load)
+
+
+def create_lease(session, identity, data):
+    _require_role(identity, "landlord")
+    fields = lease_fields(data)
+    if fields["unit_id"] not in compile_scope(session, identity, unit_ids=[fields["unit_id"]]).unit_ids:
+        raise Forbidden("not your units", unit_ids=[fields["unit_id"]])
+    overlap = find_overlap(session, fields["unit_id"], fields["start_date"], fields["end_date"], fields["status"])
+    if overlap:
+        session.rollback()
+        raise Conflict("unit already leased for those dates", lease_id=overlap)
+    return save(session, Lease(**fields), lease_payload, "create_lease")
+
+
+def import_leases(session, identity, rows):
+    _require_role(identity, "landlord")
+    if not rows or len(rows) > MAX_IMPORT_ROWS:
+        raise BadRequest(f"send between 1 and {MAX_IMPORT_ROWS} leases")
+    rows = [lease_fields(row) for row in rows]
+    unit_ids = {row["unit_id"] for row in rows}
+    foreign = sorted(unit_ids - compile_scope(session, identity, unit_ids=unit_ids).unit_ids)
+    if foreign:
+        raise Forbidden("not your units", unit_ids=foreign)
+    try:
+        with track_round_trips("import_leases"):
+            leases = insert_leases(session, rows, identity["id"])
+            body = [lease_payload(l) for l in leases]
+            session.commit()
+    except LeaseConflict as exc:
+        raise Conflict("overlapping leases", conflicts=exc.conflicts)
+    return body
+
+
+# ----------------------------
+# Issues
+# ----------------------------
+def list_issues(session, identity):
+    def load(session):
+        q = apply_scope(select_rows(Issue), Issue, compile_scope(session, identity))
+        return [issue_payload(i) for i in fetch(session, q.order_by(Issue.created_at.desc()), Issue)]
+    return sharding.gather(session, identity, load, key=lambda i: i["created_at"] or "")
+
+
+def _issue_target(session, identity, property_id, unit_id):
+    """Resolve and check the property/unit of a new issue.
+
+    Landlords may only report on their own properties, tenants only where
+    they hold a lease; the unit's property fills in a missing property_id.
+    """
+    scope = compile_scope(session, identity, property_ids=[property_id] if property_id is not None else (),
+                          unit_ids=[unit_id] if unit_id is not None else ())
+    if unit_id is not None:
+        unit = apply_scope(session.query(Unit), Unit, scope).filter(Unit.id == unit_id).first()
+        if unit is None:
+            raise NotFound("Unit not found")
+        if property_id is None:
+            property_id = unit.property_id
+        elif unit.property_id != property_id:
+            raise BadRequest("unit is not in that property")
+    if property_id is None:
+        return None, None
+    if unit_id is None and cache.get(session, Property, property_id) is None:
+        raise NotFound("Property not found")
+    if not scope.owns_property(property_id):
+        raise Forbidden("forbidden")
+    if scope.is_tenant:
+        leases = apply_scope(select(Lease.id), Lease, scope).where(Lease.property_id == property_id)
+        if unit_id is not None:
+            leases = leases.where(Lease.unit_id == unit_id)
+        if session.execute(leases.limit(1)).first() is None:
+            raise Forbidden("no lease there")
+    return property_id, unit_id
+
+
+def create_issue(session, identity, data):
+    if not data.get("title"):
+        raise BadRequest("title required")
+    try:
+        property_id, unit_id = (None if data.get(f) is None else int(data[f]) for f in ("property_id", "unit_id"))
+    except (TypeError, ValueError) as exc:
+        raise BadRequest(f"invalid issue: {exc}")
+    if property_id is not None:
+        sharding.pin_record(session, identity, Property, property_id)
+    else:
+        sharding.pin_record(session, identity, Unit, unit_id)
+    property_id, unit_id = _issue_target(session, identity, property_id, unit_id)
+    issue = Issue(title=data["title"], description=data.get("description"), reporter_id=identity["id"],
+                  priority=data.get("priority") or "normal", property_id=property_id, unit_id=unit_id)
+    return save(session, issue, issue_payload, "create_issue")
+
+
+def update_issue(session, identity, issue_id, data):
+    """Apply the ISSUE_FIELDS present in ``data`` (an explicit null clears the field)."""
+    sharding.pin_record(session, identity, Issue, issue_id)
+    q = apply_scope(session.query(Issue), Issue, compile_scope(session, identity))
+    issue = q.filter(Issue.id == issue_id).first()
+    if issue is None:
+        raise NotFound("Issue not found")
+    for field in ISSUE_FIELDS:
+        if field in data:
+            setattr(issue, field, data[field])
+    with track_round_trips("update_issue"):
+        session.commit()
+    return {"message": "updated"}
+
+
+# ----------------------------
+# Payments
+# ----------------------------
+def mpesa_initiate(session, identity, data, config):
+    lease_id, amount, phone = data.get("lease_id"), data.get("amount"), data.get("phone")
+    if not lease_id or not amount or not phone:
+        raise BadRequest("lease_id, amount, phone required")
+    sharding.pin_record(session, identity, Lease, lease_id)
+    lease = session.get(Lease, lease_id)
+    if lease is None:
+        raise NotFound("Lease not found")
+    if identity["role"] == "tenant" and lease.tenant_id != identity["id"]:
+        raise Forbidden("not allowed to pay this lease")
+    key = None
+    if duplicates.enabled():
+        key = (lease.id, duplicates.normalize_phone(phone))
+        if not duplicates.index.claim(key):
+            return _repeated_initiation(None, None)
+    try:
+        # Commit the pending row before the push: a tenant is never charged for a payment we have no
+        # row for, and a crash mid-push leaves a pending row for fail_stale_payments to close
+        payment = Payment(lease_id=lease_id, method="mpesa", amount=int(amount), status="pending",
+                          property_id=lease.property_id, landlord_id=lease.landlord_id)
+        if key is not None:
+            earlier = duplicates.earlier_pending(session, payment)
+            if earlier is not None:  # initiated through another worker, or before a restart
+                session.rollback()
+                return _repeated_initiation(earlier.id, earlier.mpesa_checkout_id)
+        payment_id = save(session, payment, lambda p: p.id, "mpesa_initiate")
+        try:
+            mpesa_resp = stk_push(phone=str(phone), amount=int(amount), account_reference=f"LEASE{lease_id}",
+                                  config=config)
+        except Exception as exc:
+            payment.status = "failed"
+            with track_round_trips("mpesa_initiate"):
+                session.commit()
+            raise UpstreamError(f"failed to initiate mpesa: {exc}")
+        checkout_id = mpesa_resp.get("CheckoutRequestID")
+        payment.mpesa_checkout_id = checkout_id
+        with track_round_trips("mpesa_initiate"):
+            session.commit()
+        return {"message": "Payment initiated", "payment_id": payment_id, "mpesa_checkout_id": checkout_id}
+    finally:
+        if key is not None:
+            duplicates.index.release(key)
+
+
+def _repeated_initiation(payment_id, checkout_id):
+    """Answer a repeat of a pending initiation as PAYMENT_DEDUPE_MODE says (see app/duplicates.py)."""
+    if checkout_id is None:  # first push still waiting on Daraja
+        metrics.incr("payments.duplicate.in_flight")
+        raise Conflict("payment already being initiated for this lease, retry shortly")
+    if duplicates.settings["PAYMENT_DEDUPE_MODE"] == "reject":
+        metrics.incr("payments.duplicate.rejected")
+        raise Conflict("payment already initiated for this lease", payment_id=payment_id)
+    metrics.incr("payments.duplicate.coalesced")
+    return {"message": "Payment already initiated", "payment_id": payment_id,
+            "mpesa_checkout_id": checkout_id, "duplicate": True}
+
+
+def mpesa_callback(session, data):
+    """Settle the payment behind an STK callback; Daraja always gets an acknowledgement."""
+    callback = (data.get("Body") or {}).get("stkCallback") or {}
+    checkout_id = callback.get("CheckoutRequestID")
+    if checkout_id:
+        sharding.pin_row(session, select(Payment.id).where(Payment.mpesa_checkout_id == checkout_id))
+    payment = session.query(Payment).filter(Payment.mpesa_checkout_id == checkout_id).first() if checkout_id else None
+    if payment is not None:
+        result_code = callback.get("ResultCode")
+        payment.status = "completed" if result_code == 0 else "failed"
+        if result_code == 0:
+            items = (callback.get("CallbackMetadata") or {}).get("Item") or []
+            payment.reference = next((i.get("Value") for i in items if i.get("Name") == "MpesaReceiptNumber"),
+                                     payment.reference)
+        session.commit()
+    elif checkout_id:
+        # Raced ahead of the commit that stores the checkout id; reconcile_mpesa_payments settles it
+        metrics.incr("payments.callback.unmatched")
+    return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+
+def get_payment(session, identity, payment_id):
+    sharding.pin_record(session, identity, Payment, payment_id) \
+        or sharding.pin_record(session, identity, PaymentArchive, payment_id)
+    payment = find_payment(session, compile_scope(session, identity), payment_id)
+    if payment is None:
+        raise NotFound("payment not found")
+    return payment_payload(payment)
+
+
+def payment_history(session, identity, config, lease_id=None, start=None, end=None, include_archived=False):
+    try:
+        start, end = parse_history_range(start, end)
+    except ValueError:
+        raise BadRequest("from/to must be YYYY-MM-DD")
+
+    def load(session):
+        payments = load_history(session, compile_scope(session, identity), config, lease_id=lease_id, start=start,
+                                end=end, include_archived=include_archived)
+        return [payment_payload(p) for p in payments]
+    return sharding.gather(session, identity, load, key=lambda p: p["created_at"] or "")
+
+
+# ----------------------------
+# Statements
+# ----------------------------
+def document_format(fmt):
+    if fmt not in statements.FORMATS:
+        raise BadRequest(f"format must be one of {', '.join(statements.FORMATS)}")
+    return fmt
+
+
+def _month(value):
+    try:
+        return statements.parse_month(value)
+    except ValueError as exc:
+        raise BadRequest(str(exc))
+
+
+def tenant_statement(session, identity, tenant_id=None, month=None):
+    if identity["role"] == "tenant":
+        tenant_id = identity["id"]
+    if not tenant_id:
+        raise BadRequest("tenant_id required")
+    if identity["role"] == sharding.ADMIN_ROLE:
+        sharding.pin(session, sharding.tenant_landlord(session.get_bind(), tenant_id))
+    return statements.tenant_statement(session, tenant_id, _month(month), compile_scope(session, identity))
+
+
+def property_statement(session, identity, property_id, month=None):
+    _forbid_tenant(identity)
+    _scoped_property(session, identity, property_id)
+    return statements.property_statement(session, property_id, _month(month))
+
+
+def payment_receipt(session, identity, payment_id):
+    sharding.pin_record(session, identity, Payment, payment_id) \
+        or sharding.pin_record(session, identity, PaymentArchive, payment_id)
+    doc = statements.receipt(session, payment_id, compile_scope(session, identity))
+    if doc is None:
+        raise NotFound("no completed payment with that id")
+    return doc
+
+
+# ----------------------------
+# Audit log
+# ----------------------------
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def audit_events(session, identity, entity=None, entity_id=None, actor_id=None, since=None, until=None,
+                 after_id=None, limit=100):
+    if not audit.can_read(session, compile_scope(session, identity), entity, entity_id):
+        raise Forbidden("pass entity and entity_id of a record you can see")
+    try:
+        since, until = _datetime(since), _datetime(until)
+    except ValueError:
+        raise BadRequest("since/until must be ISO datetimes")
+    return audit.query_events(session, since=since, until=until, entity=entity, entity_id=entity_id,
+                              actor_id=actor_id, after_id=after_id, limit=max(1, min(limit or 100, 1000)))
+
+
+# ----------------------------
+# Profiling (admins)
+# ----------------------------
+def _require_admin(identity):
+    if not admins.is_admin(identity):
+        raise Forbidden("only admins")
+
+
+def recent_profiles(identity):
+    _require_admin(identity)
+    return profiling.recent()
+
+
+def profile_report(identity, profile_id, sort="cumulative", limit=50):
+    """Text report of one request profile."""
+    _require_admin(identity)
+    if sort not in profiling.SORT_KEYS:
+        raise BadRequest(f"sort must be one of {', '.join(profiling.SORT_KEYS)}")
+    profile = profiling.find(profile_id)
+    if profile is None:
+        raise NotFound("profile not found")
+    return profile.report(sort, max(1, min(limit or 50, 500)))
+
+
+def flamegraph(identity, seconds=None):
+    _require_admin(identity)
+    if not profiling.sampler.running:
+        raise Conflict("sampler is not running")
+    return profiling.sampler.folded(seconds)
+
+
+def set_sampler(identity, enabled):
+    _require_admin(identity)
+    if enabled:
+        profiling.sampler.start()
+    else:
+        profiling.sampler.stop()
+    return {"running": profiling.sampler.running}
+
+
+def start_tracemalloc(identity, frames=1):
+    _require_admin(identity)
+    return profiling.start_tracemalloc(max(1, min(frames or 1, 25)))
+
+
+def tracemalloc_report(identity, limit=25, path=None):
+    _require_admin(identity)
+    report = profiling.tracemalloc_report(max(1, min(limit or 25, 200)), path)
+    if report is None:
+        raise Conflict("tracemalloc is not running")
+    return report
+
+
+def stop_tracemalloc(identity):
+    _require_admin(identity)
+    return profiling.stop_tracemalloc()
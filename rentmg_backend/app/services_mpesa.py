@@ -1,22 +1,60 @@
-import base64, requests, datetime, os
+import base64, datetime, os, threading, time
 from flask import current_app
 
-def _access_token():
-    key = current_app.config["MPESA_CONSUMER_KEY"]
-    secret = current_app.config["MPESA_CONSUMER_SECRET"]
-    resp = requests.get(
-        "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials",
-        auth=(key, secret), timeout=20
-    )
-    resp.raise_for_status()
-    return resp.json()["access_token"]
+_token_lock = threading.Lock()
+_token_cache = {}  # (base_url, consumer_key) -> (expires_at, token)
+_session = None
+
+
+def _http():
+    """Process-wide requests session (keep-alive to Daraja), imported on first payment call."""
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+def _config(config):
+    return config if config is not None else current_app.config
 
-def stk_push(phone, amount, account_reference, description="Rent"):
-    token = _access_token()
+
+def _base_url(config):
+    return config.get("MPESA_BASE_URL") or "https://sandbox.safaricom.co.ke"
+
+
+def _access_token(config=None):
+    """OAuth token shared by all callers in the process until shortly before it expires."""
+    config = _config(config)
+    key = config["MPESA_CONSUMER_KEY"]
+    secret = config["MPESA_CONSUMER_SECRET"]
+    cache_key = (_base_url(config), key)
+    with _token_lock:
+        cached = _token_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        resp = _http().get(
+            f"{cache_key[0]}/oauth/v1/generate?grant_type=client_credentials",
+            auth=(key, secret), timeout=20
+        )
+        resp.raise_for_status()
+        body = resp.json()
+        # Refresh a minute early so in-flight requests never carry an expired token
+        ttl = max(int(body.get("expires_in", 3599)) - 60, 0)
+        _token_cache[cache_key] = (time.monotonic() + ttl, body["access_token"])
+        return body["access_token"]
+
+def _password(config):
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    shortcode = current_app.config["MPESA_SHORTCODE"]
-    passkey = current_app.config["MPESA_PASSKEY"]
-    password = base64.b64encode((shortcode+passkey+timestamp).encode()).decode()
+    shortcode = config["MPESA_SHORTCODE"]
+    passkey = config["MPESA_PASSKEY"]
+    return base64.b64encode((shortcode+passkey+timestamp).encode()).decode(), timestamp
+
+def stk_push(phone, amount, account_reference, description="Rent", config=None):
+    config = _config(config)
+    token = _access_token(config)
+    shortcode = config["MPESA_SHORTCODE"]
+    password, timestamp = _password(config)
     payload = {
         "BusinessShortCode": shortcode,
         "Password": password,
@@ -26,12 +64,32 @@ def stk_push(phone, amount, account_reference, description="Rent"):
         "PartyA": phone,
         "PartyB": shortcode,
         "PhoneNumber": phone,
-        "CallBackURL": current_app.config["MPESA_CALLBACK_URL"],
+        "CallBackURL": config["MPESA_CALLBACK_URL"],
         "AccountReference": account_reference[:12],
         "TransactionDesc": description[:30]
     }
     headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.post("https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest",
+    resp = _http().post(f"{_base_url(config)}/mpesa/stkpush/v1/processrequest",
+                         json=payload, headers=headers, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+def stk_query(checkout_id, config=None):
+    """Ask Daraja for the final state of an STK push (used when no callback arrived)."""
+    config = _config(config)
+    token = _access_token(config)
+    password, timestamp = _password(config)
+    payload = {
+        "BusinessShortCode": config["MPESA_SHORTCODE"],
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_id,
+    }
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = _http().post(f"{_base_url(config)}/mpesa/stkpushquery/v1/query",
                          json=payload, headers=headers, timeout=30)
+    # Daraja answers 500 with errorCode 500.001.1001 while the push is still in flight
+    if resp.status_code >= 500 and "errorCode" in resp.text:
+        return resp.json()
     resp.raise_for_status()
     return resp.json()
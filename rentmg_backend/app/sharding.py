@@ -0,0 +1,453 @@
+"""Route each landlord's data to one of several databases (shards).
+
+Off unless ``SHARD_URIS`` lists extra databases (``name=uri,name=uri``).
+Then the tables holding a landlord's portfolio (properties, units, leases,
+payments, payments_archive, issues) can live on any shard. Users, tokens, the
+audit log, job state and the shard map itself stay on the primary database
+(``SQLALCHEMY_DATABASE_URI``), which also holds every landlord the map does
+not list. It is named ``primary``.
+
+The shard map is the ``landlord_shards`` table. New landlords are placed on a
+shard by a hash of their id when they register. The map is cached in process
+for ``SHARD_MAP_TTL`` seconds.
+
+Both adapters build their sessions from a class using :class:`ShardRouting`.
+Its ``get_bind`` sends statements on sharded tables to one shard. It picks, in
+this order:
+
+1. ``session.info["shard"]``, set by :func:`gather`, :func:`pin_row` and
+   :func:`each_shard`;
+2. the landlord in ``session.info["shard_landlord"]``, set by :func:`pin`;
+3. the landlord of the request's JWT identity. A landlord is their own
+   landlord; a tenant's landlord owns the property they signed up to.
+
+Anything else goes to the primary. Property managers see every landlord, so
+their list endpoints query all shards in parallel (:func:`gather`). Their
+single-record endpoints first find the shard holding the record
+(:func:`pin_row`).
+
+Each shard's schema comes from :func:`create_schema`. It starts every table's
+ids at ``index * SHARD_ID_SPAN + 1``, so ids stay unique across shards and the
+entity cache, audit log and clients can keep using bare ids.
+:func:`move_landlord` moves a landlord to a shard listed later, ids
+unchanged. While it runs, the landlord's requests get 503
+(:class:`LandlordMoving`).
+"""
+import hashlib
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import MetaData, create_engine, delete, func, insert, inspect, or_, select, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+
+log = logging.getLogger(__name__)
+
+PRIMARY = "primary"
+SHARD_ID_SPAN = 100_000_000
+# Parents first: the order rows are copied in, and the reverse of the order they are deleted in
+SHARDED_TABLES = ("properties", "units", "leases", "payments", "payments_archive", "issues")
+ADMIN_ROLE = "property_manager"
+RETRY_AFTER_SECONDS = 5  # Retry-After sent with LandlordMoving's 503
+
+settings = {"SHARD_URIS": "", "SHARD_MAP_TTL": 5.0}
+
+_uris = {}  # shard name -> URI, primary excluded
+_engines = {}  # shard name -> engine, primary excluded
+_map = {}  # landlord id -> (expires, shard, moving)
+_tenants = {}  # tenant id -> (expires, landlord id or None)
+_properties = {}  # property id -> landlord id; a property never changes landlord
+
+
+class LandlordMoving(Exception):
+    """The landlord's rows are being moved to another shard; retry shortly."""
+
+    def __init__(self, landlord_id):
+        super().__init__(f"landlord {landlord_id} is being moved, retry shortly")
+        self.landlord_id = landlord_id
+
+
+def configure(config):
+    """Apply SHARD_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+    uris = dict(item.strip().split("=", 1) for item in (settings["SHARD_URIS"] or "").split(",") if item.strip())
+    if PRIMARY in uris:
+        raise ValueError(f"SHARD_URIS: {PRIMARY!r} is SQLALCHEMY_DATABASE_URI and cannot be redefined")
+    if uris != _uris:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _uris.clear()
+        _uris.update(uris)
+    reset_cache()
+
+
+def enabled():
+    return bool(_uris)
+
+
+def names():
+    """Every shard name, primary first; a shard's position is its id range index."""
+    return [PRIMARY, *_uris]
+
+
+def engine_for(name, primary):
+    if name == PRIMARY:
+        return primary
+    engine = _engines.get(name)
+    if engine is None:
+        if name not in _uris:
+            raise RuntimeError(f"unknown shard {name!r}; SHARD_URIS lists {', '.join(_uris) or 'none'}")
+        engine = _engines.setdefault(name, create_engine(_uris[name], pool_pre_ping=True))
+    return engine
+
+
+def reset_cache():
+    """Forget cached map entries (after a move, or in tests)."""
+    _map.clear()
+    _tenants.clear()
+    _properties.clear()
+
+
+# --- shard map ---------------------------------------------------------------
+
+def lookup(primary, landlord_id):
+    """(shard, moving) for a landlord, through the in-process cache."""
+    now = time.monotonic()
+    hit = _map.get(landlord_id)
+    if hit and hit[0] > now:
+        return hit[1], hit[2]
+    from .models import LandlordShard
+
+    with primary.connect() as conn:
+        row = conn.execute(select(LandlordShard.shard, LandlordShard.moving)
+                           .where(LandlordShard.landlord_id == landlord_id)).first()
+    shard, moving = (row.shard, bool(row.moving)) if row else (PRIMARY, False)
+    _map[landlord_id] = (now + settings["SHARD_MAP_TTL"], shard, moving)
+    return shard, moving
+
+
+def property_landlord(primary, property_id):
+    """Landlord owning ``property_id``, looked up on every shard once per process."""
+    if property_id is None:
+        return None
+    if property_id not in _properties:
+        from .models import Property
+
+        for name in names():
+            with engine_for(name, primary).connect() as conn:
+                landlord_id = conn.execute(select(Property.landlord_id).where(Property.id == property_id)).scalar()
+            if landlord_id is not None:
+                _properties[property_id] = landlord_id
+                break
+        else:
+            return None
+    return _properties[property_id]
+
+
+def tenant_landlord(primary, tenant_id):
+    """Landlord of the property a tenant signed up to, or None."""
+    now = time.monotonic()
+    hit = _tenants.get(tenant_id)
+    if hit and hit[0] > now:
+        return hit[1]
+    from .models import User
+
+    with primary.connect() as conn:
+        property_id = conn.execute(select(User.property_id).where(User.id == tenant_id)).scalar()
+    landlord_id = property_landlord(primary, property_id)
+    _tenants[tenant_id] = (now + settings["SHARD_MAP_TTL"], landlord_id)
+    return landlord_id
+
+
+def place(session, landlord_id):
+    """Record the shard of a newly registered landlord and pin ``session`` to it."""
+    if not enabled():
+        return None
+    from .models import LandlordShard
+
+    shards = list(_uris)
+    digest = hashlib.blake2b(str(landlord_id).encode(), digest_size=4).digest()
+    shard = shards[int.from_bytes(digest, "big") % len(shards)]
+    session.add(LandlordShard(landlord_id=landlord_id, shard=shard, moving=False))
+    _map[landlord_id] = (time.monotonic() + settings["SHARD_MAP_TTL"], shard, False)
+    session.info["shard"] = shard  # the map row is not committed yet, so name the shard outright
+    return shard
+
+
+# --- routing -----------------------------------------------------------------
+
+def _sharded(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table.name in SHARDED_TABLES
+    return clause is not None and any(getattr(t, "name", None) in SHARDED_TABLES for t in find_tables(clause))
+
+
+def _request_landlord(session, primary):
+    from .audit import request_identity
+
+    identity = request_identity(session)
+    if not identity:
+        return None
+    if identity["role"] == "landlord":
+        return identity["id"]
+    if identity["role"] == "tenant":
+        return tenant_landlord(primary, identity["id"])
+    return None
+
+
+def shard_of(session, primary):
+    """Name of the shard that sharded-table statements of ``session`` go to."""
+    info = session.info
+    if "shard" in info:
+        return info["shard"]
+    landlord_id = info.get("shard_landlord")
+    if landlord_id is None:
+        landlord_id = _request_landlord(session, primary)
+        if landlord_id is None:
+            return PRIMARY
+        info["shard_landlord"] = landlord_id
+    shard, moving = lookup(primary, landlord_id)
+    if moving:
+        raise LandlordMoving(landlord_id)
+    return shard
+
+
+class ShardRouting:
+    """Session mixin binding statements on sharded tables to the shard :func:`shard_of` picks."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        default = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kw)
+        if bind is not None or not _uris or not _sharded(mapper, clause):
+            return default
+        return engine_for(shard_of(self, default), default)
+
+
+class RoutingSession(ShardRouting, Session):
+    """Plain SQLAlchemy session with shard routing (FastAPI, :func:`gather`, scripts)."""
+
+
+def pin(session, landlord_id):
+    """Route ``session`` to ``landlord_id``'s shard from now on."""
+    if enabled() and landlord_id is not None:
+        session.info.pop("shard", None)
+        session.info["shard_landlord"] = landlord_id
+
+
+def pin_user(session, user):
+    """Route ``session`` for ``user`` before the request's identity is known (login, register)."""
+    if not enabled():
+        return
+    if user.role == "landlord":
+        pin(session, user.id)
+    elif user.role == "tenant":
+        pin(session, property_landlord(session.get_bind(), user.property_id))
+
+
+def pin_row(session, stmt):
+    """Route ``session`` to the first shard where ``stmt`` returns a row; True if one did."""
+    if not enabled():
+        return False
+    primary = session.get_bind()
+    for name in names():
+        with engine_for(name, primary).connect() as conn:
+            if conn.execute(stmt.limit(1)).first() is not None:
+                session.info.pop("shard_landlord", None)
+                session.info["shard"] = name
+                return True
+    return False
+
+
+def pin_record(session, identity, model, pk):
+    """For a property manager, route ``session`` to the shard holding ``model`` row ``pk``; True if found."""
+    if enabled() and identity["role"] == ADMIN_ROLE and pk is not None:
+        return pin_row(session, select(model.id).where(model.id == pk))
+    return False
+
+
+def each_shard(session):
+    """Yield every shard name with ``session`` routed to it (just the primary when sharding is off)."""
+    if not enabled():
+        yield PRIMARY
+        return
+    for name in names():
+        session.info["shard"] = name
+        try:
+            yield name
+        finally:
+            session.info.pop("shard", None)
+
+
+def across(session, load):
+    """``load()`` run against every shard in turn, results concatenated (sharding off: just ``load()``)."""
+    results = []
+    for _ in each_shard(session):
+        results.extend(load())
+    return results
+
+
+def gather(session, identity, load, key=None):
+    """``load(session)`` for the caller; for a property manager, on every shard at once.
+
+    Each shard gets its own session and thread. Results are concatenated, or
+    merged on ``key`` (descending) when each shard's list is sorted that way.
+    """
+    if not enabled() or identity["role"] != ADMIN_ROLE:
+        return load(session)
+    primary = session.get_bind()
+
+    def run(name):
+        with RoutingSession(bind=primary, info={"shard": name}) as shard_session:
+            return load(shard_session)
+
+    with ThreadPoolExecutor(max_workers=len(names()), thread_name_prefix="shard-gather") as pool:
+        parts = list(pool.map(run, names()))
+    if key is not None:
+        return list(heapq.merge(*parts, key=key, reverse=True))
+    return [item for part in parts for item in part]
+
+
+# --- schema and moves ----------------------------------------------------------
+
+def _tables():
+    from .extensions import db
+
+    return [db.metadata.tables[name] for name in SHARDED_TABLES]
+
+
+def create_schema(engine, index):
+    """Create the sharded tables on a shard, ids starting at ``index * SHARD_ID_SPAN + 1``.
+
+    Foreign keys into the primary's tables (users) are dropped. Existing
+    tables are left alone, so this is safe to rerun.
+    """
+    metadata = MetaData()
+    for table in _tables():
+        copy = table.to_metadata(metadata)
+        for constraint in list(copy.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] not in SHARDED_TABLES:
+                copy.constraints.discard(constraint)
+                for fk in constraint.elements:
+                    copy.foreign_keys.discard(fk)
+                    fk.parent.foreign_keys.discard(fk)
+        copy.dialect_kwargs["sqlite_autoincrement"] = True
+    metadata.create_all(engine)
+    start = index * SHARD_ID_SPAN
+    if not start:
+        return
+    with engine.begin() as conn:
+        for name in SHARDED_TABLES:
+            if name == "payments_archive":  # ids copied from payments
+                continue
+            if engine.dialect.name == "sqlite":
+                if conn.execute(text("SELECT 1 FROM sqlite_sequence WHERE name = :t"), {"t": name}).first() is None:
+                    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:t, :s)"),
+                                 {"t": name, "s": start})
+            else:
+                conn.execute(text(f"ALTER TABLE {name} AUTO_INCREMENT = {start + 1}"))
+
+
+def _owned_ids(conn, landlord_id):
+    """{table name: ids} of every sharded row belonging to ``landlord_id`` on one database."""
+    properties, units, leases, payments, archive, issues = _tables()
+    ids = {"properties": conn.execute(select(properties.c.id).where(properties.c.landlord_id == landlord_id))
+           .scalars().all()}
+    ids["units"] = conn.execute(select(units.c.id).where(units.c.property_id.in_(ids["properties"]))).scalars().all()
+    ids["leases"] = conn.execute(select(leases.c.id).where(leases.c.unit_id.in_(ids["units"]))).scalars().all()
+    ids["payments"] = conn.execute(select(payments.c.id).where(payments.c.lease_id.in_(ids["leases"]))) \
+        .scalars().all()
+    ids["payments_archive"] = conn.execute(select(archive.c.id).where(archive.c.lease_id.in_(ids["leases"]))) \
+        .scalars().all()
+    ids["issues"] = conn.execute(select(issues.c.id).where(or_(
+        issues.c.property_id.in_(ids["properties"]), issues.c.unit_id.in_(ids["units"]),
+        issues.c.reporter_id == landlord_id))).scalars().all()
+    return ids
+
+
+def _chunks(ids, size):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def move_landlord(primary, landlord_id, target, batch_size=1000, pause=None, echo=log.info):
+    """Move every sharded row of ``landlord_id`` to shard ``target``; returns {table: rows moved}.
+
+    Steps: mark the landlord moving and wait out every process's map cache
+    (``pause``, default SHARD_MAP_TTL + 1s), so the landlord's requests get
+    503 and nothing writes to their rows. Copy the rows in one transaction on
+    the target, with ids kept, and check the counts. Point the map at the
+    target and clear the flag, then delete the rows from the source. If a step
+    fails, the map still points at the source, which still holds every row.
+    Rerunning the move replaces whatever a failed copy left on the target.
+    """
+    from .models import LandlordShard, User
+
+    if target not in names():
+        raise ValueError(f"unknown shard {target!r}; choose from {', '.join(names())}")
+    with primary.connect() as conn:
+        if conn.execute(select(User.role).where(User.id == landlord_id)).scalar() != "landlord":
+            raise ValueError(f"no landlord with id {landlord_id}")
+        row = conn.execute(select(LandlordShard.shard).where(LandlordShard.landlord_id == landlord_id)).first()
+    source = row.shard if row else PRIMARY
+    if source == target:
+        return {}
+    source_engine, target_engine = engine_for(source, primary), engine_for(target, primary)
+    if names().index(source) > names().index(target):
+        # The target's id counter would jump past the copied ids, into a later shard's range
+        raise ValueError(f"landlords only move to shards listed after their current one ({source})")
+
+    with primary.begin() as conn:
+        if row is None:
+            conn.execute(insert(LandlordShard).values(landlord_id=landlord_id, shard=source, moving=True))
+        else:
+            conn.execute(update(LandlordShard).where(LandlordShard.landlord_id == landlord_id).values(moving=True))
+    pause = settings["SHARD_MAP_TTL"] + 1 if pause is None else pause
+    echo(f"landlord {landlord_id}: marked moving, waiting {pause:.0f}s for map caches to expire")
+    time.sleep(pause)
+    try:
+        with source_engine.connect() as conn:
+            ids = _owned_ids(conn, landlord_id)
+        with target_engine.begin() as dst, source_engine.connect() as src:
+            for table in reversed(_tables()):  # leftovers of a failed attempt
+                for chunk in _chunks(ids[table.name], batch_size):
+                    dst.execute(delete(table).where(table.c.id.in_(chunk)))
+            for table in _tables():
+                for chunk in _chunks(ids[table.name], batch_size):
+                    rows = src.execute(select(table).where(table.c.id.in_(chunk))).mappings().all()
+                    dst.execute(insert(table), [dict(r) for r in rows])
+                echo(f"landlord {landlord_id}: copied {len(ids[table.name])} {table.name}")
+            copied = _owned_ids(dst, landlord_id)
+            mismatched = [t for t in ids if sorted(copied[t]) != sorted(ids[t])]
+            if mismatched:
+                raise RuntimeError(f"copy of landlord {landlord_id} incomplete: {', '.join(mismatched)}")
+        with primary.begin() as conn:
+            conn.execute(update(LandlordShard).where(LandlordShard.landlord_id == landlord_id)
+                         .values(shard=target, moving=False))
+    except BaseException:
+        with primary.begin() as conn:
+            conn.execute(update(LandlordShard).where(LandlordShard.landlord_id == landlord_id).values(moving=False))
+        raise
+    finally:
+        _map.pop(landlord_id, None)
+    with source_engine.begin() as conn:
+        for table in reversed(_tables()):
+            for chunk in _chunks(ids[table.name], batch_size):
+                conn.execute(delete(table).where(table.c.id.in_(chunk)))
+    echo(f"landlord {landlord_id}: moved from {source} to {target}")
+    return {table: len(table_ids) for table, table_ids in ids.items()}
+
+
+def status(primary):
+    """[(shard, landlords mapped, properties held)] for every shard."""
+    from .models import LandlordShard, Property
+
+    with primary.connect() as conn:
+        mapped = dict(conn.execute(select(LandlordShard.shard, func.count()).group_by(LandlordShard.shard)).all())
+    result = []
+    for name in names():
+        with engine_for(name, primary).connect() as conn:
+            result.append((name, mapped.get(name, 0), conn.execute(select(func.count(Property.id))).scalar()))
+    return result
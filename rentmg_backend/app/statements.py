@@ -0,0 +1,375 @@
+"""Monthly statements and payment receipts as CSV or PDF.
+
+Documents are built in two steps:
+
+* Loading turns leases and payments into a plain statement dict with a few
+  Core queries (no ORM objects), so a whole month can be streamed at once.
+* Rendering turns that dict into bytes. It is a pure function and can run in
+  worker processes.
+
+Rendered files are cached on disk under the SHA-256 of their content, so an
+unchanged ledger is never rendered twice. The hash doubles as the ETag, and
+the cached files are served with byte-range support. A hit refreshes the
+file's mtime. Once a process has written a tenth of
+``STATEMENT_CACHE_MAX_BYTES`` since its last check, it deletes the least
+recently used files until the directory fits the cap again.
+
+``flask generate-statements`` renders every tenant and property statement for
+a month with a process pool.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from sqlalchemy import select, union_all
+
+from . import metrics, sharding
+from .models import Lease, Payment, PaymentArchive, Property, Unit, User
+from .scoping import apply_scope
+
+RENDER_VERSION = "1"
+FORMATS = {"csv": "text/csv", "pdf": "application/pdf"}
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "rentmg-statements")
+PRUNE_MIN_AGE_SECONDS = 60  # younger files may be about to be served
+
+_written_lock = threading.Lock()
+_written = {}  # cache dir -> bytes written by this process since its last prune
+
+
+def parse_month(value=None):
+    """``(first_day, first_day_of_next_month)`` for ``YYYY-MM`` (the current month if empty)."""
+    start = date.fromisoformat(f"{value}-01") if value else date.today().replace(day=1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def _lease_columns():
+    stmt = select(
+        Lease.id, Lease.tenant_id, Lease.start_date, Lease.end_date, Lease.property_id,
+        Unit.code, Unit.rent_amount, Property.name,
+    ).join(Unit, Unit.id == Lease.unit_id).join(Property, Property.id == Unit.property_id)
+    if sharding.enabled():  # users stay on the primary; names come from _tenant_names
+        return stmt
+    return stmt.add_columns(User.email, User.full_name).join(User, User.id == Lease.tenant_id)
+
+
+def _tenant_names(session, rows):
+    """{tenant_id: display name} for lease rows, from the joined columns or a users lookup when sharded."""
+    if not sharding.enabled():
+        return {row.tenant_id: row.full_name or row.email for row in rows}
+    tenant_ids = {row.tenant_id for row in rows}
+    if not tenant_ids:
+        return {}
+    return {row.id: row.full_name or row.email
+            for row in session.execute(select(User.id, User.email, User.full_name).where(User.id.in_(tenant_ids)))}
+
+
+def _ledgers(session, lease_stmt, payment_filter, month):
+    """``{lease_id: ledger}`` for the leases running during ``month``, payments attached.
+
+    ``payment_filter(model)`` narrows the month's payments (None: all of them).
+    """
+    start, end = month
+    lease_stmt = lease_stmt.where(
+        (Lease.start_date.is_(None)) | (Lease.start_date < end),
+        (Lease.end_date.is_(None)) | (Lease.end_date >= start),
+    ).order_by(Lease.id)
+    ledgers = {}
+    for rows in session.execute(lease_stmt.execution_options(yield_per=1000)).partitions():
+        names = _tenant_names(session, rows)
+        for row in rows:
+            ledgers[row.id] = {
+                "lease_id": row.id, "tenant_id": row.tenant_id, "property_id": row.property_id,
+                "property": row.name, "unit": row.code, "tenant": names.get(row.tenant_id),
+                "rent_due": row.rent_amount, "payments": [],
+            }
+    if not ledgers:
+        return ledgers
+    for row in session.execute(_payments(payment_filter, month).execution_options(yield_per=1000)):
+        ledger = ledgers.get(row.lease_id)
+        if ledger is not None:
+            ledger["payments"].append({
+                "payment_id": row.id, "date": row.created_at.date().isoformat(), "method": row.method,
+                "status": row.status, "amount": row.amount, "reference": row.reference,
+            })
+    for ledger in ledgers.values():
+        ledger["paid"] = sum(p["amount"] for p in ledger["payments"] if p["status"] == "completed")
+        ledger["balance"] = ledger["rent_due"] - ledger["paid"]
+    return ledgers
+
+
+def _payments(payment_filter, month):
+    """The month's payments, oldest first, from payments_archive as well unless the month is in this year.
+
+    archive_payments only moves closed years, so a month of the current year is never archived.
+    """
+    start, end = month
+    models = (Payment,) if start >= date(date.today().year, 1, 1) else (Payment, PaymentArchive)
+    selects = []
+    for model in models:
+        stmt = select(model.id, model.lease_id, model.created_at, model.method, model.status, model.amount,
+                      model.reference).where(model.created_at >= start, model.created_at < end)
+        selects.append(stmt if payment_filter is None else stmt.where(payment_filter(model)))
+    if len(selects) == 1:
+        return selects[0].order_by(Payment.created_at, Payment.id)
+    both = union_all(*selects)
+    return both.order_by(both.selected_columns.created_at, both.selected_columns.id)
+
+
+def _statement(kind, title, month, ledgers):
+    return {
+        "kind": kind,
+        "title": title,
+        "period": month[0].strftime("%Y-%m"),
+        "leases": ledgers,
+        "totals": {key: sum(l[key] for l in ledgers) for key in ("rent_due", "paid", "balance")},
+    }
+
+
+def tenant_statement(session, tenant_id, month, scope=None):
+    leases = _lease_columns().where(Lease.tenant_id == tenant_id)
+    if scope is not None:
+        leases = apply_scope(leases, Lease, scope)
+    lease_ids = leases.with_only_columns(Lease.id)
+    ledgers = list(_ledgers(session, leases, lambda model: model.lease_id.in_(lease_ids), month).values())
+    name = ledgers[0]["tenant"] if ledgers else f"tenant {tenant_id}"
+    return _statement("tenant", f"Statement for {name}", month, ledgers)
+
+
+def property_statement(session, property_id, month):
+    leases = _lease_columns().where(Lease.property_id == property_id)
+    ledgers = list(_ledgers(session, leases, lambda model: model.property_id == property_id, month).values())
+    name = ledgers[0]["property"] if ledgers else f"property {property_id}"
+    return _statement("property", f"Statement for {name}", month, ledgers)
+
+
+def month_statements(session, month):
+    """Every tenant and property statement for a month, from two streamed queries."""
+    ledgers = _ledgers(session, _lease_columns(), None, month)
+    by_tenant, by_property = defaultdict(list), defaultdict(list)
+    for ledger in ledgers.values():
+        by_tenant[ledger["tenant_id"]].append(ledger)
+        by_property[ledger["property_id"]].append(ledger)
+    for group in by_tenant.values():
+        yield _statement("tenant", f"Statement for {group[0]['tenant']}", month, group)
+    for group in by_property.values():
+        yield _statement("property", f"Statement for {group[0]['property']}", month, group)
+
+
+def receipt(session, payment_id, scope=None):
+    """Receipt document for a completed payment (hot or archived), or None if it is missing/not visible/not completed."""
+    for model in (Payment, PaymentArchive):
+        stmt = _lease_columns().add_columns(
+            model.id.label("payment_id"), model.created_at, model.method, model.amount, model.reference,
+        ).join(model, model.lease_id == Lease.id).where(model.id == payment_id, model.status == "completed")
+        if scope is not None:
+            stmt = apply_scope(stmt, model, scope)
+        row = session.execute(stmt).first()
+        if row is not None:
+            break
+    else:
+        return None
+    return {
+        "kind": "receipt",
+        "title": f"Receipt {row.reference or row.payment_id}",
+        "period": row.created_at.date().isoformat(),
+        "payment": {
+            "payment_id": row.payment_id, "lease_id": row.id, "property": row.name, "unit": row.code,
+            "tenant": _tenant_names(session, [row]).get(row.tenant_id), "date": row.created_at.isoformat(timespec="seconds"),
+            "method": row.method, "amount": row.amount, "reference": row.reference,
+        },
+    }
+
+
+# --- rendering -------------------------------------------------------------
+
+def render_csv(doc):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if doc["kind"] == "receipt":
+        writer.writerow(list(doc["payment"]))
+        writer.writerow(list(doc["payment"].values()))
+        return out.getvalue().encode()
+    # balance_effect is what the row adds to the tenant's balance: failed/pending payments add nothing
+    writer.writerow(["type", "date", "lease_id", "property", "unit", "tenant", "status", "amount",
+                     "balance_effect", "reference"])
+    for l in doc["leases"]:
+        writer.writerow(["charge", f"{doc['period']}-01", l["lease_id"], l["property"], l["unit"], l["tenant"],
+                         "", l["rent_due"], l["rent_due"], ""])
+        for p in l["payments"]:
+            writer.writerow(["payment", p["date"], l["lease_id"], l["property"], l["unit"], l["tenant"],
+                             p["status"], p["amount"], -p["amount"] if p["status"] == "completed" else 0,
+                             p["reference"] or ""])
+    return out.getvalue().encode()
+
+
+def _text_lines(doc):
+    lines = [f"RentMG - {doc['title']}", f"Period: {doc['period']}", ""]
+    if doc["kind"] == "receipt":
+        p = doc["payment"]
+        lines += [f"{key.replace('_', ' ').title():<12} {value}" for key, value in p.items()]
+        return lines
+    for l in doc["leases"]:
+        lines.append(f"Lease {l['lease_id']}  Unit {l['unit']} @ {l['property']}  Tenant: {l['tenant']}")
+        lines.append(f"  {'Date':<10}  {'Method':<6}  {'Status':<9}  {'Amount':>10}  Reference")
+        for p in l["payments"]:
+            lines.append(f"  {p['date']:<10}  {p['method'] or '':<6}  {p['status']:<9}  {p['amount']:>10}  {p['reference'] or ''}")
+        lines.append(f"  Rent due {l['rent_due']}   Paid {l['paid']}   Balance {l['balance']}")
+        lines.append("")
+    t = doc["totals"]
+    lines.append(f"Totals: rent due {t['rent_due']}   paid {t['paid']}   balance {t['balance']}")
+    return lines
+
+
+def _pdf_text(line):
+    return line.encode("latin-1", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def render_pdf(doc, lines_per_page=60):
+    """Minimal multi-page PDF (Courier 9pt, A4) -- enough for a ledger, no extra dependency."""
+    lines = _text_lines(doc)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"]
+    kids = []
+    for page in pages:
+        stream = b"BT /F1 9 Tf 11 TL 40 800 Td " + b"".join(b"(" + _pdf_text(l) + b") Tj T* " for l in page) + b"ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+RENDERERS = {"csv": render_csv, "pdf": render_pdf}
+
+
+def content_key(doc, fmt):
+    payload = json.dumps(doc, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{RENDER_VERSION}:{fmt}:{payload}".encode()).hexdigest()
+
+
+def prune_cache(cache_dir, max_bytes, now=None):
+    """Delete least recently used files until ``cache_dir`` holds at most ``max_bytes``; returns files removed."""
+    now = time.time() if now is None else now
+    files, total = [], 0
+    for entry in os.scandir(cache_dir) if os.path.isdir(cache_dir) else ():
+        if not entry.is_dir():
+            continue
+        for item in os.scandir(entry.path):
+            stat = item.stat()
+            files.append((stat.st_mtime, stat.st_size, item.path))
+            total += stat.st_size
+    removed = 0
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes or mtime > now - PRUNE_MIN_AGE_SECONDS:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:  # another process pruned it first
+            pass
+        total -= size
+        removed += 1
+    metrics.incr("statements.pruned", removed)
+    return removed
+
+
+def _note_written(cache_dir, size, max_bytes):
+    with _written_lock:
+        written = _written.get(cache_dir, 0) + size
+        due = written >= max_bytes // 10
+        _written[cache_dir] = 0 if due else written
+    if due:
+        prune_cache(cache_dir, max_bytes)
+
+
+def render_cached(doc, fmt, cache_dir=DEFAULT_CACHE_DIR, max_bytes=None):
+    """Render ``doc`` unless an identical document is already cached; returns ``(path, key, rendered)``."""
+    key = content_key(doc, fmt)
+    path = os.path.join(cache_dir, key[:2], f"{key}.{fmt}")
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # keeps served files last in line for pruning
+        except FileNotFoundError:
+            pass
+        else:
+            return path, key, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            body = RENDERERS[fmt](doc)
+            fh.write(body)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if max_bytes:
+        _note_written(cache_dir, len(body), max_bytes)
+    return path, key, True
+
+
+def cached_document(doc, fmt, config):
+    path, key, rendered = render_cached(doc, fmt, config.get("STATEMENT_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                                        config.get("STATEMENT_CACHE_MAX_BYTES"))
+    metrics.incr(f"statements.{'rendered' if rendered else 'cache_hit'}")
+    return path, key
+
+
+def download_name(doc, fmt):
+    return f"{doc['kind']}-{doc['period']}.{fmt}"
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive for a single ``bytes=`` range, None to send everything.
+
+    Raises ValueError when the range cannot be satisfied (answer 416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def _render_job(job):
+    doc, fmt, cache_dir, max_bytes = job
+    return render_cached(doc, fmt, cache_dir, max_bytes)[2]
+
+
+def generate_month(session, month, formats=("pdf",), cache_dir=DEFAULT_CACHE_DIR, workers=None, chunksize=64,
+                   max_bytes=None):
+    """Render every statement for ``month`` in a process pool; returns ``(documents, rendered)``.
+
+    Documents are loaded in the parent with two streamed queries; workers
+    only render and write files, so they never touch the database.
+    """
+    jobs = [(doc, fmt, cache_dir, max_bytes) for doc in month_statements(session, month) for fmt in formats]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rendered = sum(pool.map(_render_job, jobs, chunksize=chunksize))
+    metrics.incr("statements.rendered", rendered)
+    return len(jobs), rendered
@@ -0,0 +1,168 @@
+"""Short-lived access tokens, rotating refresh tokens and an in-memory denylist.
+
+Login and signup return an access token (``JWT_ACCESS_TOKEN_EXPIRES``, 15
+minutes by default) and a refresh token (``JWT_REFRESH_TOKEN_EXPIRES``, 30
+days). Both carry a ``fam`` claim naming the login session. ``POST
+/api/auth/refresh`` spends the refresh token and returns a new pair in the same
+family. Spending means inserting its ``jti`` into ``revoked_tokens``; the unique
+constraint makes that atomic, so a refresh token works exactly once.
+
+Revocation is by ``jti``, by family (logout) or by user (every token issued
+up to now). Entries live in ``revoked_tokens``. Every worker mirrors them in
+sets and dicts that a background thread tops up every
+``TOKEN_DENYLIST_SYNC_SECONDS``. It re-reads rows revoked since shortly before
+the previous sync: ids are not committed in order, so reading past the last id
+could skip a row. It also drops entries whose tokens have all expired. The
+``prune_revoked_tokens`` job deletes those rows. Checking a token on a
+request is a few dict lookups with no DB round trip. A revocation takes effect
+at once in the worker that made it, and in the others after the next sync.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from . import metrics
+from .models import RevokedToken
+
+log = logging.getLogger(__name__)
+
+SYNC_OVERLAP = timedelta(seconds=60)  # longer than any transaction that inserts a revocation
+
+settings = {
+    "JWT_ACCESS_TOKEN_EXPIRES": timedelta(minutes=15),
+    "JWT_REFRESH_TOKEN_EXPIRES": timedelta(days=30),
+    "TOKEN_DENYLIST_SYNC_SECONDS": 5.0,
+}
+
+
+def configure(config):
+    """Apply token lifetimes and TOKEN_* settings; called from create_app and the FastAPI module."""
+    for key, default in list(settings.items()):
+        settings[key] = config.get(key, default)
+
+
+def new_family():
+    return uuid.uuid4().hex
+
+
+def _user_id(claims):
+    ident = claims.get("sub") or claims.get("identity")
+    return ident.get("id") if isinstance(ident, dict) else None
+
+
+class Denylist:
+    """Process-local mirror of ``revoked_tokens``."""
+
+    def __init__(self):
+        self._jtis = {}  # jti -> expires_at
+        self._families = {}  # family -> expires_at
+        self._users = {}  # user id -> (cutoff epoch seconds, expires_at)
+        self._synced_at = None
+        self._engine = None
+        self._pid = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def start(self, engine):
+        """Load the denylist once, then keep it in sync from a thread in this process."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._engine = engine
+            if not self._loaded:  # forked workers inherit the parent's entries
+                try:
+                    self.sync()
+                except Exception:  # e.g. table not migrated yet; the thread keeps retrying
+                    log.exception("initial token denylist load failed")
+            threading.Thread(target=self._run, name="token-denylist", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(settings["TOKEN_DENYLIST_SYNC_SECONDS"])
+            try:
+                self.sync()
+            except Exception:
+                log.exception("token denylist sync failed")
+                metrics.incr("tokens.denylist.sync_failed")
+
+    def sync(self):
+        started = datetime.utcnow()
+        stmt = select(RevokedToken.kind, RevokedToken.value, RevokedToken.expires_at).where(
+            RevokedToken.expires_at > started)
+        if self._synced_at is not None:
+            stmt = stmt.where(RevokedToken.revoked_at >= self._synced_at - SYNC_OVERLAP)
+        with self._engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        for row in rows:
+            self.add(row.kind, row.value, row.expires_at)
+        self._synced_at = started
+        self._loaded = True
+        self._prune()
+
+    def add(self, kind, value, expires_at):
+        if kind == "jti":
+            self._jtis[value] = expires_at
+        elif kind == "family":
+            self._families[value] = expires_at
+        elif kind == "user":
+            user_id, _, cutoff = value.partition("@")
+            user_id, cutoff = int(user_id), int(cutoff)
+            if cutoff > self._users.get(user_id, (0, None))[0]:
+                self._users[user_id] = (cutoff, expires_at)
+
+    def _prune(self):
+        now = datetime.utcnow()
+        for entries in (self._jtis, self._families):
+            for key in [k for k, expires_at in list(entries.items()) if expires_at <= now]:
+                entries.pop(key, None)
+        for key in [k for k, (_, expires_at) in list(self._users.items()) if expires_at <= now]:
+            self._users.pop(key, None)
+        metrics.gauge("tokens.denylist.size", len(self._jtis) + len(self._families) + len(self._users))
+
+    def contains(self, claims):
+        if claims.get("jti") in self._jtis or claims.get("fam") in self._families:
+            return True
+        user = self._users.get(_user_id(claims))
+        return user is not None and claims.get("iat", 0) <= user[0]
+
+
+denylist = Denylist()
+
+
+def is_revoked(claims, engine):
+    """O(1) revocation check for decoded JWT claims; ``engine`` seeds the sync thread on first use."""
+    denylist.start(engine)
+    if denylist.contains(claims):
+        metrics.incr("tokens.rejected_revoked")
+        return True
+    return False
+
+
+def revoke(session, kind, value, expires_at=None):
+    """Add a denylist row (flushed, not committed) and apply it to this worker at once.
+
+    Raises IntegrityError if the same entry already exists, e.g. a refresh
+    token that has already been spent.
+    """
+    expires_at = expires_at or datetime.utcnow() + settings["JWT_REFRESH_TOKEN_EXPIRES"]
+    session.add(RevokedToken(kind=kind, value=str(value), expires_at=expires_at))
+    session.flush()
+    denylist.add(kind, str(value), expires_at)
+
+
+def revoke_user(session, user_id):
+    """Revoke every token issued to ``user_id`` up to now."""
+    revoke(session, "user", f"{user_id}@{int(time.time())}")
+
+
+def expiry(claims):
+    return datetime.utcfromtimestamp(claims["exp"])
+
@@ -1,4 +1,10 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# hashlib releases the GIL while hashing, so this runs alongside request DB work
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="pwhash")
+
 def hash_password(p): return generate_password_hash(p)
+def hash_password_async(p): return _hash_pool.submit(generate_password_hash, p)
 def verify_password(h, p): return check_password_hash(h, p)
@@ -0,0 +1,64 @@
+"""Write-path helpers shared by the Flask and FastAPI create routes.
+
+Routes used to ``commit()`` and then ``refresh()`` (or let the expired
+instance lazy-load) just to serialize the row they had written. :func:`save`
+instead flushes once, which returns the autoincrement id, while the Python-side
+defaults are already on the instance. It then serializes before committing,
+so the response costs no extra SELECT.
+
+:func:`track_round_trips` counts the statements and commits a block issues and
+records them under ``db.round_trips.<name>`` on ``/metrics``.
+"""
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+_local = threading.local()
+
+
+def _active():
+    return getattr(_local, "counters", None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters = _active()
+    if counters:
+        for counter in counters:
+            counter[0] += 1
+
+
+@event.listens_for(Engine, "commit")
+def _count_commit(conn):
+    counters = _active()
+    if counters:
+        for counter in counters:
+            counter[0] += 1
+
+
+@contextmanager
+def track_round_trips(name):
+    """Count DB round trips (statements + commits) issued by this thread inside the block."""
+    counter = [0]
+    if _active() is None:
+        _local.counters = []
+    _local.counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _local.counters.remove(counter)
+        metrics.observe(f"db.round_trips.{name}", counter[0])
+
+
+def save(session, obj, serialize, name):
+    """Insert ``obj`` in one flush + commit and return ``serialize(obj)`` without a refresh."""
+    with track_round_trips(name):
+        session.add(obj)
+        session.flush()
+        payload = serialize(obj)
+        session.commit()
+    return payload
@@ -0,0 +1,50 @@
+"""Single-process ASGI entry point serving both stacks on one engine and config.
+
+Requests that match a FastAPI route are served natively; everything else (routes
+not yet ported) falls through to the Flask app via WSGI. Path prefixes listed in
+``FLASK_ROUTE_PREFIXES`` are always sent to Flask, so a ported route can be
+rolled back without a deploy of the code.
+
+Usage:
+    uvicorn asgi:app --port 8000
+"""
+from a2wsgi import WSGIMiddleware
+from starlette.routing import Match
+
+from app import create_app
+from app.extensions import db
+import fastapi_app
+
+flask_app = create_app()
+with flask_app.app_context():
+    fastapi_app.use_engine(db.engine)
+if "scheduler" in flask_app.extensions:
+    # Workers that only serve FastAPI routes never reach Flask's before_request
+    fastapi_app.app.add_event_handler("startup", flask_app.extensions["scheduler"].start)
+
+
+class RouteSplitter:
+    """Dispatch each request to FastAPI if it owns the route, otherwise to Flask."""
+
+    def __init__(self, native, fallback, flask_prefixes=()):
+        self.native = native
+        self.fallback = fallback
+        self.flask_prefixes = tuple(p for p in flask_prefixes if p)
+
+    def is_native(self, scope):
+        if scope["path"].startswith(self.flask_prefixes):
+            return False
+        return any(route.matches(scope)[0] != Match.NONE for route in self.native.router.routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan" or (scope["type"] == "http" and self.is_native(scope)):
+            await self.native(scope, receive, send)
+        else:
+            await self.fallback(scope, receive, send)
+
+
+app = RouteSplitter(
+    fastapi_app.app,
+    WSGIMiddleware(flask_app),
+    flask_app.config["FLASK_ROUTE_PREFIXES"].split(","),
+)
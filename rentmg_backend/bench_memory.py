@@ -0,0 +1,99 @@
+"""Benchmark the memory cost per row of list responses: ORM instances vs read-only rows.
+
+Usage:
+    python bench_memory.py --rows 100000
+
+Seeds a throwaway SQLite file with ``--rows`` issues and payments. It then
+loads each table the way the list endpoints used to (``session.query(Model)``,
+with ``Issue.description`` undeferred as before) and the way they do now
+(``rows.fetch`` over a Core select), and serializes every row with the
+endpoint's payload function. For both, it reports the bytes per row still
+held after loading, the peak bytes per row while building the response, and
+the wall time. Measured with tracemalloc, which slows both paths alike.
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+
+def _seed(engine, count):
+    from sqlalchemy import insert
+    from app.models import Issue, Lease, Payment, Property, Unit, User
+
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{"id": 1, "email": "l@example.com", "password_hash": "x",
+                                               "role": "landlord", "created_at": now, "updated_at": now}])
+        conn.execute(insert(Property.__table__), [{"id": 1, "name": "Bench Court", "landlord_id": 1,
+                                                   "created_at": now, "updated_at": now}])
+        conn.execute(insert(Unit.__table__), [{"id": 1, "code": "A1", "rent_amount": 1000, "property_id": 1,
+                                               "created_at": now, "updated_at": now}])
+        conn.execute(insert(Lease.__table__), [{"id": 1, "unit_id": 1, "tenant_id": 1, "start_date": date(2020, 1, 1),
+                                                "status": "active", "in_arrears": False, "property_id": 1,
+                                                "landlord_id": 1, "created_at": now, "updated_at": now}])
+        conn.execute(insert(Issue.__table__), [
+            {"title": f"Issue {i}", "description": "Water dripping from the ceiling near the window. " * 4,
+             "status": "open", "priority": "normal", "reporter_id": 1, "property_id": 1, "unit_id": 1,
+             "created_at": now - timedelta(minutes=i), "updated_at": now}
+            for i in range(count)])
+        conn.execute(insert(Payment.__table__), [
+            {"lease_id": 1, "method": "mpesa", "amount": 1000 + i % 500, "status": "completed",
+             "reference": f"QX{i:08d}", "mpesa_checkout_id": f"ws_CO_{i:012d}", "property_id": 1,
+             "landlord_id": 1, "created_at": now - timedelta(minutes=i), "updated_at": now}
+            for i in range(count)])
+
+
+def _measure(load, serialize, count):
+    """(retained bytes/row after load, peak bytes/row during load + serialize, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    items = load()
+    retained = tracemalloc.get_traced_memory()[0] - base
+    body = [serialize(item) for item in items]
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    assert len(body) == count
+    return retained / count, peak / count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session, undefer
+    from app.models import Issue, Payment, db
+    from app.rows import fetch, select_rows
+    from app.serializers import issue_payload, payment_payload
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_memory.db')}")
+    db.metadata.create_all(engine)
+    _seed(engine, args.rows)
+
+    cases = [
+        ("issues", issue_payload,
+         lambda s: s.query(Issue).options(undefer(Issue.description)).order_by(Issue.created_at.desc()).all(),
+         lambda s: fetch(s, select_rows(Issue).order_by(Issue.created_at.desc()), Issue)),
+        ("payments", payment_payload,
+         lambda s: s.query(Payment).order_by(Payment.created_at.desc()).all(),
+         lambda s: fetch(s, select_rows(Payment).order_by(Payment.created_at.desc()), Payment)),
+    ]
+    print(f"{args.rows} rows per table")
+    print(f"{'table':<10} {'loader':<6} {'retained B/row':>15} {'peak B/row':>12} {'seconds':>8}")
+    for table, serialize, orm_load, rows_load in cases:
+        for loader, load in (("orm", orm_load), ("rows", rows_load)):
+            with Session(engine) as session:
+                retained, peak, elapsed = _measure(lambda: load(session), serialize, args.rows)
+            print(f"{table:<10} {loader:<6} {retained:>15,.0f} {peak:>12,.0f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Local stand-in for the Daraja sandbox used to exercise STK push and reconciliation.
+
+Usage:
+    python fake_daraja.py --port 8099
+    MPESA_BASE_URL=http://localhost:8099 flask run-jobs reconcile_mpesa_payments --force
+
+STK query outcomes are chosen from the checkout id suffix: ``_FAIL`` answers
+ResultCode 1032 (cancelled by user), ``_PENDING`` answers the "still
+processing" 500 error, anything else succeeds. ``--default`` changes the
+outcome for ids without a suffix.
+"""
+import argparse
+import itertools
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ids = itertools.count(1)
+
+
+class DarajaHandler(BaseHTTPRequestHandler):
+    default_outcome = "0"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/oauth/v1/generate"):
+            return self._send(200, {"access_token": "fake-token", "expires_in": "3599"})
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.headers.get("Authorization") != "Bearer fake-token":
+            return self._send(401, {"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+        if self.path == "/mpesa/stkpush/v1/processrequest":
+            return self._send(200, {
+                "MerchantRequestID": f"fake-{next(_ids)}",
+                "CheckoutRequestID": f"ws_CO_FAKE{next(_ids)}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            })
+        if self.path == "/mpesa/stkpushquery/v1/query":
+            checkout_id = payload.get("CheckoutRequestID", "")
+            outcome = self.default_outcome
+            if checkout_id.endswith("_FAIL"):
+                outcome = "1032"
+            elif checkout_id.endswith("_PENDING"):
+                outcome = "pending"
+            if outcome == "pending":
+                return self._send(500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"})
+            return self._send(200, {
+                "ResponseCode": "0",
+                "CheckoutRequestID": checkout_id,
+                "ResultCode": outcome,
+                "ResultDesc": "The service request is processed successfully." if outcome == "0" else "Request cancelled by user",
+            })
+        self._send(404, {"error": "not found"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--default", choices=["0", "1032", "1037", "pending"], default="0")
+    args = parser.parse_args()
+    DarajaHandler.default_outcome = args.default
+    server = ThreadingHTTPServer((args.host, args.port), DarajaHandler)
+    print(f"Fake Daraja listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,143 +1,164 @@
 """FastAPI app that mirrors the Flask API so both can run side-by-side.
 
+Both stacks are thin adapters over ``app/services.py``; this module only
+parses requests, applies rate limits and renders responses.
+
 Usage:
     uvicorn rentmg_backend.fastapi_app:app --reload --port 8000
 """
-from datetime import datetime, timedelta
-from typing import Generator, Optional
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Generator, List, Optional
 
 import jwt
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
+from app import admins, audit, cache, duplicates, metrics, notifications, profiling, ratelimit, services, sharding, tokens
 from app.config import Config
-from app.models import User, Property, Unit, Lease, Issue, Payment
-from app.utils import hash_password, verify_password
-from app.services_mpesa import stk_push
+from app.encoding import CompactResponseMiddleware
+from app.models import User
+from app.statements import FORMATS, cached_document, download_name, parse_range
 
-# SQLAlchemy session for FastAPI (independent of Flask app context)
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# SQLAlchemy session for FastAPI (independent of Flask app context). The engine
+# is created on first use so importing this module stays cheap for workers.
+engine = None
+SessionLocal = sessionmaker(autoflush=False, autocommit=False, class_=sharding.RoutingSession)
 
-security = HTTPBearer()
+# Plain-dict view of Config for helpers that otherwise read flask.current_app.config
+settings = {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+
+
+def get_engine():
+    if engine is None:
+        use_engine(create_engine(Config.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True))
+    return engine
 
 
-def get_db() -> Generator[Session, None, None]:
+def use_engine(shared_engine):
+    """Bind FastAPI sessions to an engine owned elsewhere (the unified ASGI app shares Flask's)."""
+    global engine
+    if engine is not None and shared_engine is not engine:
+        engine.dispose()
+    engine = shared_engine
+    SessionLocal.configure(bind=shared_engine)
+
+security = HTTPBearer()
+ratelimit.configure(settings)
+admins.configure(settings)
+metrics.configure(settings)
+audit.configure(settings)
+cache.configure(settings)
+duplicates.configure(settings)
+notifications.configure(settings)
+profiling.configure(settings)
+sharding.configure(settings)
+tokens.configure(settings)
+
+
+def get_db(request: Request) -> Generator[Session, None, None]:
+    shared = request.scope.get("rentmg.db")
+    if shared is not None:
+        # Sub-request of /api/batch: the batch owns (and closes) the session
+        yield shared
+        return
+    get_engine()
     db = SessionLocal()
+    db.info["request_scope"] = request.scope  # lets the audit log find the caller (see get_identity)
     try:
         yield db
     finally:
         db.close()
 
 
-def _user_payload(user: User):
-    return {
-        "id": user.id,
-        "email": user.email,
-        "role": user.role,
-        "full_name": user.full_name,
-        "property_id": user.property_id,
-        "property_name": user.linked_property.name if user.linked_property else None,
-        "created_at": user.created_at.isoformat(timespec="seconds") if user.created_at else None,
-        "updated_at": user.updated_at.isoformat(timespec="seconds") if user.updated_at else None,
-    }
-
-
-def _property_payload(p: Property):
-    return {
-        "id": p.id,
-        "name": p.name,
-        "address": p.address,
-        "landlord_id": p.landlord_id,
-        "created_at": p.created_at.isoformat(timespec="seconds") if p.created_at else None,
-        "updated_at": p.updated_at.isoformat(timespec="seconds") if p.updated_at else None,
-    }
-
-
-def _unit_payload(u: Unit):
-    return {
-        "id": u.id,
-        "code": u.code,
-        "rent_amount": u.rent_amount,
-        "property_id": u.property_id,
-        "created_at": u.created_at.isoformat(timespec="seconds") if u.created_at else None,
-        "updated_at": u.updated_at.isoformat(timespec="seconds") if u.updated_at else None,
-    }
-
-
-def _lease_payload(l: Lease):
-    return {
-        "id": l.id,
-        "unit_id": l.unit_id,
-        "tenant_id": l.tenant_id,
-        "start_date": l.start_date.isoformat() if l.start_date else None,
-        "end_date": l.end_date.isoformat() if l.end_date else None,
-        "status": l.status,
-        "property_id": l.unit.property_id if l.unit else None,
-        "created_at": l.created_at.isoformat(timespec="seconds") if l.created_at else None,
-        "updated_at": l.updated_at.isoformat(timespec="seconds") if l.updated_at else None,
-    }
-
-
-def _issue_payload(i: Issue):
-    return {
-        "id": i.id,
-        "title": i.title,
-        "description": i.description,
-        "status": i.status,
-        "priority": i.priority,
-        "reporter_id": i.reporter_id,
-        "assignee_id": i.assignee_id,
-        "property_id": i.property_id,
-        "unit_id": i.unit_id,
-        "created_at": i.created_at.isoformat(timespec="seconds") if i.created_at else None,
-        "updated_at": i.updated_at.isoformat(timespec="seconds") if i.updated_at else None,
-    }
-
-
-def _payment_payload(p: Payment):
-    return {
-        "id": p.id,
-        "lease_id": p.lease_id,
-        "method": p.method,
-        "amount": p.amount,
-        "status": p.status,
-        "reference": p.reference,
-        "mpesa_checkout_id": p.mpesa_checkout_id,
-        "created_at": p.created_at.isoformat(timespec="seconds") if p.created_at else None,
-        "updated_at": p.updated_at.isoformat(timespec="seconds") if p.updated_at else None,
-    }
-
-
-def create_token(user: User) -> str:
+def create_token(user: User, kind: str = "access", family: Optional[str] = None) -> str:
     """Generate a JWT compatible with the payload shape used in the Flask API."""
     now = datetime.utcnow()
+    lifetime = settings["JWT_REFRESH_TOKEN_EXPIRES" if kind == "refresh" else "JWT_ACCESS_TOKEN_EXPIRES"]
     payload = {
         "sub": {"id": user.id, "role": user.role},
         "iat": now,
-        "exp": now + timedelta(hours=12),
-        "type": "access",
-        "fresh": False,
+        "nbf": now,
+        "exp": now + lifetime,
+        "jti": uuid.uuid4().hex,
+        "type": kind,
+        "fam": family,
     }
+    if kind == "access":
+        payload["fresh"] = False
     return jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm="HS256")
 
 
-def get_identity(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+def issue_tokens(user: User, family: Optional[str] = None):
+    family = family or tokens.new_family()
+    return {"access_token": create_token(user, "access", family), "refresh_token": create_token(user, "refresh", family)}
+
+
+def decode_token(token: str, kind: str = "access"):
+    """Verify signature, expiry, token type and the revocation denylist (no DB round trip)."""
     try:
-        decoded = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"])
+        claims = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    ident = decoded.get("sub") or decoded.get("identity")
+    ident = claims.get("sub") or claims.get("identity")
     if not ident or "id" not in ident:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token payload")
-    return ident
+    if claims.get("type", "access") != kind:
+        # 422 like flask_jwt_extended's wrong-token-type response
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Only {kind} tokens are allowed")
+    if tokens.is_revoked(claims, get_engine()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    return claims
+
+
+def get_claims(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if "rentmg.claims" in request.scope:
+        return request.scope["rentmg.claims"]
+    claims = decode_token(credentials.credentials)
+    request.scope["rentmg.claims"] = claims
+    request.scope["rentmg.identity"] = claims.get("sub") or claims.get("identity")
+    return claims
+
+
+def get_identity(request: Request, claims=Depends(get_claims)):
+    return request.scope["rentmg.identity"]
+
+
+def enforce_limits(*hits):
+    retry_after = ratelimit.check(*hits)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="too many requests",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def shed(pool: str):
+    """Dependency that answers 503 while ``pool`` is saturated (see app/ratelimit.py)."""
+    def dependency():
+        try:
+            with ratelimit.POOLS[pool].admit():
+                yield
+        except ratelimit.Overloaded as exc:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="server busy, retry shortly",
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+    return dependency
 
 
 # ----------------------------
@@ -157,6 +178,10 @@ class LoginBody(BaseModel):
     password: str
 
 
+class RevokeBody(BaseModel):
+    user_id: Optional[int] = None
+
+
 class PropertyCreateBody(BaseModel):
     name: str
     address: str
@@ -176,6 +201,10 @@ class LeaseCreateBody(BaseModel):
     status: str = "active"
 
 
+class LeaseImportBody(BaseModel):
+    leases: List[LeaseCreateBody]
+
+
 class IssueCreateBody(BaseModel):
     title: str
     description: Optional[str] = None
@@ -198,11 +227,43 @@ class PaymentInitBody(BaseModel):
     phone: str
 
 
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+    body: Optional[Any] = None
+
+
+class BatchBody(BaseModel):
+    requests: List[BatchItem]
+
+
+class SamplerBody(BaseModel):
+    enabled: bool = True
+
+
+class TracemallocBody(BaseModel):
+    frames: int = 1
+
+
 # ----------------------------
 # FastAPI Application
 # ----------------------------
+class ProfiledRoute(APIRoute):
+    """Route whose endpoint runs under the request's profiler when ProfileMiddleware picked one."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiling.profiled(endpoint), **kwargs)
+
+
 app = FastAPI(title="RentMG FastAPI", version="1.0.0")
+app.router.route_class = ProfiledRoute
 
+app.add_middleware(
+    CompactResponseMiddleware,
+    min_size=Config.COMPRESS_MIN_SIZE,
+    level=Config.COMPRESS_LEVEL,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=Config.CORS_ORIGINS.split(","),
@@ -210,79 +271,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(profiling.ProfileMiddleware, decode_claims=lambda token: decode_token(token))
+
+
+@app.exception_handler(services.ServiceError)
+def service_error(request: Request, exc: services.ServiceError):
+    return JSONResponse({"detail": exc.body() if exc.extra else exc.message}, status_code=exc.status)
+
+
+@app.exception_handler(sharding.LandlordMoving)
+def landlord_moving(request: Request, exc: sharding.LandlordMoving):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": str(sharding.RETRY_AFTER_SECONDS)})
 
 
 # ----------------------------
 # Auth
 # ----------------------------
-@app.post("/api/auth/register")
-def register(payload: RegisterBody, db: Session = Depends(get_db)):
-    role = (payload.role or "tenant").lower()
-    if role not in ("tenant", "landlord", "property_manager"):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="role must be tenant, landlord, or property_manager")
-    property_name = (payload.property_name or "").strip()
-    property_address = (payload.property_address or "").strip()
-    if db.query(User).filter(User.email == payload.email).first():
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="email exists")
-
-    selected_property = None
-    if role == "tenant":
-        if not property_name:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="property_name required for tenant signup")
-        matches = db.query(Property).filter(func.lower(Property.name) == property_name.lower()).all()
-        if not matches:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="property not found")
-        if len(matches) > 1:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="multiple properties share that name; please provide a unique name")
-        selected_property = matches[0]
-    elif role == "landlord":
-        if not property_name:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="property_name required to create landlord profile")
-        if not property_address:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="property_address required to create landlord profile")
-
-    user = User(
-        email=payload.email,
-        password_hash=hash_password(payload.password),
-        role=role,
-        full_name=payload.full_name,
-        property_id=selected_property.id if selected_property else None,
+@app.post("/api/auth/register", status_code=status.HTTP_201_CREATED, dependencies=[Depends(shed("auth"))])
+def register(payload: RegisterBody, request: Request, db: Session = Depends(get_db)):
+    enforce_limits(("register:ip", request.client.host if request.client else None))
+    return services.register(db, payload.model_dump(), issue_tokens)
+
+
+@app.post("/api/auth/login", dependencies=[Depends(shed("auth"))])
+def login(payload: LoginBody, request: Request, db: Session = Depends(get_db)):
+    enforce_limits(
+        ("login:ip", request.client.host if request.client else None),
+        ("login:email", payload.email.lower()),
     )
-    db.add(user)
-    db.flush()  # populate user.id for property creation
-
-    if role == "landlord":
-        new_prop = Property(
-            name=property_name,
-            address=property_address or None,
-            landlord_id=user.id,
-        )
-        db.add(new_prop)
-        db.flush()
-        user.property_id = new_prop.id
-        selected_property = new_prop
+    return services.login(db, payload.email, payload.password, issue_tokens)
+
+
+@app.post("/api/auth/refresh")
+def refresh(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    return services.refresh(db, decode_token(credentials.credentials, "refresh"), issue_tokens)
 
-    db.commit()
-    db.refresh(user)
-    token = create_token(user)
-    return {"message": "registered", "access_token": token, "user": _user_payload(user)}
 
+@app.post("/api/auth/logout")
+def logout(claims=Depends(get_claims), db: Session = Depends(get_db)):
+    return services.logout(db, claims)
 
-@app.post("/api/auth/login")
-def login(payload: LoginBody, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(user.password_hash, payload.password):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid credentials")
-    token = create_token(user)
-    return {"access_token": token, "user": _user_payload(user)}
+
+@app.post("/api/auth/revoke")
+def revoke(payload: RevokeBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
+    return services.revoke_tokens(db, identity, payload.user_id)
 
 
 @app.get("/api/auth/me")
 def me(identity=Depends(get_identity), db: Session = Depends(get_db)):
-    user = db.query(User).get(identity["id"])
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return _user_payload(user)
+    return services.me(db, identity)
 
 
 @app.get("/")
@@ -298,6 +335,13 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics_snapshot(request: Request):
+    if not metrics.authorized(request.headers.get("authorization")):
+        raise services.Forbidden("metrics token required")
+    return metrics.snapshot()
+
+
 @app.get("/favicon.ico", status_code=204)
 def favicon():
     # Ignore browser favicon requests to silence 404 noise
@@ -319,31 +363,35 @@ def docs_info():
 # ----------------------------
 @app.get("/api/properties/")
 def list_properties(identity=Depends(get_identity), db: Session = Depends(get_db)):
-    q = db.query(Property)
-    if identity["role"] == "landlord":
-        q = q.filter(Property.landlord_id == identity["id"])
-    return [_property_payload(p) for p in q.all()]
+    return services.list_properties(db, identity)
+
+
+def occupancy_period(
+    on: Optional[str] = None,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+):
+    return on, start, end
+
+
+@app.get("/api/properties/occupancy")
+def portfolio_occupancy(period=Depends(occupancy_period), identity=Depends(get_identity), db: Session = Depends(get_db)):
+    return services.portfolio_occupancy(db, identity, *period)
+
 
+@app.get("/api/properties/{property_id}/occupancy")
+def property_occupancy(property_id: int, period=Depends(occupancy_period), identity=Depends(get_identity), db: Session = Depends(get_db)):
+    return services.property_occupancy(db, identity, property_id, *period)
 
-@app.get("/api/properties/{property_id}")
+
+@app.get("/api/properties/{property_id:int}")
 def get_property(property_id: int, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    prop = db.query(Property).get(property_id)
-    if not prop:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
-    if identity["role"] == "landlord" and prop.landlord_id != identity["id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="forbidden")
-    return _property_payload(prop)
+    return services.get_property(db, identity, property_id)
 
 
-@app.post("/api/properties/")
+@app.post("/api/properties/", status_code=status.HTTP_201_CREATED)
 def create_property(payload: PropertyCreateBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    if identity["role"] != "landlord":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="only landlord")
-    prop = Property(name=payload.name, address=payload.address, landlord_id=identity["id"])
-    db.add(prop)
-    db.commit()
-    db.refresh(prop)
-    return _property_payload(prop)
+    return services.create_property(db, identity, payload.model_dump())
 
 
 # ----------------------------
@@ -351,27 +399,17 @@ def create_property(payload: PropertyCreateBody, identity=Depends(get_identity),
 # ----------------------------
 @app.get("/api/units/by-property/{property_id}")
 def list_units(property_id: int, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    units = db.query(Unit).filter(Unit.property_id == property_id).all()
-    return [_unit_payload(u) for u in units]
+    return services.list_units(db, identity, property_id)
 
 
 @app.get("/api/units/{unit_id}")
 def get_unit(unit_id: int, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    unit = db.query(Unit).get(unit_id)
-    if not unit:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unit not found")
-    return _unit_payload(unit)
+    return services.get_unit(db, identity, unit_id)
 
 
-@app.post("/api/units/")
+@app.post("/api/units/", status_code=status.HTTP_201_CREATED)
 def create_unit(payload: UnitCreateBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    if identity["role"] != "landlord":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="only landlord")
-    unit = Unit(code=payload.code, rent_amount=int(payload.rent_amount), property_id=payload.property_id)
-    db.add(unit)
-    db.commit()
-    db.refresh(unit)
-    return _unit_payload(unit)
+    return services.create_unit(db, identity, payload.model_dump())
 
 
 # ----------------------------
@@ -379,37 +417,17 @@ def create_unit(payload: UnitCreateBody, identity=Depends(get_identity), db: Ses
 # ----------------------------
 @app.get("/api/leases/")
 def list_leases(identity=Depends(get_identity), db: Session = Depends(get_db)):
-    q = db.query(Lease)
-    if identity["role"] == "tenant":
-        q = q.filter(Lease.tenant_id == identity["id"])
-    leases = q.all()
-    return [_lease_payload(l) for l in leases]
+    return services.list_leases(db, identity)
 
 
-@app.post("/api/leases/")
+@app.post("/api/leases/", status_code=status.HTTP_201_CREATED)
 def create_lease(payload: LeaseCreateBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    if identity["role"] != "landlord":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="only landlord")
+    return services.create_lease(db, identity, payload.model_dump())
 
-    def parse_date(val: Optional[str]):
-        if not val:
-            return None
-        try:
-            return datetime.fromisoformat(val).date()
-        except ValueError:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid date format")
-
-    lease = Lease(
-        unit_id=payload.unit_id,
-        tenant_id=payload.tenant_id,
-        status=payload.status,
-        start_date=parse_date(payload.start_date),
-        end_date=parse_date(payload.end_date),
-    )
-    db.add(lease)
-    db.commit()
-    db.refresh(lease)
-    return _lease_payload(lease)
+
+@app.post("/api/leases/import", status_code=status.HTTP_201_CREATED)
+def import_lease_batch(payload: LeaseImportBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
+    return services.import_leases(db, identity, [row.model_dump() for row in payload.leases])
 
 
 # ----------------------------
@@ -417,113 +435,261 @@ def create_lease(payload: LeaseCreateBody, identity=Depends(get_identity), db: S
 # ----------------------------
 @app.get("/api/issues/")
 def list_issues(identity=Depends(get_identity), db: Session = Depends(get_db)):
-    q = db.query(Issue)
-    if identity["role"] == "tenant":
-        q = q.filter(Issue.reporter_id == identity["id"])
-    return [_issue_payload(i) for i in q.order_by(Issue.created_at.desc()).all()]
+    return services.list_issues(db, identity)
 
 
-@app.post("/api/issues/")
+@app.post("/api/issues/", status_code=status.HTTP_201_CREATED)
 def create_issue(payload: IssueCreateBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    issue = Issue(
-        title=payload.title,
-        description=payload.description,
-        reporter_id=identity["id"],
-        priority=payload.priority or "normal",
-        property_id=payload.property_id,
-        unit_id=payload.unit_id,
-    )
-    db.add(issue)
-    db.commit()
-    db.refresh(issue)
-    return _issue_payload(issue)
+    return services.create_issue(db, identity, payload.model_dump())
 
 
 @app.patch("/api/issues/{issue_id}")
 def update_issue(issue_id: int, payload: IssueUpdateBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    issue = db.query(Issue).get(issue_id)
-    if not issue:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Issue not found")
-    for field, value in payload.dict(exclude_none=True).items():
-        setattr(issue, field, value)
-    db.commit()
-    return {"message": "updated"}
+    return services.update_issue(db, identity, issue_id, payload.model_dump(exclude_unset=True))
 
 
 # ----------------------------
 # Payments
 # ----------------------------
-@app.post("/api/payments/mpesa/initiate")
+@app.post("/api/payments/mpesa/initiate", dependencies=[Depends(shed("payments"))])
 def mpesa_initiate(payload: PaymentInitBody, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    lease = db.query(Lease).get(payload.lease_id)
-    if not lease:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lease not found")
-    if identity["role"] == "tenant" and lease.tenant_id != identity["id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="not allowed")
+    enforce_limits(("mpesa:user", identity["id"]), ("mpesa:phone", payload.phone))
+    return services.mpesa_initiate(db, identity, payload.model_dump(), settings)
+
 
-    payment = Payment(lease_id=payload.lease_id, method="mpesa", amount=int(payload.amount), status="pending")
-    db.add(payment)
-    db.commit()
-    db.refresh(payment)
+@app.post("/api/payments/mpesa/callback")
+def mpesa_callback(payload: dict, db: Session = Depends(get_db)):
+    return services.mpesa_callback(db, payload)
 
+
+@app.get("/api/payments/{payment_id:int}")
+def get_payment(payment_id: int, identity=Depends(get_identity), db: Session = Depends(get_db)):
+    return services.get_payment(db, identity, payment_id)
+
+
+@app.get("/api/payments/{payment_id:int}/receipt")
+def payment_receipt(payment_id: int, request: Request, format: str = "pdf",
+                    identity=Depends(get_identity), db: Session = Depends(get_db)):
+    fmt = services.document_format(format)
+    return _document_response(services.payment_receipt(db, identity, payment_id), fmt, request)
+
+
+@app.get("/api/payments/history")
+def payment_history(
+    lease_id: Optional[int] = None,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    include_archived: bool = False,
+    identity=Depends(get_identity),
+    db: Session = Depends(get_db),
+):
+    return services.payment_history(db, identity, settings, lease_id=lease_id, start=start, end=end,
+                                    include_archived=include_archived)
+
+
+# ----------------------------
+# Statements
+# ----------------------------
+def _document_response(doc, fmt: str, request: Request):
+    """Serve a cached document with ETag / If-None-Match and single byte-range support."""
+    path, key = cached_document(doc, fmt, settings)
+    headers = {
+        "ETag": f'"{key}"',
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{download_name(doc, fmt)}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    size = os.path.getsize(path)
     try:
-        mpesa_resp = stk_push(phone=str(payload.phone), amount=int(payload.amount), account_reference=f"LEASE{payload.lease_id}")
-        payment.mpesa_checkout_id = mpesa_resp.get("CheckoutRequestID")
-        db.commit()
-    except Exception as exc:
-        payment.status = "failed"
-        db.commit()
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Mpesa initiation failed: {exc}")
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                        headers={**headers, "Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        body = fh.read(end - start + 1)
+    if byte_range is None:
+        return Response(body, media_type=FORMATS[fmt], headers=headers)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(body, status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=FORMATS[fmt], headers=headers)
+
+
+@app.get("/api/statements/tenant")
+def tenant_statement_document(request: Request, tenant_id: Optional[int] = None, month: Optional[str] = None,
+                              format: str = "pdf", identity=Depends(get_identity), db: Session = Depends(get_db)):
+    fmt = services.document_format(format)
+    return _document_response(services.tenant_statement(db, identity, tenant_id, month), fmt, request)
+
+
+@app.get("/api/statements/property/{property_id}")
+def property_statement_document(property_id: int, request: Request, month: Optional[str] = None, format: str = "pdf",
+                                identity=Depends(get_identity), db: Session = Depends(get_db)):
+    fmt = services.document_format(format)
+    return _document_response(services.property_statement(db, identity, property_id, month), fmt, request)
 
-    return {
-        "message": "Payment initiated",
-        "payment_id": payment.id,
-        "mpesa_checkout_id": payment.mpesa_checkout_id,
+
+# ----------------------------
+# Audit log
+# ----------------------------
+@app.get("/api/audit/")
+def list_audit_events(
+    entity: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    actor_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    identity=Depends(get_identity),
+    db: Session = Depends(get_db),
+):
+    return services.audit_events(db, identity, entity=entity, entity_id=entity_id, actor_id=actor_id,
+                                 since=since, until=until, after_id=after_id, limit=limit)
+
+
+# ----------------------------
+# Profiling
+# ----------------------------
+@app.get("/api/admin/profile/requests")
+def recent_profiles(identity=Depends(get_identity)):
+    return services.recent_profiles(identity)
+
+
+@app.get("/api/admin/profile/requests/{profile_id}", response_class=PlainTextResponse)
+def profile_report(profile_id: str, sort: str = "cumulative", limit: int = 50, identity=Depends(get_identity)):
+    return services.profile_report(identity, profile_id, sort, limit)
+
+
+@app.get("/api/admin/profile/flamegraph", response_class=PlainTextResponse)
+def flamegraph(seconds: Optional[int] = None, identity=Depends(get_identity)):
+    return services.flamegraph(identity, seconds)
+
+
+@app.post("/api/admin/profile/sampler")
+def set_sampler(payload: SamplerBody = SamplerBody(), identity=Depends(get_identity)):
+    return services.set_sampler(identity, payload.enabled)
+
+
+@app.post("/api/admin/profile/tracemalloc")
+def start_tracemalloc(payload: TracemallocBody = TracemallocBody(), identity=Depends(get_identity)):
+    return services.start_tracemalloc(identity, payload.frames)
+
+
+@app.get("/api/admin/profile/tracemalloc")
+def tracemalloc_report(limit: int = 25, path: Optional[str] = None, identity=Depends(get_identity)):
+    return services.tracemalloc_report(identity, limit, path)
+
+
+@app.delete("/api/admin/profile/tracemalloc")
+def stop_tracemalloc(identity=Depends(get_identity)):
+    return services.stop_tracemalloc(identity)
+
+
+# ----------------------------
+# Batch
+# ----------------------------
+BATCH_MAX_REQUESTS = 20
+BATCH_READ_CONCURRENCY = 4
+
+
+async def _dispatch(request: Request, item: BatchItem, extra_scope: dict):
+    """Run one sub-request through the app's own routing and capture the response."""
+    path, _, query = item.path.partition("?")
+    body = b"" if item.body is None else json.dumps(item.body).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    auth = request.headers.get("authorization")
+    if auth:
+        headers.append((b"authorization", auth.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": item.method.upper(),
+        "scheme": request.url.scheme,
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": headers,
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+        **extra_scope,
     }
+    sent = False
 
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
 
-@app.post("/api/payments/mpesa/callback")
-def mpesa_callback(payload: dict, db: Session = Depends(get_db)):
-    result_code = payload.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-    checkout_id = payload.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-    if checkout_id:
-        payment = db.query(Payment).filter(Payment.mpesa_checkout_id == checkout_id).first()
-        if payment:
-            payment.status = "completed" if result_code == 0 else "failed"
-            if result_code == 0:
-                try:
-                    payment.reference = next(
-                        i["Value"]
-                        for i in payload["Body"]["stkCallback"]["CallbackMetadata"]["Item"]
-                        if i["Name"] == "MpesaReceiptNumber"
-                    )
-                except Exception:
-                    payment.reference = payment.reference
-            db.commit()
-    return {"ResultCode": 0, "ResultDesc": "Accepted"}
-
-
-@app.get("/api/payments/{payment_id}")
-def get_payment(payment_id: int, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    q = db.query(Payment).join(Lease, Payment.lease_id == Lease.id)
-    if identity["role"] == "tenant":
-        q = q.filter(Lease.tenant_id == identity["id"])
-    elif identity["role"] == "landlord":
-        q = q.join(Unit, Lease.unit_id == Unit.id).join(Property, Unit.property_id == Property.id).filter(Property.landlord_id == identity["id"])
-    payment = q.filter(Payment.id == payment_id).first()
-    if not payment:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
-    return _payment_payload(payment)
+    result = {"status": 500, "body": b""}
 
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            result["body"] += message.get("body", b"")
 
-@app.get("/api/payments/history")
-def payment_history(lease_id: Optional[int] = None, identity=Depends(get_identity), db: Session = Depends(get_db)):
-    q = db.query(Payment).join(Lease, Payment.lease_id == Lease.id)
-    if identity["role"] == "tenant":
-        q = q.filter(Lease.tenant_id == identity["id"])
-    elif identity["role"] == "landlord":
-        q = q.join(Unit, Lease.unit_id == Unit.id).join(Property, Unit.property_id == Property.id).filter(Property.landlord_id == identity["id"])
-    if lease_id:
-        q = q.filter(Payment.lease_id == lease_id)
-    payments = q.order_by(Payment.created_at.desc()).all()
-    return [_payment_payload(p) for p in payments]
+    try:
+        await app(scope, receive, send)
+    except Exception as exc:
+        return {"id": item.id, "status": 500, "body": {"detail": str(exc)}}
+    try:
+        parsed = json.loads(result["body"]) if result["body"] else None
+    except ValueError:
+        parsed = result["body"].decode(errors="replace")
+    return {"id": item.id, "status": result["status"], "body": parsed}
+
+
+@app.post("/api/batch")
+async def batch(payload: BatchBody, request: Request, claims=Depends(get_claims)):
+    """Execute several API calls in one round trip.
+
+    The token is decoded once and shared by every sub-request. Writes run in
+    order on one shared session, rolled back after any that fails with a
+    5xx. Runs of consecutive GETs between them run concurrently, each on a
+    pooled session of its own, because a single Session cannot be used from
+    several threads at once. Results come back in request order.
+    """
+    items = payload.requests
+    if len(items) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"at most {BATCH_MAX_REQUESTS} requests per batch")
+    for item in items:
+        if not item.path.startswith("/api/") or item.path.startswith("/api/batch"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"unsupported batch path: {item.path}")
+
+    get_engine()
+    session = SessionLocal()
+    session.info["request_scope"] = request.scope
+    limit = asyncio.Semaphore(BATCH_READ_CONCURRENCY)
+    shared = {"rentmg.claims": claims, "rentmg.identity": request.scope["rentmg.identity"]}
+
+    async def read(item):
+        async with limit:
+            return await _dispatch(request, item, shared)
+
+    results = []
+    try:
+        i = 0
+        while i < len(items):
+            if items[i].method.upper() == "GET":
+                j = i
+                while j < len(items) and items[j].method.upper() == "GET":
+                    j += 1
+                results.extend(await asyncio.gather(*(read(item) for item in items[i:j])))
+                i = j
+            else:
+                result = await _dispatch(request, items[i], {**shared, "rentmg.db": session})
+                if result["status"] >= 500:
+                    # A write that died mid-transaction leaves the shared session unusable for the next one
+                    await run_in_threadpool(session.rollback)
+                results.append(result)
+                i += 1
+    finally:
+        await run_in_threadpool(session.close)
+    metrics.observe("batch.size", len(items))
+    return {"responses": results}
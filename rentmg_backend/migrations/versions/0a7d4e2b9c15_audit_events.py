@@ -0,0 +1,37 @@
+"""append-only audit_events table
+
+Revision ID: 0a7d4e2b9c15
+Revises: f3a8c61d0e47
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0a7d4e2b9c15"
+down_revision = "f3a8c61d0e47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "audit_events",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), primary_key=True),
+        sa.Column("at", sa.DateTime(), nullable=False),
+        sa.Column("actor_id", sa.Integer(), nullable=True),
+        sa.Column("entity", sa.String(length=32), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=True),
+        sa.Column("action", sa.String(length=1), nullable=False),
+        sa.Column("changes", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_audit_events_at", "audit_events", ["at"])
+    op.create_index("ix_audit_events_entity", "audit_events", ["entity", "entity_id", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_audit_events_entity", table_name="audit_events")
+    op.drop_index("ix_audit_events_at", table_name="audit_events")
+    op.drop_table("audit_events")
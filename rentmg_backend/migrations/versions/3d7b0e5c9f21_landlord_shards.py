@@ -0,0 +1,32 @@
+"""landlord_shards map for routing landlords to database shards
+
+Revision ID: 3d7b0e5c9f21
+Revises: 9c4f1d2e7a38
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3d7b0e5c9f21"
+down_revision = "9c4f1d2e7a38"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "landlord_shards",
+        sa.Column("landlord_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True, autoincrement=False),
+        sa.Column("shard", sa.String(length=32), nullable=False),
+        sa.Column("moving", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_landlord_shards_shard", "landlord_shards", ["shard"])
+
+
+def downgrade():
+    op.drop_index("ix_landlord_shards_shard", table_name="landlord_shards")
+    op.drop_table("landlord_shards")
@@ -0,0 +1,56 @@
+"""payments_archive table for settled payments from closed years
+
+Revision ID: 5b2e9f7c3a64
+Revises: 0a7d4e2b9c15
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b2e9f7c3a64"
+down_revision = "0a7d4e2b9c15"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("id, created_at, updated_at, lease_id, method, amount, status, reference, "
+           "mpesa_checkout_id, property_id, landlord_id")
+# Same rule as app/archive.py with the default PAYMENT_ARCHIVE_KEEP_YEARS=1
+CLOSED = "created_at < :boundary AND status IN ('completed', 'failed')"
+
+
+def upgrade():
+    op.create_table(
+        "payments_archive",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("lease_id", sa.Integer(), nullable=False),
+        sa.Column("method", sa.String(length=20), nullable=True),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=True),
+        sa.Column("reference", sa.String(length=64), nullable=True),
+        sa.Column("mpesa_checkout_id", sa.String(length=64), nullable=True),
+        sa.Column("property_id", sa.Integer(), nullable=True),
+        sa.Column("landlord_id", sa.Integer(), nullable=True),
+        mysql_row_format="COMPRESSED",
+    )
+    op.create_index("ix_payments_archive_landlord_created", "payments_archive", ["landlord_id", "created_at"])
+    op.create_index("ix_payments_archive_lease_created", "payments_archive", ["lease_id", "created_at"])
+
+    boundary = date(date.today().year - 1, 1, 1)
+    bind = op.get_bind()
+    bind.execute(sa.text(f"INSERT INTO payments_archive ({COLUMNS}) SELECT {COLUMNS} FROM payments WHERE {CLOSED}"),
+                 {"boundary": boundary})
+    bind.execute(sa.text(f"DELETE FROM payments WHERE {CLOSED}"), {"boundary": boundary})
+
+
+def downgrade():
+    op.execute(f"INSERT INTO payments ({COLUMNS}) SELECT {COLUMNS} FROM payments_archive")
+    op.drop_index("ix_payments_archive_lease_created", table_name="payments_archive")
+    op.drop_index("ix_payments_archive_landlord_created", table_name="payments_archive")
+    op.drop_table("payments_archive")
@@ -0,0 +1,42 @@
+"""denormalize property_id/landlord_id on leases and payments
+
+Revision ID: 7d1f3a9c5e21
+Revises: 4c2b0e4c4dcb
+Create Date: 2026-10-19 00:00:00.000000
+
+Existing rows are filled in by `flask backfill-owners`, which runs in bounded
+batches instead of one long table-locking UPDATE.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7d1f3a9c5e21"
+down_revision = "4c2b0e4c4dcb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ("leases", "payments"):
+        op.add_column(table, sa.Column("property_id", sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column("landlord_id", sa.Integer(), nullable=True))
+        op.create_foreign_key(f"fk_{table}_property", table, "properties", ["property_id"], ["id"])
+        op.create_foreign_key(f"fk_{table}_landlord", table, "users", ["landlord_id"], ["id"])
+    op.create_index("ix_leases_property_id", "leases", ["property_id"])
+    op.create_index("ix_leases_landlord_id", "leases", ["landlord_id"])
+    op.create_index("ix_payments_landlord_created", "payments", ["landlord_id", "created_at"])
+    op.create_index("ix_payments_property_created", "payments", ["property_id", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_payments_property_created", table_name="payments")
+    op.drop_index("ix_payments_landlord_created", table_name="payments")
+    op.drop_index("ix_leases_landlord_id", table_name="leases")
+    op.drop_index("ix_leases_property_id", table_name="leases")
+    for table in ("payments", "leases"):
+        op.drop_constraint(f"fk_{table}_landlord", table, type_="foreignkey")
+        op.drop_constraint(f"fk_{table}_property", table, type_="foreignkey")
+        op.drop_column(table, "landlord_id")
+        op.drop_column(table, "property_id")
@@ -0,0 +1,23 @@
+"""index payments_archive by property for statements of archived months
+
+Revision ID: 8e4a1c6f2b90
+Revises: 3d7b0e5c9f21
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "8e4a1c6f2b90"
+down_revision = "3d7b0e5c9f21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_payments_archive_property_created", "payments_archive", ["property_id", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_payments_archive_property_created", table_name="payments_archive")
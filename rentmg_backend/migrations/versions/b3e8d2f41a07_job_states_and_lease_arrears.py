@@ -0,0 +1,41 @@
+"""job state table and lease arrears flag
+
+Revision ID: b3e8d2f41a07
+Revises: 7d1f3a9c5e21
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b3e8d2f41a07"
+down_revision = "7d1f3a9c5e21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "job_states",
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("last_started_at", sa.DateTime(), nullable=True),
+        sa.Column("last_finished_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("last_processed", sa.Integer(), nullable=True),
+        sa.Column("run_count", sa.Integer(), nullable=True),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.add_column("leases", sa.Column("in_arrears", sa.Boolean(), nullable=False, server_default=sa.false()))
+    # Supports the batched scans in app/jobs.py
+    op.create_index("ix_leases_status_end_date", "leases", ["status", "end_date"])
+    op.create_index("ix_payments_status_created", "payments", ["status", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_payments_status_created", table_name="payments")
+    op.drop_index("ix_leases_status_end_date", table_name="leases")
+    op.drop_column("leases", "in_arrears")
+    op.drop_table("job_states")
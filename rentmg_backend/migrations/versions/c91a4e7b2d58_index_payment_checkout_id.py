@@ -0,0 +1,23 @@
+"""index payments.mpesa_checkout_id
+
+Revision ID: c91a4e7b2d58
+Revises: b3e8d2f41a07
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c91a4e7b2d58"
+down_revision = "b3e8d2f41a07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_payments_mpesa_checkout_id", "payments", ["mpesa_checkout_id"])
+
+
+def downgrade():
+    op.drop_index("ix_payments_mpesa_checkout_id", table_name="payments")
@@ -0,0 +1,27 @@
+"""normalized, indexed property name for tenant signup lookups
+
+Revision ID: e52c7f0a9b13
+Revises: c91a4e7b2d58
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e52c7f0a9b13"
+down_revision = "c91a4e7b2d58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("properties", sa.Column("name_normalized", sa.String(length=120), nullable=True))
+    op.execute("UPDATE properties SET name_normalized = LOWER(TRIM(name))")
+    op.create_index("ix_properties_name_normalized", "properties", ["name_normalized"])
+
+
+def downgrade():
+    op.drop_index("ix_properties_name_normalized", table_name="properties")
+    op.drop_column("properties", "name_normalized")
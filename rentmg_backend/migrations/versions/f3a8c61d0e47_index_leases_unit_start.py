@@ -0,0 +1,23 @@
+"""index leases by (unit_id, start_date) for overlap checks
+
+Revision ID: f3a8c61d0e47
+Revises: e52c7f0a9b13
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "f3a8c61d0e47"
+down_revision = "e52c7f0a9b13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_leases_unit_start", "leases", ["unit_id", "start_date"])
+
+
+def downgrade():
+    op.drop_index("ix_leases_unit_start", table_name="leases")
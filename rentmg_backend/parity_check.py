@@ -0,0 +1,271 @@
+"""Check that the Flask and FastAPI stacks answer the same requests identically.
+
+Usage:
+    python parity_check.py
+    python parity_check.py --verbose
+
+Each stack gets its own throwaway SQLite database. The same scripted session
+(signup, properties, units, leases, imports, issues, occupancy, payments,
+statements, audit) is replayed against both. For every request the script
+compares three things: the status code, the JSON body, and the number of SQL
+statements issued. Before comparing bodies it masks tokens and timestamps, and
+reads FastAPI's ``{"detail": ...}`` error envelope as Flask's
+``{"error": ...}``. Scope, occupancy and entity caches are cleared before each
+request, so both stacks start from the same state. Steps in ``FASTAPI_ONLY``
+(``/api/batch``) run on FastAPI alone, for plan_check's sake. Exits non-zero
+on any mismatch.
+"""
+import argparse
+import os
+import tempfile
+import threading
+
+MASKED_KEYS = {"access_token", "refresh_token", "created_at", "updated_at", "at"}
+BACKGROUND_THREADS = {"audit-writer", "token-denylist", "notifier"}
+SEED_PAYMENT_BEFORE = "mpesa callback"
+
+# (label, stack-independent request). Paths and bodies may use {placeholders}
+# filled from earlier responses; "save" stores response fields under new names.
+STEPS = [
+    ("register landlord", "POST", "/api/auth/register", None, {
+        "email": "l1@example.com", "password": "pw", "role": "landlord",
+        "property_name": "Alpha Court", "property_address": "1 Alpha Rd"}, {"L1": "access_token", "P1": "user.property_id"}),
+    ("register landlord 2", "POST", "/api/auth/register", None, {
+        "email": "l2@example.com", "password": "pw", "role": "landlord",
+        "property_name": "Beta Court", "property_address": "2 Beta Rd"}, {"L2": "access_token"}),
+    ("register tenant", "POST", "/api/auth/register", None, {
+        "email": "t1@example.com", "password": "pw", "role": "tenant", "property_name": "alpha court"},
+        {"T1": "access_token", "T1_ID": "user.id"}),
+    ("register duplicate email", "POST", "/api/auth/register", None, {
+        "email": "t1@example.com", "password": "pw", "role": "tenant", "property_name": "Alpha Court"}, {}),
+    ("register unknown property", "POST", "/api/auth/register", None, {
+        "email": "t9@example.com", "password": "pw", "role": "tenant", "property_name": "Nowhere"}, {}),
+    ("register bad role", "POST", "/api/auth/register", None, {
+        "email": "x@example.com", "password": "pw", "role": "admin"}, {}),
+    ("login", "POST", "/api/auth/login", None, {"email": "l1@example.com", "password": "pw"},
+        {"L1_REFRESH": "refresh_token"}),
+    ("login wrong password", "POST", "/api/auth/login", None, {"email": "l1@example.com", "password": "nope"}, {}),
+    ("me", "GET", "/api/auth/me", "T1", None, {}),
+    ("refresh with access token", "POST", "/api/auth/refresh", "L1", None, {}),
+    ("refresh", "POST", "/api/auth/refresh", "L1_REFRESH", None, {"L1_NEXT": "access_token"}),
+    ("reuse refresh token", "POST", "/api/auth/refresh", "L1_REFRESH", None, {}),
+    ("logout", "POST", "/api/auth/logout", "L1_NEXT", None, {}),
+    ("use logged-out token", "GET", "/api/auth/me", "L1_NEXT", None, {}),
+    ("revoke other user's tokens", "POST", "/api/auth/revoke", "T1", {"user_id": 1}, {}),
+    ("list properties", "GET", "/api/properties/", "L1", None, {}),
+    ("get foreign property", "GET", "/api/properties/{P1}", "L2", None, {}),
+    ("get missing property", "GET", "/api/properties/999", "L1", None, {}),
+    ("create property", "POST", "/api/properties/", "L1", {"name": "Gamma Court", "address": "3 Gamma Rd"}, {}),
+    ("tenant creates property", "POST", "/api/properties/", "T1", {"name": "Nope", "address": "x"}, {}),
+    ("create unit", "POST", "/api/units/", "L1", {"code": "A1", "rent_amount": 1000, "property_id": "{P1}"}, {"U1": "id"}),
+    ("create unit 2", "POST", "/api/units/", "L1", {"code": "A2", "rent_amount": 1200, "property_id": "{P1}"}, {"U2": "id"}),
+    ("create unit on foreign property", "POST", "/api/units/", "L2", {"code": "B1", "rent_amount": 1, "property_id": "{P1}"}, {}),
+    ("list units", "GET", "/api/units/by-property/{P1}", "L1", None, {}),
+    ("get unit", "GET", "/api/units/{U1}", "T1", None, {}),
+    ("get missing unit", "GET", "/api/units/999", "T1", None, {}),
+    ("create lease", "POST", "/api/leases/", "L1", {
+        "unit_id": "{U1}", "tenant_id": "{T1_ID}", "start_date": "2026-01-01", "end_date": "2026-12-31"}, {"LE1": "id"}),
+    ("overlapping lease", "POST", "/api/leases/", "L1", {
+        "unit_id": "{U1}", "tenant_id": "{T1_ID}", "start_date": "2026-06-01", "end_date": "2027-05-31"}, {}),
+    ("lease ending before start", "POST", "/api/leases/", "L1", {
+        "unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2026-06-01", "end_date": "2026-01-01"}, {}),
+    ("import leases", "POST", "/api/leases/import", "L1", {"leases": [
+        {"unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2025-01-01", "end_date": "2025-06-30"},
+        {"unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2025-07-01", "end_date": "2025-12-31"}]}, {}),
+    ("import overlapping leases", "POST", "/api/leases/import", "L1", {"leases": [
+        {"unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2027-01-01", "end_date": "2027-06-30"},
+        {"unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2027-03-01", "end_date": "2027-12-31"}]}, {}),
+    ("import onto foreign units", "POST", "/api/leases/import", "L2", {"leases": [
+        {"unit_id": "{U1}", "tenant_id": "{T1_ID}", "start_date": "2030-01-01"}]}, {}),
+    ("landlord leases", "GET", "/api/leases/", "L1", None, {}),
+    ("other landlord leases", "GET", "/api/leases/", "L2", None, {}),
+    ("tenant leases", "GET", "/api/leases/", "T1", None, {}),
+    ("create issue", "POST", "/api/issues/", "T1", {"title": "Leak", "property_id": "{P1}", "unit_id": "{U1}"}, {"I1": "id"}),
+    ("issue without title", "POST", "/api/issues/", "T1", {"title": ""}, {}),
+    ("landlord issues", "GET", "/api/issues/", "L1", None, {}),
+    ("other landlord issues", "GET", "/api/issues/", "L2", None, {}),
+    ("update foreign issue", "PATCH", "/api/issues/{I1}", "L2", {"status": "closed"}, {}),
+    ("update issue", "PATCH", "/api/issues/{I1}", "L1", {"status": "in_progress", "assignee_id": "{T1_ID}"}, {}),
+    ("portfolio occupancy", "GET", "/api/properties/occupancy?on=2026-03-01", "L1", None, {}),
+    ("property occupancy", "GET", "/api/properties/{P1}/occupancy?from=2025-01-01&to=2025-12-31", "L1", None, {}),
+    ("tenant occupancy", "GET", "/api/properties/occupancy", "T1", None, {}),
+    ("bad occupancy date", "GET", "/api/properties/{P1}/occupancy?on=soon", "L1", None, {}),
+    ("pay foreign lease", "POST", "/api/payments/mpesa/initiate", "L2", {"lease_id": 999, "amount": 10, "phone": "254700000000"}, {}),
+    ("mpesa callback", "POST", "/api/payments/mpesa/callback", None, {"Body": {"stkCallback": {
+        "ResultCode": 0, "CheckoutRequestID": "ws_CO_parity",
+        "CallbackMetadata": {"Item": [{"Name": "MpesaReceiptNumber", "Value": "QX1"}]}}}}, {}),
+    ("get payment", "GET", "/api/payments/{PAY1}", "T1", None, {}),
+    ("get foreign payment", "GET", "/api/payments/{PAY1}", "L2", None, {}),
+    ("payment history", "GET", "/api/payments/history?from=2020-01-01", "L1", None, {}),
+    ("bad history range", "GET", "/api/payments/history?from=yesterday", "L1", None, {}),
+    ("receipt", "GET", "/api/payments/{PAY1}/receipt?format=csv", "T1", None, {}),
+    ("tenant statement", "GET", "/api/statements/tenant?month=2026-01&format=csv", "T1", None, {}),
+    ("property statement bad format", "GET", "/api/statements/property/{P1}?format=xls", "L1", None, {}),
+    ("audit without entity", "GET", "/api/audit/", "T1", None, {}),
+    ("lease audit trail", "GET", "/api/audit/?entity=leases&entity_id={LE1}", "T1", None, {}),
+    ("profiles as tenant", "GET", "/api/admin/profile/requests", "T1", None, {}),
+    # Last, so its writes (on one stack only) cannot change what later steps compare
+    ("batch", "POST", "/api/batch", "L1", {"requests": [
+        {"id": "units", "path": "/api/units/by-property/{P1}"},
+        {"id": "unit", "method": "POST", "path": "/api/units/", "body": {"code": "A3", "rent_amount": 900, "property_id": "{P1}"}},
+        {"id": "bad lease", "method": "POST", "path": "/api/leases/", "body": {
+            "unit_id": "{U2}", "tenant_id": "{T1_ID}", "start_date": "2026-06-01", "end_date": "2026-01-01"}}]}, {}),
+]
+# Routes only FastAPI serves: replayed there alone and left out of the comparison
+FASTAPI_ONLY = {"batch"}
+
+
+def _fill(value, names):
+    if isinstance(value, str) and value.startswith("{") and value.endswith("}") and value[1:-1] in names:
+        return names[value[1:-1]]
+    if isinstance(value, str):
+        return value.format(**names)
+    if isinstance(value, dict):
+        return {k: _fill(v, names) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, names) for v in value]
+    return value
+
+
+def _lookup(body, dotted):
+    for key in dotted.split("."):
+        body = body[key]
+    return body
+
+
+def _mask(value):
+    if isinstance(value, dict):
+        return {k: "<masked>" if k in MASKED_KEYS and v is not None else _mask(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_mask(v) for v in value]
+    return value
+
+
+class Stack:
+    """One API under test: a request function, its engine and the names captured so far."""
+
+    def __init__(self, name, send, engine):
+        self.name, self.send, self.engine, self.names = name, send, engine, {}
+        self.statements = [0]
+
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count(*_):
+            if threading.current_thread().name not in BACKGROUND_THREADS:
+                self.statements[0] += 1
+
+    def seed_payment(self):
+        """Insert a pending M-Pesa payment directly; initiating one would call Daraja."""
+        from sqlalchemy.orm import Session
+        from app.models import Lease, Payment
+
+        with Session(self.engine) as session:
+            lease = session.get(Lease, self.names["LE1"])
+            payment = Payment(lease_id=lease.id, method="mpesa", amount=1000, status="pending",
+                              mpesa_checkout_id="ws_CO_parity", property_id=lease.property_id,
+                              landlord_id=lease.landlord_id)
+            session.add(payment)
+            session.commit()
+            self.names["PAY1"] = payment.id
+
+    def run(self, method, path, token, body):
+        from app import audit, cache, occupancy, scoping
+
+        audit.writer.flush()
+        scoping.invalidate_scope()
+        occupancy.index.invalidate()
+        cache.cache.clear()
+        headers = {"Authorization": f"Bearer {self.names[token]}"} if token else {}
+        self.statements[0] = 0
+        status, content_type, payload = self.send(method, _fill(path, self.names), headers, _fill(body, self.names))
+        return status, content_type, payload, self.statements[0]
+
+
+def _flask_stack(uri):
+    os.environ["SQLALCHEMY_DATABASE_URI"] = uri
+    from app import create_app, tokens
+    from app.extensions import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        engine = db.engine
+    tokens.denylist.start(engine)  # initial load happens once per process; keep it out of the counts
+    client = app.test_client()
+
+    def send(method, path, headers, body):
+        resp = client.open(path, method=method, headers=headers, json=body)
+        payload = resp.get_json(silent=True)
+        if isinstance(payload, dict) and set(payload) == {"msg"}:  # flask_jwt_extended errors
+            payload = {"error": payload["msg"]}
+        return resp.status_code, resp.mimetype, payload
+
+    return Stack("flask", send, engine)
+
+
+def _fastapi_stack(uri):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    import fastapi_app
+    from app.models import db
+
+    engine = create_engine(uri)
+    db.metadata.create_all(engine)
+    fastapi_app.use_engine(engine)
+    client = TestClient(fastapi_app.app)
+
+    def send(method, path, headers, body):
+        resp = client.request(method, path, headers=headers, json=body)
+        content_type = resp.headers.get("content-type", "").split(";")[0]
+        payload = resp.json() if content_type == "application/json" else None
+        if isinstance(payload, dict) and set(payload) == {"detail"}:
+            detail = payload["detail"]
+            payload = detail if isinstance(detail, dict) else {"error": detail}
+        return resp.status_code, content_type, payload
+
+    return Stack("fastapi", send, engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="print every request, not only mismatches")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ.setdefault("STATEMENT_CACHE_DIR", os.path.join(workdir, "statements"))
+    flask = _flask_stack(f"sqlite:///{os.path.join(workdir, 'flask.db')}")
+    fastapi = _fastapi_stack(f"sqlite:///{os.path.join(workdir, 'fastapi.db')}")
+
+    mismatches = 0
+    for label, method, path, token, body, save in STEPS:
+        if label == SEED_PAYMENT_BEFORE:
+            flask.seed_payment()
+            fastapi.seed_payment()
+        results = {}
+        for stack in (fastapi,) if label in FASTAPI_ONLY else (flask, fastapi):
+            status, content_type, payload, statements = stack.run(method, path, token, body)
+            if 200 <= status < 300:
+                for name, field in save.items():
+                    stack.names[name] = _lookup(payload, field)
+            results[stack.name] = (status, content_type, _mask(payload), statements)
+        same = label in FASTAPI_ONLY or results["flask"] == results["fastapi"]
+        mismatches += not same
+        if args.verbose or not same:
+            status, _, _, statements = next(iter(results.values()))
+            print(f"{'ok  ' if same else 'DIFF'} {label}: {method} {path} -> {status}, {statements} statement(s)")
+        if not same:
+            for name, (status, content_type, payload, statements) in results.items():
+                print(f"     {name}: {status} {content_type} statements={statements} body={payload}")
+
+    from app import audit
+
+    audit.writer.flush()
+    compared = len(STEPS) - len(FASTAPI_ONLY)
+    print(f"{compared - mismatches}/{compared} requests identical on both stacks")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Check landlord sharding end to end on a primary and three SQLite shard files.
+
+Usage:
+    python shard_check.py
+
+Runs the Flask stack with ``SHARD_URIS`` pointing at three shard files next
+to the primary. First it replays the scripted session from
+``parity_check.py``. Every step must answer with the status that
+``query_plans.json`` recorded for the unsharded stack, except where
+``SHARDED_STATUS`` says otherwise. Then it checks that:
+
+* each new landlord's rows are on their mapped shard, with ids in that shard's range;
+* a property manager sees the properties, issues and payments of every shard;
+* the FastAPI stack, sharing the same databases, answers the same;
+* jobs visit every shard;
+* a landlord being moved gets 503;
+* moving a landlord (also one still on the primary) keeps their data and ids and empties the source.
+
+Exits non-zero on any failure.
+"""
+import json
+import os
+import tempfile
+
+from parity_check import FASTAPI_ONLY, SEED_PAYMENT_BEFORE, STEPS, _flask_stack, _lookup, _mask
+
+SHARDS = ("s1", "s2", "s3")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+# Another landlord's records live on their own shard, so they are missing here rather than forbidden
+SHARDED_STATUS = {"get foreign property": 404, "create unit on foreign property": 404}
+
+failures = []
+
+
+def check(ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def _seed_payment(stack):
+    """parity_check's seed, written through a routing session so it lands on the lease's shard."""
+    from sqlalchemy import select
+    from app import sharding
+    from app.models import Lease, Payment
+
+    with sharding.RoutingSession(bind=stack.engine) as session:
+        sharding.pin_row(session, select(Lease.id).where(Lease.id == stack.names["LE1"]))
+        lease = session.get(Lease, stack.names["LE1"])
+        payment = Payment(lease_id=lease.id, method="mpesa", amount=1000, status="pending",
+                          mpesa_checkout_id="ws_CO_parity", property_id=lease.property_id,
+                          landlord_id=lease.landlord_id)
+        session.add(payment)
+        session.commit()
+        stack.names["PAY1"] = payment.id
+
+
+def _owned(engine, landlord_id):
+    """{shard: property ids of ``landlord_id``} over every database."""
+    from sqlalchemy import select
+    from app import sharding
+    from app.models import Property
+
+    owned = {}
+    for name in sharding.names():
+        with sharding.engine_for(name, engine).connect() as conn:
+            ids = conn.execute(select(Property.id).where(Property.landlord_id == landlord_id)).scalars().all()
+        if ids:
+            owned[name] = ids
+    return owned
+
+
+def _mapped(engine):
+    from sqlalchemy import select
+    from app.models import LandlordShard
+
+    with engine.connect() as conn:
+        return dict(conn.execute(select(LandlordShard.landlord_id, LandlordShard.shard)).all())
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ.setdefault("STATEMENT_CACHE_DIR", os.path.join(workdir, "statements"))
+    os.environ["SHARD_URIS"] = ",".join(f"{name}=sqlite:///{os.path.join(workdir, name + '.db')}" for name in SHARDS)
+    os.environ["SHARD_MAP_TTL"] = "0"  # moves in this script need no wait for map caches
+
+    stack = _flask_stack(f"sqlite:///{os.path.join(workdir, 'primary.db')}")
+    stack.seed_payment = lambda: _seed_payment(stack)
+    from app import sharding
+
+    for index, name in enumerate(sharding.names()):
+        if name != sharding.PRIMARY:
+            sharding.create_schema(sharding.engine_for(name, stack.engine), index)
+    engine = stack.engine
+
+    with open(BASELINE) as fh:
+        expected = json.load(fh)["sqlite"]["flask"]
+    mismatched = []
+    for label, method, path, token, body, save in STEPS:
+        if label in FASTAPI_ONLY:
+            continue
+        if label == SEED_PAYMENT_BEFORE:
+            stack.seed_payment()
+        status, _, payload, _ = stack.run(method, path, token, body)
+        if 200 <= status < 300:
+            for name, field in save.items():
+                stack.names[name] = _lookup(payload, field)
+        want = SHARDED_STATUS.get(label, expected[label]["status"])
+        if status != want:
+            mismatched.append(f"{label}: {status}, expected {want}")
+    check(not mismatched, f"{len(STEPS) - len(FASTAPI_ONLY)} parity steps answer as on one database" +
+          "".join(f"\n       {line}" for line in mismatched))
+
+    def call(method, path, token=None, body=None):
+        status, _, payload, _ = stack.run(method, path, token, body)
+        return status, payload
+
+    # Placement: every landlord registered above has a map entry and their rows on that shard only
+    mapped = _mapped(engine)
+    placed = True
+    for landlord_id, shard in mapped.items():
+        owned = _owned(engine, landlord_id)
+        index = sharding.names().index(shard)
+        in_range = all(index * sharding.SHARD_ID_SPAN < pk <= (index + 1) * sharding.SHARD_ID_SPAN
+                       for pk in owned.get(shard, []))
+        placed &= list(owned) == [shard] and in_range
+    check(len(mapped) == 2 and placed and len(set(mapped.values())) == 2,
+          f"new landlords spread over shards with shard-range ids: {mapped}")
+
+    # Property manager fan-out
+    status, body = call("POST", "/api/auth/register", None, {"email": "pm@example.com", "password": "pw",
+                                                             "role": "property_manager"})
+    stack.names["PM"] = body["access_token"]
+    status, properties = call("GET", "/api/properties/", "PM")
+    check(status == 200 and len(properties) == 3, f"property manager lists properties of all shards ({len(properties)})")
+    l1_id = next(p["landlord_id"] for p in properties if p["id"] == stack.names["P1"])
+    l2_id = next(landlord for landlord in mapped if landlord != l1_id)
+    status, issues = call("GET", "/api/issues/", "PM")
+    check(status == 200 and [i["id"] for i in issues] == [stack.names["I1"]], "property manager lists issues")
+    status, history = call("GET", "/api/payments/history?from=2020-01-01", "PM")
+    check(status == 200 and [p["id"] for p in history] == [stack.names["PAY1"]], "property manager payment history")
+    status, payment = call("GET", "/api/payments/{PAY1}", "PM")
+    check(status == 200 and payment["status"] == "completed", "property manager reads a payment on its shard")
+    status, _ = call("GET", "/api/properties/{P1}", "PM")
+    check(status == 200, "property manager reads a property on its shard")
+    status, _ = call("PATCH", "/api/issues/{I1}", "PM", {"priority": "high"})
+    check(status == 200, "property manager updates an issue on its shard")
+    status, _ = call("GET", "/api/statements/property/{P1}?month=2026-01&format=csv", "PM")
+    check(status == 200, "property manager property statement")
+
+    # Same answers from FastAPI on the same databases
+    import fastapi_app
+    from fastapi.testclient import TestClient
+
+    fastapi_app.use_engine(engine)
+    client = TestClient(fastapi_app.app)
+    same = []
+    for token in ("L1", "T1", "PM"):
+        for path in ("/api/properties/", "/api/leases/", "/api/issues/", "/api/payments/history?from=2020-01-01"):
+            _, flask_body = call("GET", path, token)
+            resp = client.get(path, headers={"Authorization": f"Bearer {stack.names[token]}"})
+            same.append(_mask(resp.json()) == _mask(flask_body))
+    check(all(same), f"FastAPI answers {sum(same)}/{len(same)} sharded reads like Flask")
+
+    # Jobs run on every shard
+    from app.jobs import run_job
+    from app.models import LandlordShard
+    from sqlalchemy import update
+
+    _, unit = call("POST", "/api/units/", "L2", {"code": "B1", "rent_amount": 900,
+                                                "property_id": _owned(engine, l2_id)[mapped[l2_id]][0]})
+    stack.names["UB1"] = unit["id"]
+    call("POST", "/api/leases/", "L2", {"unit_id": unit["id"], "tenant_id": stack.names["T1_ID"],
+                                        "start_date": "2020-01-01", "end_date": "2020-12-31"})
+    call("POST", "/api/leases/", "L1", {"unit_id": stack.names["U2"], "tenant_id": stack.names["T1_ID"],
+                                        "start_date": "2019-01-01", "end_date": "2019-12-31"})
+    with sharding.RoutingSession(bind=engine) as session:
+        processed = run_job(session, fastapi_app.settings, "expire_leases", force=True)
+    _, leases = call("GET", "/api/leases/", "PM")
+    ended = {lease["property_id"] for lease in leases if lease["status"] == "ended"}
+    check(processed == 4 and len(ended) == 2, f"expire_leases ended {processed} leases on {len(ended)} shards")
+
+    # A landlord being moved gets 503
+    with engine.begin() as conn:
+        conn.execute(update(LandlordShard).where(LandlordShard.landlord_id == l2_id).values(moving=True))
+    sharding.reset_cache()
+    status, _ = call("GET", "/api/properties/", "L2")
+    resp = client.get("/api/properties/", headers={"Authorization": f"Bearer {stack.names['L2']}"})
+    check(status == 503 and resp.status_code == 503 and resp.headers.get("Retry-After"),
+          f"moving landlord gets 503 from both stacks ({status}, {resp.status_code})")
+    with engine.begin() as conn:
+        conn.execute(update(LandlordShard).where(LandlordShard.landlord_id == l2_id).values(moving=False))
+
+    # Move landlord 1 to the last shard, with tenants, leases, payments and issues
+    source = mapped[l1_id]
+    before = {(token, path): call("GET", path, token)
+              for token in ("L1", "T1") for path in ("/api/properties/", "/api/leases/", "/api/issues/",
+                                                     "/api/payments/history?from=2020-01-01", "/api/auth/me")}
+    moved = sharding.move_landlord(engine, l1_id, SHARDS[-1], pause=0, echo=lambda message: None)
+    after = {key: call("GET", key[1], key[0]) for key in before}
+    check(_mapped(engine)[l1_id] == SHARDS[-1] and list(_owned(engine, l1_id)) == [SHARDS[-1]],
+          f"landlord {l1_id} moved {source} -> {SHARDS[-1]}: {moved}")
+    check(before == after, "landlord and tenant see the same data, same ids, after the move")
+    check(call("GET", "/api/payments/{PAY1}", "PM")[0] == 200, "property manager finds the moved payment")
+    try:
+        sharding.move_landlord(engine, l1_id, SHARDS[0], pause=0)
+        check(False, "moving back to an earlier shard is refused")
+    except ValueError:
+        check(True, "moving back to an earlier shard is refused")
+
+    # A landlord from before sharding, with no map entry, lives on the primary and can move off it
+    from datetime import datetime
+    from sqlalchemy import insert
+    from app.models import Property, User
+
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        legacy_id = conn.execute(insert(User).values(email="legacy@example.com", password_hash="x",
+                                                     role="landlord", created_at=now, updated_at=now)).inserted_primary_key[0]
+        conn.execute(insert(Property).values(name="Legacy Court", name_normalized="legacy court",
+                                             landlord_id=legacy_id, created_at=now, updated_at=now))
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+
+    with create_app().app_context():
+        stack.names["LEGACY"] = create_access_token(identity={"id": legacy_id, "role": "landlord"})
+    _, legacy_before = call("GET", "/api/properties/", "LEGACY")
+    sharding.move_landlord(engine, legacy_id, SHARDS[0], pause=0, echo=lambda message: None)
+    _, legacy_after = call("GET", "/api/properties/", "LEGACY")
+    check(len(legacy_before) == 1 and legacy_before == legacy_after
+          and list(_owned(engine, legacy_id)) == [SHARDS[0]], "legacy landlord moved off the primary")
+
+    for name, landlords, held in sharding.status(engine):
+        print(f"     {name}: {landlords} landlords mapped, {held} properties")
+    print(f"{len(failures)} failure(s)")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()